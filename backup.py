@@ -3,13 +3,16 @@ from fastapi.responses import RedirectResponse, StreamingResponse
 from pathlib import Path
 import tempfile
 import time
-import vercel_blob
 import httpx
 from dotenv import load_dotenv
 import os
 
+from storage import create_backend
+
 load_dotenv()
 
+storage = create_backend()
+
 
 token = os.getenv("BLOB_READ_WRITE_TOKEN")
 print(f"Token loaded: {'Yes' if token else 'No'}")
@@ -38,15 +41,11 @@ async def upload_file(file: UploadFile = File(...)):
         with tmp_path.open("rb") as f:
             content = f.read()
 
-        resp = vercel_blob.put(
-            blob_name,
-            content,
-            options={"add_random_suffix": False},
-        )
+        blob = storage.put(blob_name, content)
 
         return {
             "filename": blob_name,
-            "url": resp["url"],
+            "url": blob["url"],
             "status": "uploaded",
         }
 
@@ -79,16 +78,11 @@ async def upload_binary(request: Request):
         safe_name = Path(filename).name
         blob_name = f"{timestamp}_{safe_name}"
         
-        # Upload to Vercel Blob
-        resp = vercel_blob.put(
-            blob_name,
-            content,
-            options={"add_random_suffix": False},
-        )
+        blob = storage.put(blob_name, content)
         
         return {
             "filename": blob_name,
-            "url": resp["url"],
+            "url": blob["url"],
             "status": "uploaded",
             "size": len(content),
             "method": "binary-get"
@@ -0,0 +1,213 @@
+"""A stand-in for the Vercel Blob API, for benchmarks that must not touch
+the network.
+
+Implements what blob_api.BlobApi and the app use: put, copy, multipart upload,
+paginated list, delete and GET/HEAD of blob URLs with a single Range.
+Blobs live in memory. --latency delays every call and --bandwidth caps
+the transfer rate of request and response bodies, to make the fake look
+like a remote store. --error-rate fails that fraction of calls with a 503,
+like a store that is struggling (POST /_faults?error_rate=... changes it
+while running). GET /_stats returns per-operation call counts.
+
+    python bench/fake_blob_server.py --port 9100 --latency 0.02 --bandwidth 50 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+import uvicorn
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class FakeBlobStore:
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth  # bytes per second, None for unlimited
+        self.error_rate = error_rate
+        self.base_url = None  # set before serving; blob URLs point here
+        self.blobs = {}
+        self.uploads = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    async def delay(self, op):
+        self.calls[op] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.calls[f"{op}_failed"] += 1
+            raise HTTPException(status_code=503, detail="Injected failure")
+
+    async def read_body(self, request):
+        # Pace the upload so a slow store pushes back on the app
+        body = bytearray()
+        started = time.monotonic()
+        async for chunk in request.stream():
+            body += chunk
+            if self.bandwidth:
+                ahead = len(body) / self.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        return bytes(body)
+
+    def meta(self, pathname):
+        data, uploaded_at = self.blobs[pathname]
+        url = f"{self.base_url}/b/{quote(pathname)}"
+        return {"url": url, "downloadUrl": f"{url}?download=1", "pathname": pathname,
+                "size": len(data), "uploadedAt": uploaded_at}
+
+    def store(self, pathname, data):
+        uploaded_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        with self._lock:
+            self.blobs[pathname] = (data, uploaded_at)
+        blob = self.meta(pathname)
+        blob["contentType"] = "application/octet-stream"
+        blob["contentDisposition"] = f'attachment; filename="{pathname}"'
+        return blob
+
+
+def create_app(store: FakeBlobStore):
+    app = FastAPI()
+
+    @app.get("/_stats")
+    def stats():
+        return {"calls": dict(store.calls), "blobs": len(store.blobs),
+                "bytes": sum(len(d) for d, _ in store.blobs.values())}
+
+    @app.post("/_stats/reset")
+    def reset_stats():
+        store.calls.clear()
+        return {"status": "reset"}
+
+    @app.post("/_faults")
+    def set_faults(error_rate: float = 0.0):
+        store.error_rate = error_rate
+        return {"errorRate": store.error_rate}
+
+    @app.get("/")
+    async def list_blobs(limit: int = 1000, prefix: str = "", cursor: str = ""):
+        await store.delay("list")
+        with store._lock:
+            names = sorted(p for p in store.blobs if p.startswith(prefix) and p > cursor)
+        page = names[:limit]
+        has_more = len(names) > limit
+        return {"blobs": [store.meta(p) for p in page], "cursor": page[-1] if has_more else None,
+                "hasMore": has_more}
+
+    @app.put("/")
+    async def put(pathname: str, request: Request, fromUrl: str = None):
+        if fromUrl is not None:
+            # copy: the source bytes never leave the store
+            await store.delay("copy")
+            prefix = f"{store.base_url}/b/"
+            entry = store.blobs.get(unquote(fromUrl[len(prefix):])) if fromUrl.startswith(prefix) else None
+            if entry is None:
+                raise HTTPException(status_code=404, detail="Blob not found")
+            return store.store(pathname, entry[0])
+        data = await store.read_body(request)
+        await store.delay("put")
+        return store.store(pathname, data)
+
+    @app.post("/mpu")
+    async def multipart(pathname: str, request: Request):
+        action = request.headers.get("x-mpu-action")
+        if action == "create":
+            await store.delay("mpu_create")
+            upload_id = uuid.uuid4().hex
+            store.uploads[upload_id] = {}
+            return {"uploadId": upload_id, "key": pathname}
+
+        upload = store.uploads.get(request.headers.get("x-mpu-upload-id"))
+        if upload is None:
+            raise HTTPException(status_code=404, detail="Unknown upload")
+        if action == "upload":
+            part_number = int(request.headers["x-mpu-part-number"])
+            upload[part_number] = await store.read_body(request)
+            await store.delay("mpu_part")
+            return {"etag": f'"{part_number}-{len(upload[part_number])}"'}
+        if action == "complete":
+            parts = await request.json()
+            await store.delay("mpu_complete")
+            data = b"".join(upload[p["partNumber"]] for p in sorted(parts, key=lambda p: p["partNumber"]))
+            del store.uploads[request.headers["x-mpu-upload-id"]]
+            return store.store(pathname, data)
+        raise HTTPException(status_code=400, detail=f"Unknown action {action}")
+
+    @app.post("/delete")
+    async def delete(request: Request):
+        urls = (await request.json()).get("urls", [])
+        await store.delay("delete")
+        prefix = f"{store.base_url}/b/"
+        with store._lock:
+            for url in urls:
+                if url.startswith(prefix):
+                    store.blobs.pop(unquote(url[len(prefix):]), None)
+        return {}
+
+    @app.api_route("/b/{pathname:path}", methods=["GET", "HEAD"])
+    async def get_blob(pathname: str, request: Request):
+        entry = store.blobs.get(pathname)
+        if entry is None:
+            await store.delay("get_missing")
+            raise HTTPException(status_code=404, detail="Blob not found")
+        data = entry[0]
+        start, end, status = 0, len(data) - 1, 200
+        spec = request.headers.get("range", "")
+        if spec.startswith("bytes=") and "," not in spec:
+            first, _, last = spec[6:].partition("-")
+            if first:
+                start, end = int(first), min(int(last) if last else end, end)
+            elif last:
+                start = max(len(data) - int(last), 0)
+            if start > end:
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+            status = 206
+
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start + 1)}
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        if request.method == "HEAD":
+            await store.delay("head")
+            return Response(status_code=200, headers=headers)
+
+        await store.delay("get")
+
+        async def body():
+            view = memoryview(data)
+            for pos in range(start, end + 1, STREAM_CHUNK_SIZE):
+                chunk = view[pos:min(pos + STREAM_CHUNK_SIZE, end + 1)]
+                if store.bandwidth:
+                    await asyncio.sleep(len(chunk) / store.bandwidth)
+                yield bytes(chunk)
+
+        return StreamingResponse(body(), status_code=status, headers=headers,
+                                 media_type="application/octet-stream")
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an in-memory fake of the Vercel Blob API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="MB/s cap on bodies (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failed with a 503")
+    args = parser.parse_args(argv)
+
+    store = FakeBlobStore(args.latency, args.bandwidth * 1024 * 1024 or None, args.error_rate)
+    store.base_url = f"http://{args.host}:{args.port}"
+    uvicorn.run(create_app(store), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,574 @@
+"""End-to-end benchmark of the app against a local blob store.
+
+Starts bench/fake_blob_server.py (unless --backend is local or memory) and
+the app under uvicorn in a scratch TMPDIR, then drives each scenario at
+the given concurrency for every file size:
+
+    pupload         PUT /pupload (streamed multipart upload)
+    upload          PUT /upload/{name} (raw body)
+    test1           the base64 /test1 chunk protocol
+    sessions        the binary /sessions chunk protocol
+    ingest          POST /ingest of a tar of INGEST_BATCH distinct files
+    download        GET /download?filename=...
+    latest          GET /latest
+    latest_partial  GET /latest/partial
+    archive         GET /archive?files=...&format=tar of the seeded file
+
+For each run it reports throughput, p50/p99 latency, the app's peak RSS
+and CPU time per GB moved, and the calls the fake store saw, and writes them as JSON so two commits
+can be compared:
+
+    python bench/run_bench.py --sizes 1MB,32MB --concurrency 8 --output before.json
+    python bench/run_bench.py --sizes 1MB,32MB --concurrency 8 --compare before.json
+
+Transport compression is measured on CSV-like data over a capped client
+link; throughput counts content bytes, "wire%" what crossed the link:
+
+    python bench/run_bench.py --data text --link-bandwidth 20 --output raw.json
+    python bench/run_bench.py --data text --link-bandwidth 20 --encoding zstd --compare raw.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("pupload", "upload", "test1", "sessions", "ingest", "download", "latest", "latest_partial", "archive")
+UPLOAD_SCENARIOS = ("pupload", "upload", "test1", "sessions", "ingest")
+TEST1_CHUNK_SIZE = 1024 * 1024
+SESSION_CHUNK_SIZE = 8 * 1024 * 1024
+INGEST_BATCH = 100
+INGEST_MAX_ITEM_BYTES = 8 * 1024 * 1024  # the app's default; --env INGEST_MAX_ITEM_BYTES=... changes both
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    for suffix, factor in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10), ("B", 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
+
+
+def format_size(size):
+    for suffix, factor in (("GB", 1 << 30), ("MB", 1 << 20), ("KB", 1 << 10)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{suffix}"
+    return f"{size}B"
+
+
+def text_data(size):
+    """CSV-like log lines, about as compressible as the real payloads."""
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = b"%d,user%d,2026-10-18T10:%02d:%02d,GET,/api/v1/items/%d,200,%d\n" % (
+            i, i % 997, i // 60 % 60, i % 60, i % 5003, i * 7919 % 100000)
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b"".join(lines)[:size]
+
+
+class Link:
+    """A client link of `mbps` shared by all requests: each transfer waits
+    for its turn on the wire."""
+
+    def __init__(self, mbps):
+        self.rate = mbps * (1 << 20)
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def transfer(self, nbytes):
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(now, self._next) + nbytes / self.rate
+            wait = self._next - now
+        time.sleep(wait)
+
+
+class Transport:
+    """How the bench client talks to the app: the Content-Encoding it sends
+    and accepts, whether chunks carry a checksum, and the optional capped
+    link. Counts bytes on the wire."""
+
+    def __init__(self, encoding=None, link=None, checksums=False):
+        self.encoding = encoding
+        self.link = link
+        self.checksums = checksums
+        self.wire = 0
+        self._lock = threading.Lock()
+
+    def _count(self, nbytes):
+        with self._lock:
+            self.wire += nbytes
+        if self.link is not None:
+            self.link.transfer(nbytes)
+
+    def send(self, data, encode=False):
+        """(body, headers) for an upload of `data`, after it crossed the link."""
+        headers = {}
+        if encode and self.encoding:
+            if self.encoding == "zstd":
+                data = zstandard.ZstdCompressor(level=3).compress(data)
+            else:
+                c = zlib.compressobj(6, zlib.DEFLATED, 31)
+                data = c.compress(data) + c.flush()
+            headers["Content-Encoding"] = self.encoding
+        self._count(len(data))
+        return data, headers
+
+    def checksum(self, data):
+        """The chunk checksum the clients send, or None when off."""
+        return f"crc32={zlib.crc32(data):08x}" if self.checksums else None
+
+    def accept(self):
+        return {"Accept-Encoding": self.encoding or "identity"}
+
+    def drain(self, r):
+        """Content bytes of a streamed response, decoded here."""
+        r.raise_for_status()
+        encoding = r.headers.get("Content-Encoding")
+        if encoding == "zstd":
+            decoder = zstandard.ZstdDecompressor().decompressobj()
+        elif encoding == "gzip":
+            decoder = zlib.decompressobj(31)
+        else:
+            decoder = None
+        total = 0
+        for raw in r.raw.stream(READ_CHUNK_SIZE, decode_content=False):
+            self._count(len(raw))
+            total += len(decoder.decompress(raw)) if decoder is not None else len(raw)
+        return total
+
+
+transport = Transport()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(args, env, health_url, timeout=30):
+    """Start a server process and wait until `health_url` answers."""
+    proc = subprocess.Popen(args, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{args[-1]} exited: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if requests.get(health_url, timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{health_url} did not come up within {timeout}s")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class RssSampler:
+    """Peak resident set size of a process, sampled from /proc (Linux only)."""
+
+    def __init__(self, pid, interval=0.05):
+        self.path = f"/proc/{pid}/status"
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+
+    def _run(self):
+        while True:
+            rss = self._sample()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def cpu_seconds(pid):
+    """User plus system CPU time of a process so far (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_pupload(session, base_url, data, name):
+    transport.send(data)
+    r = session.put(f"{base_url}/pupload", files={"file": (name, data)}, timeout=300)
+    r.raise_for_status()
+    return len(data)
+
+
+def run_upload(session, base_url, data, name):
+    body, headers = transport.send(data, encode=True)
+    r = session.put(f"{base_url}/upload/{name}", data=body, headers=headers, timeout=300)
+    r.raise_for_status()
+    return len(data)
+
+
+def wait_job(session, base_url, r):
+    # Finalizing runs as a server-side job; the upload is done when it is
+    r.raise_for_status()
+    job = r.json()
+    while "jobId" in job and job.get("status") not in ("completed", "failed"):
+        job = session.get(f"{base_url}/jobs/{job['jobId']}", params={"wait": 30}, timeout=60).json()
+    if job.get("status") == "failed":
+        raise RuntimeError(f"finalize failed: {job.get('error')}")
+
+
+def run_test1(session, base_url, data, name):
+    chunks = [data[i:i + TEST1_CHUNK_SIZE] for i in range(0, len(data), TEST1_CHUNK_SIZE)] or [b""]
+    for i, chunk in enumerate(chunks):
+        encoded, _ = transport.send(base64.b64encode(chunk))
+        r = session.post(f"{base_url}/test1", json={
+            "data": encoded.decode(),
+            "chunkNumber": i,
+            "totalChunks": len(chunks),
+            "fileName": name,
+            "isStarted": i == 0,
+            "isCompleted": i == len(chunks) - 1,
+            "checksum": transport.checksum(chunk),
+        }, timeout=300)
+        r.raise_for_status()
+    wait_job(session, base_url, r)
+    return len(data)
+
+
+def run_sessions(session, base_url, data, name):
+    total = max(1, -(-len(data) // SESSION_CHUNK_SIZE))
+    r = session.post(f"{base_url}/sessions", json={
+        "fileName": name, "totalChunks": total, "chunkSize": SESSION_CHUNK_SIZE, "fileSize": len(data),
+    }, timeout=30)
+    r.raise_for_status()
+    session_id = r.json()["sessionId"]
+    for i in range(total):
+        chunk = data[i * SESSION_CHUNK_SIZE:(i + 1) * SESSION_CHUNK_SIZE]
+        body, headers = transport.send(chunk, encode=True)
+        if transport.checksums:
+            headers["X-Chunk-Checksum"] = transport.checksum(chunk)
+        r = session.put(f"{base_url}/sessions/{session_id}/chunks/{i}", data=body, headers=headers, timeout=300)
+        r.raise_for_status()
+    r = session.post(f"{base_url}/sessions/{session_id}/commit", timeout=300)
+    wait_job(session, base_url, r)
+    return len(data)
+
+
+def run_ingest(session, base_url, data, name):
+    # Each file gets a distinct prefix so content addressing cannot fold them
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for i in range(INGEST_BATCH):
+            body = f"{name}:{i}:".encode() + data
+            info = tarfile.TarInfo(f"{name}_{i}")
+            info.size = len(body)
+            tar.addfile(info, io.BytesIO(body))
+    body, headers = transport.send(buf.getvalue(), encode=True)
+    r = session.post(f"{base_url}/ingest", data=body,
+                     headers={"Content-Type": "application/x-tar", **headers}, timeout=300)
+    r.raise_for_status()
+    # A 200 can still carry per-file failures, e.g. items over the size limit
+    result = r.json()
+    if result.get("failed"):
+        failures = [f for f in result.get("files", []) if f.get("status") != "uploaded"]
+        raise RuntimeError(f"ingest: {result['failed']} of {INGEST_BATCH} files failed, first: {failures[:1]}")
+    return len(data) * INGEST_BATCH
+
+
+def run_download(session, base_url, data, name):
+    with session.get(f"{base_url}/download", params={"filename": name}, headers=transport.accept(),
+                     stream=True, timeout=300) as r:
+        return transport.drain(r)
+
+
+def run_latest(session, base_url, data, name):
+    with session.get(f"{base_url}/latest", headers=transport.accept(), stream=True, timeout=300) as r:
+        return transport.drain(r)
+
+
+def run_latest_partial(session, base_url, data, name):
+    with session.get(f"{base_url}/latest/partial", headers=transport.accept(), stream=True, timeout=300) as r:
+        return transport.drain(r)
+
+
+def run_archive(session, base_url, data, name):
+    with session.get(f"{base_url}/archive", params={"files": name, "format": "tar"}, headers=transport.accept(),
+                     stream=True, timeout=300) as r:
+        return transport.drain(r)
+
+
+RUNNERS = {
+    "pupload": run_pupload,
+    "upload": run_upload,
+    "test1": run_test1,
+    "sessions": run_sessions,
+    "ingest": run_ingest,
+    "download": run_download,
+    "latest": run_latest,
+    "latest_partial": run_latest_partial,
+    "archive": run_archive,
+}
+
+
+def store_calls(fake_url):
+    if not fake_url:
+        return {}
+    return requests.get(f"{fake_url}/_stats", timeout=10).json()["calls"]
+
+
+def run_scenario(scenario, base_url, fake_url, app_pid, data, size, requests_per_run, concurrency, run_id):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    runner = RUNNERS[scenario]
+    latencies, errors = [], []
+    transferred = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal transferred
+        # Uploads get their own name each; downloads read the seeded file
+        name = f"bench_{run_id}_{scenario}_{i}.bin" if scenario in UPLOAD_SCENARIOS else f"bench_{run_id}.bin"
+        started = time.perf_counter()
+        try:
+            nbytes = runner(session, base_url, data, name)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            transferred += nbytes
+
+    before = store_calls(fake_url)
+    wire_before = transport.wire
+    cpu_before = cpu_seconds(app_pid)
+    with RssSampler(app_pid) as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests_per_run)))
+        elapsed = time.perf_counter() - started
+    after = store_calls(fake_url)
+    cpu_after = cpu_seconds(app_pid)
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    session.close()
+
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    return {
+        "scenario": scenario,
+        "size": size,
+        "requests": requests_per_run,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_mbps": round(transferred / elapsed / (1 << 20), 2) if elapsed else None,
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+        "peak_rss_mb": round(rss.peak / (1 << 20), 1) if rss.peak else None,
+        "cpu_s": round(cpu, 3) if cpu is not None else None,
+        "cpu_s_per_gb": round(cpu / (transferred / (1 << 30)), 3) if cpu is not None and transferred else None,
+        "wire_pct": round((transport.wire - wire_before) / transferred * 100, 1) if transferred else None,
+        "upstream_calls": {op: after.get(op, 0) - before.get(op, 0)
+                           for op in sorted(set(after) | set(before)) if after.get(op, 0) != before.get(op, 0)},
+    }
+
+
+def print_table(results, baseline=None):
+    base = {(r["scenario"], r["size"]): r for r in (baseline or {}).get("results", [])}
+    print(f"\n{'scenario':<16}{'size':>8}{'MB/s':>10}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'RSS MB':>9}{'CPU s/GB':>10}{'wire%':>7}{'err':>5}  upstream calls")
+    for r in results:
+        line = (f"{r['scenario']:<16}{format_size(r['size']):>8}{r['throughput_mbps'] or 0:>10.2f}"
+                f"{r['requests_per_s'] or 0:>9.2f}{r['p50_ms'] or 0:>10.1f}{r['p99_ms'] or 0:>10.1f}"
+                f"{r['peak_rss_mb'] or 0:>9.1f}{r['cpu_s_per_gb'] or 0:>10.2f}{r.get('wire_pct') or 0:>7.1f}{r['errors']:>5}  "
+                + " ".join(f"{op}={n}" for op, n in r["upstream_calls"].items()))
+        print(line)
+        old = base.get((r["scenario"], r["size"]))
+        if old and old.get("throughput_mbps") and r["throughput_mbps"] and old.get("p99_ms") and r["p99_ms"]:
+            print(f"{'':<16}{'vs base':>8}{(r['throughput_mbps'] / old['throughput_mbps'] - 1) * 100:>+9.1f}%"
+                  f"{'':>9}{'':>10}{(r['p99_ms'] / old['p99_ms'] - 1) * 100:>+9.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app end to end against a local blob store.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--sizes", default="1MB,16MB", help="comma-separated file sizes, e.g. 256KB,4MB,64MB")
+    parser.add_argument("--requests", type=int, default=16, help="requests per scenario and size")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--backend", default="vercel", choices=("vercel", "local", "memory"),
+                        help="storage backend; vercel runs against the fake blob server")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake store: seconds added to every call")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="fake store: MB/s cap (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake store: fraction of calls failed with a 503")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--data", default="random", choices=("random", "text"), help="file contents")
+    parser.add_argument("--encoding", choices=("gzip", "zstd"),
+                        help="Content-Encoding for uploads and Accept-Encoding for downloads (default: none)")
+    parser.add_argument("--checksums", action="store_true", help="send a CRC32 with every test1 and sessions chunk")
+    parser.add_argument("--link-bandwidth", type=float, default=0.0, help="client link: MB/s cap (0 = unlimited)")
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    if args.encoding == "zstd" and zstandard is None:
+        parser.error("--encoding zstd needs the zstandard package")
+    transport.encoding = args.encoding
+    transport.link = Link(args.link_bandwidth) if args.link_bandwidth else None
+    transport.checksums = args.checksums
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    env = {**os.environ, "TMPDIR": workdir, "STORAGE_BACKEND": args.backend,
+           "BLOB_READ_WRITE_TOKEN": "vercel_blob_rw_bench_fake", "PYTHONUNBUFFERED": "1"}
+    if args.encoding:
+        # Downloads are only compressed on the fly when the app is told to
+        env["COMPRESS_RESPONSES"] = "1"
+    env.update(item.split("=", 1) for item in args.env)
+    ingest_limit = int(env.get("INGEST_MAX_ITEM_BYTES", INGEST_MAX_ITEM_BYTES))
+    processes = []
+    fake_url = None
+    try:
+        if args.backend == "vercel":
+            port = free_port()
+            fake_url = f"http://127.0.0.1:{port}"
+            processes.append(start(
+                [sys.executable, "bench/fake_blob_server.py", "--port", str(port),
+                 "--latency", str(args.latency), "--bandwidth", str(args.bandwidth),
+                 "--error-rate", str(args.error_rate)],
+                env, f"{fake_url}/_stats",
+            ))
+            env["BLOB_API_URL"] = fake_url
+
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        app = start(
+            [sys.executable, "-m", "uvicorn", "--port", str(port), "--log-level", "warning", "main:app"],
+            env, f"{base_url}/health",
+        )
+        processes.append(app)
+
+        results = []
+        for size in sizes:
+            data = text_data(size) if args.data == "text" else os.urandom(size)
+            run_id = f"{format_size(size)}_{int(time.time())}"
+            for scenario in scenarios:
+                if scenario not in UPLOAD_SCENARIOS:
+                    continue
+                # Each tar item is the data plus a short name prefix
+                if scenario == "ingest" and size + 64 > ingest_limit:
+                    print(f"ingest {format_size(size)}: skipped, over INGEST_MAX_ITEM_BYTES ({format_size(ingest_limit)})")
+                    continue
+                print(f"{scenario} {format_size(size)} x{args.requests} @{args.concurrency}...")
+                results.append(run_scenario(scenario, base_url, fake_url, app.pid, data, size,
+                                            args.requests, args.concurrency, run_id))
+            if any(s not in UPLOAD_SCENARIOS for s in scenarios):
+                # The file every download scenario reads, and the latest one
+                with requests.Session() as session:
+                    run_pupload(session, base_url, data, f"bench_{run_id}.bin")
+            for scenario in scenarios:
+                if scenario in UPLOAD_SCENARIOS:
+                    continue
+                print(f"{scenario} {format_size(size)} x{args.requests} @{args.concurrency}...")
+                results.append(run_scenario(scenario, base_url, fake_url, app.pid, data, size,
+                                            args.requests, args.concurrency, run_id))
+
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {
+                "backend": args.backend, "latency": args.latency, "bandwidth_mbps": args.bandwidth,
+                "error_rate": args.error_rate,
+                "requests": args.requests, "concurrency": args.concurrency, "env": args.env,
+                "data": args.data, "encoding": args.encoding, "link_bandwidth_mbps": args.link_bandwidth,
+                "checksums": args.checksums,
+            },
+            "results": results,
+        }
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""Cold-start benchmark of the app.
+
+Measures, over several fresh processes in a scratch TMPDIR:
+
+    import      wall time of `python -c "import main"`, and the cumulative
+                import time of main as reported by -X importtime
+    health      time from spawning uvicorn to the first 200 from /health
+
+and lists the modules that cost the most to import. With a budget given,
+it exits 1 when the median goes over it, so cold start can be held to a
+budget in CI:
+
+    python bench/startup_bench.py --runs 5 --budget-import-ms 600 --budget-health-ms 1500
+    python bench/startup_bench.py --output before.json
+    python bench/startup_bench.py --compare before.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from run_bench import REPO_DIR, free_port, git_commit
+
+
+def import_times(env):
+    """(wall ms, main's cumulative import ms, {module: cumulative ms})."""
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                          cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    wall = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main failed: {proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if cumulative.isdigit():
+            modules[name] = int(cumulative) / 1000
+    return wall, modules.get("main"), modules
+
+
+def time_to_health(env, timeout=30):
+    """ms from spawning uvicorn until /health answers 200."""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--port", str(port), "--log-level", "warning", "main:app"],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        with requests.Session() as session:
+            while time.perf_counter() - started < timeout:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+                try:
+                    if session.get(url, timeout=1).status_code == 200:
+                        return (time.perf_counter() - started) * 1000
+                except requests.RequestException:
+                    pass
+                time.sleep(0.005)
+        raise RuntimeError(f"{url} did not come up within {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def summary(values):
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+def print_report(report, baseline=None, top=10):
+    rows = [("import (wall)", "import_wall_ms"), ("import main", "import_main_ms"), ("first /health", "health_ms")]
+    print(f"\n{'':16}{'median':>10}{'min':>10}{'max':>10}" + (f"{'before':>10}{'change':>9}" if baseline else ""))
+    for label, key in rows:
+        s = report[key]
+        line = f"{label:16}{s['median']:>8.1f}ms{s['min']:>8.1f}ms{s['max']:>8.1f}ms"
+        if baseline and key in baseline:
+            before = baseline[key]["median"]
+            line += f"{before:>8.1f}ms{(s['median'] - before) / before * 100:>+8.0f}%"
+        print(line)
+    print("\nSlowest imports (cumulative, last run):")
+    for name, ms in report["slowest_imports"][:top]:
+        print(f"  {ms:>8.1f}ms  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark import time and time to first /health of the app.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--backend", default="memory", choices=("vercel", "local", "memory"))
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--budget-import-ms", type=float, help="fail if the median import of main takes longer")
+    parser.add_argument("--budget-health-ms", type=float, help="fail if the median time to first /health is longer")
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="startup-bench-")
+    env = {**os.environ, "TMPDIR": workdir, "STORAGE_BACKEND": args.backend,
+           "BLOB_READ_WRITE_TOKEN": "vercel_blob_rw_bench_fake", "PYTHONUNBUFFERED": "1"}
+    env.update(item.split("=", 1) for item in args.env)
+    try:
+        # One untimed run first, so every timed run finds warm .pyc files
+        import_times(env)
+        walls, mains, modules = [], [], {}
+        for _ in range(args.runs):
+            wall, main_ms, modules = import_times(env)
+            walls.append(wall)
+            mains.append(main_ms)
+        healths = [time_to_health(env) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # Top-level packages only; their children are counted in them
+    top_level = {name: ms for name, ms in modules.items() if "." not in name and name != "main"}
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {"runs": args.runs, "backend": args.backend, "env": args.env},
+        "import_wall_ms": summary(walls),
+        "import_main_ms": summary(mains),
+        "health_ms": summary(healths),
+        "slowest_imports": sorted(top_level.items(), key=lambda item: -item[1]),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    over = []
+    if args.budget_import_ms is not None and report["import_main_ms"]["median"] > args.budget_import_ms:
+        over.append(f"import main {report['import_main_ms']['median']}ms > {args.budget_import_ms}ms")
+    if args.budget_health_ms is not None and report["health_ms"]["median"] > args.budget_health_ms:
+        over.append(f"first /health {report['health_ms']['median']}ms > {args.budget_health_ms}ms")
+    for message in over:
+        print(f"Over budget: {message}")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
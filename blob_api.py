@@ -0,0 +1,120 @@
+import mimetypes
+import os
+import threading
+from urllib.parse import quote
+
+from http_client import MAX_CONNECTIONS, MAX_KEEPALIVE
+
+DEFAULT_API_URL = "https://blob.vercel-storage.com"
+API_VERSION = "10"
+CACHE_MAX_AGE = "31536000"
+
+
+class BlobApiError(Exception):
+    """The Blob API answered with an error; `status_code` says which."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def content_type(pathname):
+    return mimetypes.guess_type(pathname, strict=False)[0] or "application/octet-stream"
+
+
+class BlobApi:
+    """The Vercel Blob HTTP API at `api_url`, through one pooled httpx client.
+
+    The vercel_blob SDK reads its endpoint from a module constant and retries
+    inside every call; here each instance has its own endpoint and each
+    method sends exactly one request. Retries are upstream.Governor's job,
+    as it knows which operations are safe to repeat. The token is read from
+    BLOB_READ_WRITE_TOKEN on every call, so one loaded from .env is seen.
+    """
+
+    def __init__(self, api_url=None, cache_max_age=CACHE_MAX_AGE):
+        self.api_url = (api_url or DEFAULT_API_URL).rstrip("/")
+        self.cache_max_age = cache_max_age
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _http(self):
+        # httpx is imported on the first call, not when the backend is made
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    self._client = httpx.Client(
+                        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE),
+                    )
+        return self._client
+
+    def _headers(self, pathname=None, **extra):
+        token = os.getenv("BLOB_READ_WRITE_TOKEN")
+        if not token:
+            raise BlobApiError("BLOB_READ_WRITE_TOKEN is not set")
+        headers = {"authorization": f"Bearer {token}", "x-api-version": API_VERSION}
+        if pathname is not None:
+            # Writes: what the store serves the blob with
+            headers["access"] = "public"
+            headers["x-content-type"] = content_type(pathname)
+            headers["x-cache-control-max-age"] = self.cache_max_age
+        headers.update(extra)
+        return headers
+
+    def _send(self, method, path, timeout, **kwargs):
+        response = self._http().request(method, f"{self.api_url}{path}", timeout=timeout, **kwargs)
+        if response.status_code != 200:
+            raise BlobApiError(
+                f"Blob API {method} {path} failed (status {response.status_code}): {response.text[:200]}",
+                response.status_code,
+            )
+        return response
+
+    def put(self, pathname, data, timeout):
+        return self._send("PUT", "/", timeout, params={"pathname": pathname}, content=data,
+                          headers=self._headers(pathname)).json()
+
+    def copy(self, from_url, pathname, timeout):
+        return self._send("PUT", "/", timeout, params={"pathname": pathname, "fromUrl": from_url},
+                          headers=self._headers(pathname)).json()
+
+    def list(self, timeout, prefix=None, cursor=None, limit=1000):
+        params = {"limit": str(limit)}
+        if prefix:
+            params["prefix"] = prefix
+        if cursor:
+            params["cursor"] = cursor
+        return self._send("GET", "/", timeout, params=params, headers=self._headers()).json()
+
+    def delete(self, urls, timeout):
+        return self._send("POST", "/delete", timeout, json={"urls": list(urls)}, headers=self._headers()).json()
+
+    def mpu_create(self, pathname, timeout):
+        """(uploadId, key) of a new multipart upload to `pathname`."""
+        info = self._send("POST", "/mpu", timeout, params={"pathname": pathname},
+                          headers=self._headers(pathname, **{"x-mpu-action": "create"})).json()
+        if "uploadId" not in info or "key" not in info:
+            raise BlobApiError(f"Invalid response from create multipart upload: {info}")
+        return info["uploadId"], info["key"]
+
+    def _mpu_headers(self, pathname, action, upload_id, key, **extra):
+        return self._headers(pathname, **{
+            "x-mpu-action": action, "x-mpu-upload-id": upload_id, "x-mpu-key": quote(key), **extra,
+        })
+
+    def mpu_part(self, pathname, upload_id, key, part_number, data, timeout):
+        """Upload one part; returns the {partNumber, etag} mpu_complete wants."""
+        response = self._send("POST", "/mpu", timeout, params={"pathname": pathname}, content=data,
+                              headers=self._mpu_headers(pathname, "upload", upload_id, key, **{
+                                  "x-mpu-part-number": str(part_number),
+                                  "content-type": "application/octet-stream",
+                              }))
+        etag = response.headers.get("etag") or response.json().get("etag")
+        if not etag:
+            raise BlobApiError(f"No etag for part {part_number} of {pathname}")
+        return {"partNumber": part_number, "etag": etag}
+
+    def mpu_complete(self, pathname, upload_id, key, parts, timeout):
+        return self._send("POST", "/mpu", timeout, params={"pathname": pathname}, json=parts,
+                          headers=self._mpu_headers(pathname, "complete", upload_id, key)).json()
@@ -0,0 +1,229 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+BLOB_INDEX_TTL = float(os.getenv("BLOB_INDEX_TTL", 30))
+
+# Content-addressed uploads: the bytes live once under objects/{sha256} and
+# each name gets a ref blob `{timestamp}.{sha256}.{size}_{name}`, so a
+# listing alone says which object a name points at. Objects stored
+# compressed carry the encoding's suffix, on the object and in the ref
+# (`{timestamp}.{sha256}.{size}.zst_{name}`).
+OBJECT_PREFIX = "objects/"
+STAGING_PREFIX = "staging/"
+INTERNAL_PREFIXES = (OBJECT_PREFIX, STAGING_PREFIX)
+ENCODING_SUFFIXES = {"zstd": "zst", "gzip": "gz"}
+_SUFFIX_ENCODINGS = {suffix: encoding for encoding, suffix in ENCODING_SUFFIXES.items()}
+
+_TIMESTAMP_PREFIX = re.compile(r"^\d+(?:\.[0-9a-f]{64}\.\d+(?:\.(?:zst|gz))?)?_")
+_REF = re.compile(r"^(\d+)\.([0-9a-f]{64})\.(\d+)(?:\.(zst|gz))?_")
+
+
+def logical_name(pathname):
+    """Strip the `{timestamp}_` (or ref) prefix uploads are stored under."""
+    return _TIMESTAMP_PREFIX.sub("", pathname, count=1)
+
+
+def _suffix(encoding):
+    return f".{ENCODING_SUFFIXES[encoding]}" if encoding else ""
+
+
+def object_pathname(sha256, encoding=None):
+    return f"{OBJECT_PREFIX}{sha256}{_suffix(encoding)}"
+
+
+def ref_pathname(timestamp, sha256, size, name, encoding=None):
+    return f"{timestamp}.{sha256}.{size}{_suffix(encoding)}_{name}"
+
+
+def ref_sha256(pathname):
+    """The content a ref pathname points at, or None for other pathnames."""
+    match = _REF.match(pathname)
+    return match[2] if match else None
+
+
+def display_pathname(pathname):
+    """`{timestamp}_{name}` for a ref pathname; other pathnames as they are."""
+    match = _REF.match(pathname)
+    return f"{match[1]}_{pathname[match.end():]}" if match else pathname
+
+
+def resolve(blob):
+    """The blob to read and show for an index entry: a ref becomes its
+    object, under the ref's display pathname."""
+    match = _REF.match(blob["pathname"])
+    if match is None:
+        return blob
+    encoding = _SUFFIX_ENCODINGS.get(match[4])
+    url = f"{blob['url'].rsplit('/', 1)[0]}/{object_pathname(match[2], encoding)}"
+    resolved = {
+        "url": url,
+        "downloadUrl": url,
+        "pathname": display_pathname(blob["pathname"]),
+        "size": int(match[3]),
+        "uploadedAt": blob["uploadedAt"],
+        "sha256": match[2],
+    }
+    if encoding:
+        # The object holds this encoding of the content; "size" is the content's
+        resolved["encoding"] = encoding
+    return resolved
+
+
+def etag(blob):
+    """Strong validator for a blob: its content hash when we know it, else
+    a digest of its URL and upload time, which never change for a stored
+    blob."""
+    if blob.get("sha256"):
+        return f'"{blob["sha256"]}"'
+    base = f"{blob['url']}|{blob['uploadedAt']}"
+    return f'"{hashlib.sha256(base.encode()).hexdigest()[:32]}"'
+
+
+def format_uploaded_at(timestamp):
+    """A Unix timestamp in the `uploadedAt` format the blob API uses."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def uploaded_at_now():
+    return format_uploaded_at(time.time())
+
+
+class BlobIndex:
+    """In-process view of the blob store, keyed by logical filename.
+
+    Holds every version of each name plus a pointer to the newest one and to
+    the newest blob overall, so lookups are dict reads. The view starts from
+    the local manifest and is brought up to date with `manifest.sync()` once
+    it is older than `ttl` seconds. Our own uploads and deletes are applied
+    to it (and written through to the manifest) immediately.
+    """
+
+    def __init__(self, manifest, ttl: float = BLOB_INDEX_TTL):
+        self.manifest = manifest
+        self.ttl = ttl
+        self._versions = {}
+        self._newest = {}
+        self._latest = None
+        self._refs = Counter()  # refs per content sha256
+        self._loaded_at = None
+        self.stats = {"list_requests": 0, "list_syncs": 0}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def refresh(self, force=False):
+        # Only one caller goes upstream; the rest keep serving the old view
+        # unless there is none yet.
+        if not force and not self.stale():
+            return
+        self.stats["list_requests"] += 1
+        if not self._refresh_lock.acquire(blocking=self._loaded_at is None or force):
+            return
+        try:
+            if not force and not self.stale():
+                return
+            started = time.monotonic()
+            if self._loaded_at is None:
+                self._apply(self.manifest.load(), [])
+            changed, removed = self.manifest.sync()
+            self.stats["list_syncs"] += 1
+            self._apply(changed, removed)
+            self._loaded_at = started
+        finally:
+            self._refresh_lock.release()
+
+    def _add(self, blob):
+        name = logical_name(blob["pathname"])
+        versions = self._versions.setdefault(name, {})
+        if blob["url"] not in versions:
+            self._count_ref(blob, 1)
+        versions[blob["url"]] = blob
+        newest = self._newest.get(name)
+        if newest is None or newest["url"] == blob["url"] or blob["uploadedAt"] >= newest["uploadedAt"]:
+            self._newest[name] = blob
+        if self._latest is None or self._latest["url"] == blob["url"] or blob["uploadedAt"] >= self._latest["uploadedAt"]:
+            self._latest = blob
+
+    def _remove(self, blob):
+        # Returns True if the overall latest pointer needs recomputing
+        name = logical_name(blob["pathname"])
+        versions = self._versions.get(name, {})
+        if versions.pop(blob["url"], None) is not None:
+            self._count_ref(blob, -1)
+        if not versions:
+            self._versions.pop(name, None)
+            self._newest.pop(name, None)
+        elif self._newest.get(name, {}).get("url") == blob["url"]:
+            self._newest[name] = max(versions.values(), key=lambda b: b["uploadedAt"])
+        return self._latest is not None and self._latest["url"] == blob["url"]
+
+    def _count_ref(self, blob, delta):
+        sha256 = ref_sha256(blob["pathname"])
+        if sha256 is not None:
+            self._refs[sha256] += delta
+            if self._refs[sha256] <= 0:
+                del self._refs[sha256]
+
+    def _apply(self, changed, removed):
+        with self._lock:
+            stale_latest = False
+            for blob in removed:
+                stale_latest |= self._remove(blob)
+            if stale_latest:
+                self._latest = max(self._newest.values(), key=lambda b: b["uploadedAt"], default=None)
+            for blob in changed:
+                self._add(blob)
+
+    def lookup(self, filename):
+        """Newest blob stored under `filename`, or None."""
+        self.refresh()
+        blob = self._newest.get(filename)
+        if blob is not None:
+            return blob
+        # Otherwise `filename` may be a full `{timestamp}_name` pathname
+        # asking for that exact version. Names can start with digits and an
+        # underscore themselves ("2024_report.csv"), so it only counts as
+        # one when a stored version has exactly that pathname.
+        name = logical_name(filename)
+        if name != filename:
+            for blob in self._versions.get(name, {}).values():
+                if filename in (blob["pathname"], display_pathname(blob["pathname"])):
+                    return blob
+        return None
+
+    def versions(self, name):
+        """Every blob stored under the logical name `name`."""
+        self.refresh()
+        return list(self._versions.get(name, {}).values())
+
+    def referenced(self, sha256):
+        """Whether any ref in the store points at content `sha256`."""
+        self.refresh()
+        return sha256 in self._refs
+
+    def latest(self):
+        """Newest blob in the store, or None if it is empty."""
+        self.refresh()
+        return self._latest
+
+    def all(self):
+        self.refresh()
+        return list(self._newest.values())
+
+    def add(self, blob):
+        """Record a blob we just uploaded."""
+        blob.setdefault("uploadedAt", uploaded_at_now())
+        self._apply([blob], [])
+        self.manifest.upsert([blob])
+
+    def remove(self, blob):
+        """Forget a blob we just deleted."""
+        self._apply([], [blob])
+        self.manifest.delete([blob["url"]])
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from blob_index import INTERNAL_PREFIXES, logical_name
+
+LIST_PAGE_SIZE = 1000
+LIST_WORKERS = int(os.getenv("BLOB_LIST_WORKERS", 8))
+FULL_SYNC_INTERVAL = float(os.getenv("MANIFEST_FULL_SYNC_INTERVAL", 10 * 60))
+# A blob is named when its upload starts but only listed once it finishes,
+# so a delta sync re-lists names from this long before the previous sync.
+DELTA_SLACK = float(os.getenv("MANIFEST_DELTA_SLACK", 15 * 60))
+
+_COLUMNS = ("url", "pathname", "name", "size", "uploadedAt", "downloadUrl")
+
+
+def list_blobs(storage, prefix=None):
+    """Every blob under `prefix`, following the cursor through all pages."""
+    blobs = []
+    cursor = None
+    while True:
+        page = storage.list(prefix, cursor, LIST_PAGE_SIZE)
+        # Content objects and staged uploads are reached through refs only
+        blobs.extend(b for b in page.get("blobs", []) if not b["pathname"].startswith(INTERNAL_PREFIXES))
+        cursor = page.get("cursor")
+        if not page.get("hasMore") or not cursor:
+            return blobs
+
+
+def timestamp_prefixes(since, until):
+    """A small set of pathname prefixes covering every `{timestamp}_` name
+    with a timestamp in [since, until].
+
+    The listing API pages sequentially through one cursor, so splitting the
+    range into prefixes is what lets a delta sync list in parallel. Blocks
+    may run past `until`, since no names exist there yet.
+    """
+    low, high = int(since), int(until)
+    if len(str(low)) != len(str(high)):
+        return [None]
+    span = high - low + 1
+    prefixes = []
+    while low <= high:
+        step = 1
+        while low % (step * 10) == 0 and step * 10 <= span:
+            step *= 10
+        digits = len(str(step)) - 1
+        prefixes.append(str(low)[:len(str(low)) - digits])
+        low += step
+    return prefixes
+
+
+def list_prefixes(storage, prefixes, workers=LIST_WORKERS):
+    if len(prefixes) == 1:
+        return list_blobs(storage, prefixes[0])
+    with ThreadPoolExecutor(max_workers=min(workers, len(prefixes))) as pool:
+        pages = pool.map(lambda prefix: list_blobs(storage, prefix), prefixes)
+        return [blob for page in pages for blob in page]
+
+
+class BlobManifest:
+    """Local SQLite copy of the listing of a storage backend.
+
+    A full listing runs at most every FULL_SYNC_INTERVAL seconds and is the
+    only way deletions by other writers are noticed. In between, sync() only
+    lists the timestamp prefixes uploaded since the last sync.
+    """
+
+    def __init__(self, path: Path, storage, full_sync_interval: float = FULL_SYNC_INTERVAL):
+        self.path = path
+        self.storage = storage
+        self.full_sync_interval = full_sync_interval
+        self._lock = threading.Lock()
+        self._connection = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def _db(self):
+        # Opened on first use, so importing the app touches no files
+        if self._connection is None:
+            with self._open_lock:
+                if self._connection is None:
+                    self._connection = self._open()
+        return self._connection
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                url TEXT PRIMARY KEY,
+                pathname TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER,
+                uploadedAt TEXT NOT NULL,
+                downloadUrl TEXT
+            );
+            CREATE INDEX IF NOT EXISTS blobs_name ON blobs (name, uploadedAt);
+            CREATE INDEX IF NOT EXISTS blobs_uploaded ON blobs (uploadedAt);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL);
+        """)
+        return db
+
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _rows(self, blobs):
+        return [
+            (b["url"], b["pathname"], logical_name(b["pathname"]), b.get("size"),
+             b["uploadedAt"], b.get("downloadUrl"))
+            for b in blobs
+        ]
+
+    def _to_blob(self, row):
+        blob = dict(zip(_COLUMNS, row))
+        del blob["name"]
+        return blob
+
+    def _count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+
+    def load(self):
+        """Every blob in the manifest, without going upstream."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM blobs").fetchall()
+        return [self._to_blob(row) for row in rows]
+
+    def upsert(self, blobs):
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO blobs ({', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                self._rows(blobs),
+            )
+            self._db.execute("COMMIT")
+
+    def delete(self, urls):
+        with self._lock:
+            self._db.executemany("DELETE FROM blobs WHERE url = ?", [(u,) for u in urls])
+
+    def sync(self):
+        """Bring the manifest up to date with the store.
+
+        Returns (changed, removed): blobs that were added or updated, and
+        blobs that no longer exist upstream.
+        """
+        last_full = self._meta("last_full_sync")
+        last_sync = self._meta("last_sync")
+        if last_full is None or last_sync is None or time.time() - last_full > self.full_sync_interval:
+            return self._full_sync()
+        if self._count() <= LIST_PAGE_SIZE:
+            # A single page lists everything, cheaper than many prefixes
+            return self._full_sync()
+
+        started = time.time()
+        blobs = list_prefixes(self.storage, timestamp_prefixes(last_sync - DELTA_SLACK, started + 60))
+        self.upsert(blobs)
+        with self._lock:
+            self._set_meta("last_sync", started)
+        return blobs, []
+
+    def _full_sync(self):
+        started = time.time()
+        blobs = list_blobs(self.storage)
+        seen = {b["url"] for b in blobs}
+
+        with self._lock:
+            known = {
+                row[0]: row for row in
+                self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM blobs").fetchall()
+            }
+        removed = [self._to_blob(row) for url, row in known.items() if url not in seen]
+        changed = [b for b, row in zip(blobs, self._rows(blobs)) if known.get(b["url"]) != row]
+
+        self.upsert(changed)
+        self.delete([b["url"] for b in removed])
+        with self._lock:
+            self._set_meta("last_full_sync", started)
+            self._set_meta("last_sync", started)
+        return changed, removed
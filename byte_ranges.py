@@ -0,0 +1,128 @@
+import uuid
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import datetime
+
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """Parse a `Range: bytes=...` header into sorted, merged (start, end)
+    pairs with inclusive ends.
+
+    Returns None when the header is missing, malformed or asks for more than
+    MAX_RANGES ranges; RFC 7233 lets a server answer those with the full
+    body. Raises RangeNotSatisfiable when no range overlaps the body.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        first, dash, last = part.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else None
+                if start < 0 or (end is not None and end < start):
+                    return None
+                if end is None:
+                    end = size - 1
+            else:
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start = max(size - suffix, 0)
+                end = size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(end, last_end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def http_date(uploaded_at):
+    """Blob `uploadedAt` (ISO 8601) as an HTTP-date."""
+    return format_datetime(datetime.fromisoformat(uploaded_at.replace("Z", "+00:00")), usegmt=True)
+
+
+def if_range_matches(if_range, last_modified, etag=None):
+    """Whether an If-Range validator still matches the current representation."""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(("W/", '"')):
+        # Weak tags never match for ranges (RFC 7233 section 3.2)
+        return etag is not None and not if_range.startswith("W/") and if_range == etag
+    try:
+        return last_modified is not None and parsedate_to_datetime(if_range) == parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def not_modified(if_none_match, if_modified_since, etag, last_modified):
+    """Whether a GET/HEAD with these validators can be answered with 304.
+
+    If-None-Match uses weak comparison and, when present, overrides
+    If-Modified-Since (RFC 9110 section 13.1).
+    """
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def content_range(start, end, size):
+    return f"bytes {start}-{end}/{size}"
+
+
+class MultipartByteranges:
+    """Framing for a multipart/byteranges body over the given ranges."""
+
+    def __init__(self, ranges, size, content_type="application/octet-stream"):
+        self.ranges = ranges
+        self.size = size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+        self._part_type = content_type
+
+    def part_header(self, start, end):
+        return (
+            f"\r\n--{self.boundary}\r\n"
+            f"Content-Type: {self._part_type}\r\n"
+            f"Content-Range: {content_range(start, end, self.size)}\r\n\r\n"
+        ).encode("latin-1")
+
+    def closing(self):
+        return f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+
+    def content_length(self):
+        return sum(len(self.part_header(s, e)) + e - s + 1 for s, e in self.ranges) + len(self.closing())
@@ -0,0 +1,66 @@
+import hashlib
+import zlib
+
+try:
+    import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+# Sent with every chunk as "<algorithm>=<hex>", over the chunk's content
+# (after any Content-Encoding is removed)
+CHUNK_CHECKSUM_HEADER = "X-Chunk-Checksum"
+# The whole content's SHA-256, on uploads that declare it and on downloads
+CONTENT_SHA256_HEADER = "X-Content-SHA256"
+
+# Cheapest first; crc32c only when the crc32c package is installed
+ALGORITHMS = ("crc32c", "crc32", "sha256") if _crc32c is not None else ("crc32", "sha256")
+
+
+class UnsupportedChecksum(ValueError):
+    pass
+
+
+class Checksum:
+    """An incremental checksum in one of ALGORITHMS, read out as hex."""
+
+    def __init__(self, algorithm):
+        if algorithm not in ALGORITHMS:
+            raise UnsupportedChecksum(f"Checksum {algorithm} is not supported; use {', '.join(ALGORITHMS)}")
+        self.algorithm = algorithm
+        self._sha256 = hashlib.sha256() if algorithm == "sha256" else None
+        self._crc = 0
+
+    def update(self, data):
+        if self._sha256 is not None:
+            self._sha256.update(data)
+        elif self.algorithm == "crc32c":
+            self._crc = _crc32c.crc32c(data, self._crc)
+        else:
+            self._crc = zlib.crc32(data, self._crc)
+
+    def hexdigest(self):
+        if self._sha256 is not None:
+            return self._sha256.hexdigest()
+        return f"{self._crc:08x}"
+
+
+def parse(value):
+    """(algorithm, expected hex) from a checksum header, or None without one."""
+    if not value:
+        return None
+    algorithm, sep, expected = value.strip().partition("=")
+    if not sep or not expected:
+        raise UnsupportedChecksum(f"Malformed checksum {value!r}; expected <algorithm>=<hex>")
+    Checksum(algorithm.lower())  # raises for an unknown algorithm
+    return algorithm.lower(), expected.strip().lower()
+
+
+def compute(data, algorithm):
+    checksum = Checksum(algorithm)
+    checksum.update(data)
+    return checksum.hexdigest()
+
+
+def header_value(data, algorithm=ALGORITHMS[0]):
+    """The checksum header for a chunk, in the cheapest algorithm by default."""
+    return f"{algorithm}={compute(data, algorithm)}"
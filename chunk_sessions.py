@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import Counter
+import time
+import uuid
+from pathlib import Path
+
+SESSION_TTL = int(os.getenv("CHUNK_SESSION_TTL", 24 * 60 * 60))
+
+
+def pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        offset += written
+        view = view[written:]
+    return offset
+
+
+class ChunkSession:
+    """One chunked upload: chunks are written at their offset into a
+    preallocated file, so they may arrive in any order and in parallel."""
+
+    def __init__(self, session_id, filename, total_chunks, chunk_size, file_size, path, created_at=None,
+                 sha256=None, chunk_hashes=None):
+        self.id = session_id
+        self.filename = filename
+        self.total_chunks = total_chunks
+        self.chunk_size = chunk_size
+        self.file_size = file_size
+        self.path = path
+        self.created_at = created_at or time.time()
+        # Optional client-declared hashes, checked as the data arrives
+        self.sha256 = sha256
+        self.chunk_hashes = chunk_hashes
+        self.received = set()
+        self.committing = False
+        # SHA-256 of chunks 0..hashed-1, fed in order as they arrive so the
+        # whole digest is ready at commit without reading the file again.
+        # Chunks that arrive ahead of the frontier are read back once it
+        # reaches them; `writing` and `writes` keep that from reading a
+        # chunk while it is being (re)written.
+        self.digest = hashlib.sha256()
+        self.hashed = 0
+        self.hashed_chunks = []
+        self.digest_lock = asyncio.Lock()
+        self.writing = Counter()
+        self.writes = Counter()
+
+    @property
+    def meta_path(self):
+        return self.path.with_suffix(".json")
+
+    @property
+    def log_path(self):
+        return self.path.with_suffix(".log")
+
+    def expected_length(self, index):
+        """Size chunk `index` must have, or None if only an upper bound is known."""
+        if index < self.total_chunks - 1:
+            return self.chunk_size
+        if self.file_size is not None:
+            return self.file_size - index * self.chunk_size
+        return None
+
+    def reset_digest(self):
+        self.digest = hashlib.sha256()
+        self.hashed = 0
+        self.hashed_chunks = []
+
+    def read_chunk(self, index):
+        length = self.expected_length(index)
+        with open(self.path, "rb") as f:
+            f.seek(index * self.chunk_size)
+            return f.read(length if length is not None else self.chunk_size)
+
+    def missing(self):
+        return [i for i in range(self.total_chunks) if i not in self.received]
+
+    def size(self):
+        if self.file_size is not None:
+            return self.file_size
+        return os.path.getsize(self.path)
+
+    def to_dict(self):
+        return {
+            "sessionId": self.id,
+            "fileName": self.filename,
+            "totalChunks": self.total_chunks,
+            "chunkSize": self.chunk_size,
+            "fileSize": self.file_size,
+            "received": len(self.received),
+            "missing": self.missing(),
+        }
+
+
+class ChunkSessionStore:
+    """Keeps chunk sessions in memory, with a small sidecar file per session
+    so a restarted worker can pick up uploads that were in flight."""
+
+    def __init__(self, directory: Path, ttl: int = SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._sessions = {}
+
+    def create(self, filename, total_chunks, chunk_size, file_size=None, sha256=None, chunk_hashes=None):
+        self.expire()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        session_id = uuid.uuid4().hex
+        path = self.directory / f"{session_id}.part"
+        session = ChunkSession(session_id, filename, total_chunks, chunk_size, file_size, path,
+                               sha256=sha256, chunk_hashes=chunk_hashes)
+
+        with open(path, "wb") as f:
+            if file_size:
+                f.truncate(file_size)
+        with open(session.meta_path, "w") as f:
+            json.dump({
+                "filename": filename,
+                "total_chunks": total_chunks,
+                "chunk_size": chunk_size,
+                "file_size": file_size,
+                "created_at": session.created_at,
+                "sha256": sha256,
+                "chunk_hashes": chunk_hashes,
+            }, f)
+
+        self._sessions[session_id] = session
+        return session
+
+    def active(self):
+        """Number of sessions held in memory."""
+        return len(self._sessions)
+
+    def get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+        return session
+
+    def _load(self, session_id):
+        if not session_id.isalnum():
+            return None
+        path = self.directory / f"{session_id}.part"
+        try:
+            with open(path.with_suffix(".json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        session = ChunkSession(
+            session_id, meta["filename"], meta["total_chunks"], meta["chunk_size"],
+            meta["file_size"], path, meta["created_at"],
+            meta.get("sha256"), meta.get("chunk_hashes"),
+        )
+        try:
+            with open(session.log_path) as f:
+                for line in f:
+                    line = line.strip()
+                    # "-N" undoes an earlier "N": chunk N was overwritten by a bad one
+                    if line.startswith("-"):
+                        session.received.discard(int(line[1:]))
+                    elif line:
+                        session.received.add(int(line))
+        except OSError:
+            pass
+        self._sessions[session_id] = session
+        return session
+
+    def open_for_write(self, session):
+        return os.open(session.path, os.O_WRONLY)
+
+    def mark_received(self, session, index):
+        if index in session.received:
+            return
+        session.received.add(index)
+        with open(session.log_path, "a") as f:
+            f.write(f"{index}\n")
+
+    def unmark_received(self, session, index):
+        if index not in session.received:
+            return
+        session.received.discard(index)
+        with open(session.log_path, "a") as f:
+            f.write(f"-{index}\n")
+
+    def remove(self, session):
+        self._sessions.pop(session.id, None)
+        for path in (session.path, session.meta_path, session.log_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                if meta_path.stat().st_mtime < cutoff:
+                    session = self.get(meta_path.stem)
+                    if session is not None and not session.committing:
+                        self.remove(session)
+            except OSError:
+                pass
@@ -1,10 +1,35 @@
 import requests
+from requests.adapters import HTTPAdapter
+import argparse
+import hashlib
+import json
 import re
 import os
 import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 BASE_URL = "http://localhost:8000"
-CHUNK_SIZE = 8192  # 8KB chunks for download
+CHUNK_SIZE = 1024 * 1024  # 1MB reads per segment
+SEGMENTS = 8
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024  # smaller files use a single stream
+PROGRESS_INTERVAL = 0.5  # seconds between progress lines and state saves
+VALIDATORS_FILE = ".download_validators.json"  # per output directory
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)  # preferred first
+SHA256_HEADER = "X-Content-SHA256"  # the content's digest, when the server knows it
+
+
+class DownloadError(Exception):
+    pass
+
 
 def get_filename_from_cd(cd):
     if not cd:
@@ -14,48 +39,422 @@ def get_filename_from_cd(cd):
         return None
     return fname[0].strip('"')
 
-def download_file(target_filename=None):
-    if target_filename:
-        print(f"Fetching file '{target_filename}'...")
-        url = f"{BASE_URL}/download?filename={target_filename}"
-    else:
-        print("Fetching latest file...")
-        url = f"{BASE_URL}/latest"
-    
-    try:
-        with requests.get(url, stream=True) as r:
-            if r.status_code == 404:
-                print("Error: File not found.")
-                return
+
+def decoder_for(content_encoding):
+    """A decompressor for a response's Content-Encoding, or None for identity."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding == "gzip":
+        return zlib.decompressobj(31)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise DownloadError(f"Server sent an encoding this client cannot decode: {encoding}")
+
+
+def make_session(workers=SEGMENTS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def probe(session, url, cached=None):
+    """Fetch the first byte to learn the size, name and version of the file.
+
+    With the validators of a `cached` copy, returns None if the server says
+    it is still current (304).
+    """
+    headers = {"Range": "bytes=0-0"}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("lastModified"):
+            headers["If-Modified-Since"] = cached["lastModified"]
+    with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as r:
+        if r.status_code == 304:
+            return None
+        if r.status_code == 404:
+            raise DownloadError("File not found.")
+        if r.status_code == 416:
+            # Empty file: nothing satisfies a range
+            size = int(r.headers.get("Content-Range", "*/0").rsplit("/", 1)[1])
+            ranged = False
+        else:
             r.raise_for_status()
-            
-            cd = r.headers.get("Content-Disposition")
-            filename = get_filename_from_cd(cd)
-            
-            if not filename:
-                filename = f"downloaded_{int(time.time())}.bin"
-                
-            filename = filename.strip('"')
-            local_path = os.path.join(os.getcwd(), f"downloaded_{filename}")
-            
-            print(f"Downloading to '{local_path}'...")
-            
-            total_size = 0
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=CHUNK_SIZE): 
-                    if chunk:
-                        f.write(chunk)
-                        total_size += len(chunk)
-                        sys.stdout.write(f"\rDownloaded {total_size} bytes")
-                        sys.stdout.flush()
-            
-            print(f"\n\nSuccess! File saved to: {local_path}")
-            
-    except Exception as e:
+            ranged = r.status_code == 206
+            if ranged:
+                size = int(r.headers["Content-Range"].rsplit("/", 1)[1])
+            else:
+                size = int(r.headers.get("Content-Length", -1))
+        # A redirect to the blob store carries the digest; the store does not
+        sha256 = r.headers.get(SHA256_HEADER)
+        for hop in r.history:
+            sha256 = sha256 or hop.headers.get(SHA256_HEADER)
+        return {
+            "filename": get_filename_from_cd(r.headers.get("Content-Disposition")),
+            "size": size,
+            "lastModified": r.headers.get("Last-Modified"),
+            "etag": r.headers.get("ETag"),
+            "ranged": ranged,
+            "sha256": sha256.lower() if sha256 else None,
+        }
+
+
+def validators_path(output_dir):
+    return os.path.join(output_dir, VALIDATORS_FILE)
+
+
+def load_validators(output_dir):
+    try:
+        with open(validators_path(output_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_validators(output_dir, validators):
+    tmp = validators_path(output_dir) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(validators, f)
+    os.replace(tmp, validators_path(output_dir))
+
+
+def cached_copy(validators, key):
+    """Validators of the last download for `key`, if that file is still
+    on disk untouched (same size)."""
+    entry = validators.get(key)
+    if not entry:
+        return None
+    try:
+        if os.path.getsize(entry["path"]) != entry["size"]:
+            return None
+    except (OSError, KeyError):
+        return None
+    return entry
+
+
+def split(size, segments):
+    segments = max(1, min(segments, size // MIN_SEGMENT_SIZE or 1))
+    step = -(-size // segments)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+
+class Progress:
+    def __init__(self, total, done=0, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.done = done
+        self.fetched = 0
+        self.wire = 0  # bytes actually received, before decompression
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def update(self, nbytes, wire=None):
+        """Count bytes; returns True when a (throttled) progress tick is due."""
+        with self._lock:
+            self.done += nbytes
+            self.fetched += nbytes
+            self.wire += nbytes if wire is None else wire
+            now = time.monotonic()
+            if now - self._last < self.interval and self.done < self.total:
+                return False
+            self._last = now
+        pct = 100 * self.done / self.total if self.total else 100
+        sys.stdout.write(f"\rDownloaded {self.done}/{self.total} bytes ({pct:.1f}%) at {self.rate():.2f} MB/s")
+        sys.stdout.flush()
+        return True
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.fetched / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+
+
+def state_path(local_path):
+    return f"{local_path}.download.json"
+
+
+def load_state(local_path, info):
+    try:
+        with open(state_path(local_path)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("size") != info["size"] or state.get("lastModified") != info["lastModified"]:
+        return None
+    if state.get("etag") != info["etag"]:
+        return None
+    if not os.path.exists(local_path) or os.path.getsize(local_path) != info["size"]:
+        return None
+    return state
+
+
+def save_state(local_path, state, lock):
+    with lock:
+        tmp = state_path(local_path) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, state_path(local_path))
+
+
+def fetch_segment(session, url, fd, segment, validator, progress, on_tick):
+    start, end, done = segment
+    if start + done > end:
+        return
+    headers = {"Range": f"bytes={start + done}-{end}"}
+    if validator:
+        headers["If-Range"] = validator
+    with session.get(url, headers=headers, stream=True, timeout=(10, 120)) as r:
+        if r.status_code != 206:
+            raise DownloadError(f"Expected 206 for bytes {start + done}-{end}, got {r.status_code} (file changed?)")
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            if not chunk:
+                continue
+            offset = start + segment[2]
+            view = memoryview(chunk)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                offset += written
+                view = view[written:]
+            segment[2] += len(chunk)
+            if progress.update(len(chunk)):
+                on_tick()
+    if start + segment[2] != end + 1:
+        raise DownloadError(f"Segment {start}-{end} ended early at {start + segment[2]}")
+
+
+class Verifier(threading.Thread):
+    """Hashes a segmented download while it runs, following the prefix of
+    the file that has been written without gaps. Bytes are read back right
+    after they land, so they usually still are in the page cache."""
+
+    def __init__(self, local_path, segments):
+        super().__init__(daemon=True)
+        self.local_path = local_path
+        self.segments = sorted(segments, key=lambda s: s[0])
+        self.size = self.segments[-1][1] + 1 if self.segments else 0
+        self.digest = hashlib.sha256()
+        self.position = 0
+        self.error = None
+        self.stopped = threading.Event()
+
+    def frontier(self):
+        for start, end, done in self.segments:
+            if start + done <= end:
+                return start + done
+        return self.size
+
+    def run(self):
+        try:
+            with open(self.local_path, "rb") as f:
+                while self.position < self.size and not self.stopped.is_set():
+                    frontier = self.frontier()
+                    if frontier <= self.position:
+                        self.stopped.wait(0.05)
+                        continue
+                    f.seek(self.position)
+                    data = f.read(min(CHUNK_SIZE, frontier - self.position))
+                    if not data:
+                        raise OSError(f"'{self.local_path}' is shorter than {self.position + 1} bytes")
+                    self.digest.update(data)
+                    self.position += len(data)
+        except OSError as e:
+            self.error = e
+
+    def result(self):
+        """The SHA-256 of the whole file, once every segment is in."""
+        self.join()
+        if self.error is not None:
+            raise DownloadError(f"Could not verify '{self.local_path}': {self.error}")
+        return self.digest.hexdigest()
+
+
+def download_single(session, url, local_path, progress, compress=False):
+    """Stream the whole file; returns (Content-Encoding, SHA-256 of the content)."""
+    headers = {"Accept-Encoding": ", ".join(ENCODINGS) if compress else "identity"}
+    digest = hashlib.sha256()
+    with session.get(url, headers=headers, stream=True, timeout=(10, 120)) as r:
+        r.raise_for_status()
+        decoder = decoder_for(r.headers.get("Content-Encoding"))
+        with open(local_path, "wb") as f:
+            for raw in r.raw.stream(CHUNK_SIZE, decode_content=False):
+                chunk = decoder.decompress(raw) if decoder is not None else raw
+                if chunk:
+                    f.write(chunk)
+                    digest.update(chunk)
+                progress.update(len(chunk), len(raw))
+            if decoder is not None:
+                if not decoder.eof:
+                    raise DownloadError("Compressed download ended early")
+                tail = decoder.flush()
+                f.write(tail)
+                digest.update(tail)
+        return r.headers.get("Content-Encoding"), digest.hexdigest()
+
+
+def download_file(target_filename=None, base_url=BASE_URL, segments=SEGMENTS, output_dir=None,
+                  resume=True, session=None, force=False, compress=False, local_path=None):
+    """Download a file (or the latest one) over `segments` parallel ranged
+    connections into a preallocated file.
+
+    Segment progress is saved next to the file, so an interrupted download
+    resumes where each segment stopped. The ETag of every finished download
+    is remembered in the output directory, and a file the server reports
+    unchanged is not fetched again unless `force` is set. With `compress`,
+    the file comes over one stream the server may compress, which beats
+    parallel raw segments on slow links for text-like data. When the
+    server sends the content's SHA-256, the file is hashed as it arrives
+    and a mismatch fails the download. With `local_path` the file is saved
+    there, always fetched, and left out of the remembered ETags. Returns the
+    local path and transfer statistics; raises DownloadError on failure.
+    """
+    output_dir = output_dir or os.getcwd()
+    validators = load_validators(output_dir) if local_path is None else {}
+    key = f"{base_url}|{target_filename or ''}"
+    own_session = session is None
+    if own_session:
+        session = make_session(segments)
+
+    try:
+        if target_filename:
+            print(f"Fetching file '{target_filename}'...")
+            url = f"{base_url}/download?filename={quote(target_filename)}"
+        else:
+            print("Fetching latest file...")
+            url = f"{base_url}/latest"
+
+        cached = None if force or local_path else cached_copy(validators, key)
+        info = probe(session, url, cached)
+        if info is None:
+            print(f"Up to date: '{cached['path']}' (not modified on the server)")
+            return {"path": cached["path"], "size": cached["size"], "elapsed": 0.0, "mbps": 0.0,
+                    "connections": 0, "unchanged": True}
+        filename = info["filename"] or f"downloaded_{int(time.time())}.bin"
+        if info["filename"]:
+            # Pin the exact version so every segment reads the same blob even
+            # if a newer one is published mid-download
+            url = f"{base_url}/download?filename={quote(info['filename'])}"
+        remember = local_path is None
+        local_path = local_path or os.path.join(output_dir, f"downloaded_{filename}")
+        size = info["size"]
+
+        encoding = None
+        if compress or not info["ranged"] or segments <= 1 or size < 2 * MIN_SEGMENT_SIZE:
+            print(f"Downloading to '{local_path}' over a single stream...")
+            progress = Progress(max(size, 0))
+            encoding, sha256 = download_single(session, url, local_path, progress, compress)
+            state = None
+        else:
+            state = load_state(local_path, info) if resume else None
+            if state:
+                print(f"Resuming '{local_path}'...")
+            else:
+                state = {"size": size, "lastModified": info["lastModified"], "etag": info["etag"],
+                         "segments": split(size, segments)}
+                with open(local_path, "wb") as f:
+                    f.truncate(size)
+            parts = state["segments"]
+            print(f"Downloading to '{local_path}' over {len(parts)} connections...")
+
+            progress = Progress(size, sum(s[2] for s in parts))
+            state_lock = threading.Lock()
+            tick = lambda: save_state(local_path, state, state_lock)
+            # The ETag pins the exact bytes; Last-Modified only has 1s resolution
+            validator = info["etag"] or info["lastModified"]
+
+            verifier = Verifier(local_path, parts) if info["sha256"] else None
+            if verifier is not None:
+                verifier.start()
+            fd = os.open(local_path, os.O_WRONLY)
+            try:
+                with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+                    futures = [
+                        pool.submit(fetch_segment, session, url, fd, s, validator, progress, tick)
+                        for s in parts
+                    ]
+                    try:
+                        for future in as_completed(futures):
+                            future.result()
+                    finally:
+                        tick()
+            except BaseException:
+                if verifier is not None:
+                    verifier.stopped.set()
+                raise
+            finally:
+                os.close(fd)
+            sha256 = verifier.result() if verifier is not None else None
+
+        actual = os.path.getsize(local_path)
+        if size >= 0 and actual != size:
+            raise DownloadError(f"Size mismatch: expected {size} bytes, got {actual}")
+        if info["sha256"] and sha256 != info["sha256"]:
+            # Corrupt on the way: start over rather than resume into it
+            if state:
+                os.remove(state_path(local_path))
+            raise DownloadError(f"Checksum mismatch: expected sha256 {info['sha256']}, got {sha256}")
+        if state:
+            os.remove(state_path(local_path))
+        if remember and (info["etag"] or info["lastModified"]):
+            validators[key] = {"etag": info["etag"], "lastModified": info["lastModified"],
+                               "path": local_path, "size": actual}
+            save_validators(output_dir, validators)
+
+        result = {
+            "path": local_path,
+            "size": actual,
+            "elapsed": progress.elapsed(),
+            "mbps": progress.rate(),
+            "connections": len(state["segments"]) if state else 1,
+            "wireBytes": progress.wire,
+            "sha256": sha256,
+            "verified": bool(info["sha256"]),
+        }
+        print(f"\n\nSuccess! File saved to: {local_path}")
+        print(f"{progress.fetched} bytes in {result['elapsed']:.2f}s ({result['mbps']:.2f} MB/s over {result['connections']} connection(s))")
+        if encoding:
+            print(f"Received {progress.wire} bytes on the wire ({encoding})")
+        if info["sha256"]:
+            print(f"SHA-256 verified: {sha256}")
+        return result
+    except requests.exceptions.RequestException as e:
+        raise DownloadError(str(e)) from e
+    finally:
+        if own_session:
+            session.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download a file, or the latest one, over parallel ranged connections.")
+    parser.add_argument("filename", nargs="?", help="file to download (default: latest)")
+    parser.add_argument("--url", default=BASE_URL, help=f"server base URL (default {BASE_URL})")
+    parser.add_argument("--segments", type=int, default=SEGMENTS, help="parallel connections (1 = single stream)")
+    parser.add_argument("--output-dir", help="directory to save into (default: current directory)")
+    parser.add_argument("--no-resume", action="store_true", help="ignore saved segment progress")
+    parser.add_argument("--compare", action="store_true", help="also time a single-stream download for comparison")
+    parser.add_argument("--force", action="store_true", help="download even if the local copy is up to date")
+    parser.add_argument("--compress", action="store_true",
+                        help=f"one stream the server may compress ({', '.join(ENCODINGS)}) instead of raw segments")
+    args = parser.parse_args(argv)
+
+    try:
+        result = download_file(args.filename, args.url, args.segments, args.output_dir,
+                               resume=not args.no_resume, force=args.force, compress=args.compress)
+        if args.compare and result["connections"] > 1:
+            print("\nSingle-stream baseline:")
+            baseline = download_file(args.filename, args.url, 1, args.output_dir, resume=False, force=True)
+            speedup = result["mbps"] / baseline["mbps"] if baseline["mbps"] else float("inf")
+            print(f"\nSegmented: {result['mbps']:.2f} MB/s, single stream: {baseline['mbps']:.2f} MB/s ({speedup:.1f}x)")
+    except DownloadError as e:
         print(f"\nError downloading file: {e}")
+        return 1
+    return 0
+
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        download_file(sys.argv[1])
-    else:
-        download_file()
+    sys.exit(main())
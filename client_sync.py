@@ -0,0 +1,391 @@
+"""Mirror a directory to or from the server.
+
+    python client_sync.py push ./artifacts --prefix build-42_
+    python client_sync.py pull ./artifacts --prefix build-42_ --delete
+
+One GET /manifest says what the server has (name, size, uploadedAt,
+sha256). The directory is scanned with a cache of each file's SHA-256 kept
+by size and mtime, so only new or touched files are hashed again. Only
+files that differ are transferred: small ones through a pool of workers,
+one request each; large ones after that, one at a time, each split across
+as many connections by client_upload / client_download. Everything shares
+one pooled HTTP session.
+
+Names on the server are flat, so a file's path below the directory becomes
+its name after the prefix, with "/" written as "%2F" and "%" as "%25".
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote
+
+import requests
+
+import client_download
+import client_upload
+
+BASE_URL = "http://localhost:8000"
+WORKERS = 8
+RETRIES = client_upload.RETRIES
+LARGE_FILE_SIZE = 16 * 1024 * 1024  # from here on files go through the chunked clients
+CACHE_FILE = ".sync_cache.json"  # per synced directory
+HASH_READ_SIZE = 4 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+TMP_SUFFIX = ".sync.tmp"
+PROGRESS_INTERVAL = 0.5
+# What the clients keep next to the files they transfer
+SKIP_NAMES = {CACHE_FILE, client_download.VALIDATORS_FILE}
+SKIP_SUFFIXES = (".tmp", ".upload.json", ".download.json")
+
+
+class SyncError(Exception):
+    pass
+
+
+def remote_name(relpath, prefix=""):
+    return prefix + relpath.replace("%", "%25").replace("/", "%2F")
+
+
+def local_relpath(name, prefix=""):
+    return re.sub(r"%(25|2F)", lambda m: "%" if m[1] == "25" else "/", name[len(prefix):])
+
+
+def skipped(filename):
+    return filename in SKIP_NAMES or filename.endswith(SKIP_SUFFIXES)
+
+
+def safe_relpath(relpath):
+    """Whether a path from the server stays inside the synced directory."""
+    parts = relpath.split("/")
+    return bool(relpath) and not relpath.startswith("/") and all(p not in ("", ".", "..") for p in parts)
+
+
+def load_cache(directory):
+    try:
+        with open(os.path.join(directory, CACHE_FILE)) as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(directory, files):
+    path = os.path.join(directory, CACHE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"files": files}, f)
+    os.replace(path + ".tmp", path)
+
+
+def scan(directory, cache):
+    """{relpath: entry} for every file below `directory`. An entry has the
+    file's size and mtime, and its sha256 when the cache still vouches for
+    it (same size and mtime); otherwise sha256 is None until hashed."""
+    files = {}
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        with os.scandir(os.path.join(directory, rel_dir)) as entries:
+            for entry in entries:
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(rel)
+                    continue
+                if not entry.is_file(follow_symlinks=False) or skipped(entry.name):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                cached = cache.get(rel)
+                fresh = cached is not None and cached.get("size") == st.st_size and cached.get("mtime") == st.st_mtime_ns
+                files[rel] = {
+                    "size": st.st_size,
+                    "mtime": st.st_mtime_ns,
+                    "sha256": cached.get("sha256") if fresh else None,
+                    "uploadedAt": cached.get("uploadedAt") if fresh else None,
+                }
+    return files
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(HASH_READ_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def hash_missing(directory, files, relpaths, pool):
+    """Fill in the sha256 of the given files that the cache did not have."""
+    todo = [rel for rel in relpaths if files[rel]["sha256"] is None]
+    for rel, sha256 in zip(todo, pool.map(lambda rel: hash_file(os.path.join(directory, rel)), todo)):
+        files[rel]["sha256"] = sha256
+    return len(todo)
+
+
+def fetch_manifest(session, base_url, prefix="", retries=RETRIES):
+    """{name: entry} of the newest version of every name under `prefix`."""
+    manifest = client_upload.request_with_retry(
+        session, "GET", f"{base_url}/manifest", retries, params={"prefix": prefix},
+    ).json()
+    return {entry["name"]: entry for entry in manifest["files"]}
+
+
+def same_content(local, remote):
+    if remote.get("sha256"):
+        return local["sha256"] == remote["sha256"]
+    # Blobs from before content addressing have no hash; what was pulled
+    # last time is known by its upload time
+    return local["size"] == remote.get("size") and local.get("uploadedAt") == remote["uploadedAt"]
+
+
+def with_retries(fn, retries=RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except (requests.exceptions.RequestException, SyncError) as e:
+            if attempt == retries:
+                raise SyncError(f"failed after {retries + 1} attempts: {e}") from e
+            time.sleep(client_upload.BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def push_small(session, base_url, path, name, sha256, retries=RETRIES):
+    """One PUT /upload with the hash declared, so content the server has
+    already is linked without the body being read."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != sha256:
+        raise SyncError(f"'{path}' changed while syncing")
+    return client_upload.request_with_retry(
+        session, "PUT", f"{base_url}/upload/{quote(name, safe='')}", retries, data=data,
+        headers={"Content-Type": "application/octet-stream", "X-Content-SHA256": sha256},
+    ).json()
+
+
+def pull_small(session, base_url, name, path, expected=None, retries=RETRIES):
+    """GET one file into a temporary name, check its hash, move it into
+    place; returns its sha256."""
+    tmp = path + TMP_SUFFIX
+
+    def fetch():
+        digest = hashlib.sha256()
+        with session.get(f"{base_url}/download", params={"filename": name},
+                         headers={"Accept-Encoding": "identity"}, stream=True, timeout=(10, 120)) as r:
+            if r.status_code == 404:
+                raise SyncError(f"'{name}' is no longer on the server")
+            r.raise_for_status()
+            wanted = expected or r.headers.get(client_download.SHA256_HEADER)
+            with open(tmp, "wb") as f:
+                for chunk in r.iter_content(chunk_size=READ_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+        if wanted and digest.hexdigest() != wanted.lower():
+            raise SyncError(f"'{name}' arrived with sha256 {digest.hexdigest()}, expected {wanted}")
+        return digest.hexdigest()
+
+    try:
+        sha256 = with_retries(fetch, retries)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return sha256
+
+
+class Progress:
+    def __init__(self, total_files, total_bytes, interval=PROGRESS_INTERVAL):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def update(self, nbytes):
+        with self._lock:
+            self.files += 1
+            self.bytes += nbytes
+            now = time.monotonic()
+            if now - self._last < self.interval and self.files < self.total_files:
+                return
+            self._last = now
+        sys.stdout.write(f"\rSynced {self.files}/{self.total_files} files, {self.bytes}/{self.total_bytes} bytes")
+        sys.stdout.flush()
+
+
+def sync(direction, directory, base_url=BASE_URL, prefix="", workers=WORKERS, delete=False,
+         dry_run=False, retries=RETRIES, session=None):
+    """Push `directory` to the server, or pull the server into it, moving
+    only what differs. With `delete`, a pull also removes local files the
+    server does not have. Returns a report; failed files are listed in
+    "errors" and do not stop the others."""
+    if direction not in ("push", "pull"):
+        raise SyncError(f"Unknown direction {direction!r}; use push or pull")
+    if "/" in prefix:
+        raise SyncError("The prefix cannot contain '/': names on the server are flat")
+    if direction == "push" and not os.path.isdir(directory):
+        raise SyncError(f"'{directory}' is not a directory")
+    os.makedirs(directory, exist_ok=True)
+
+    started = time.monotonic()
+    own_session = session is None
+    if own_session:
+        session = client_download.make_session(workers)
+    try:
+        remote = fetch_manifest(session, base_url, prefix, retries)
+        cache = load_cache(directory)
+        local = scan(directory, cache)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            if direction == "push":
+                hashed = hash_missing(directory, local, list(local), pool)
+                todo = [rel for rel, entry in local.items()
+                        if remote_name(rel, prefix) not in remote
+                        or not same_content(entry, remote[remote_name(rel, prefix)])]
+                sizes = {rel: local[rel]["size"] for rel in todo}
+                stale = []
+            else:
+                wanted = {}
+                for name, entry in remote.items():
+                    rel = local_relpath(name, prefix)
+                    if safe_relpath(rel):
+                        wanted[rel] = entry
+                    else:
+                        print(f"Skipping '{name}': not a safe local path")
+                hashed = hash_missing(directory, local, [rel for rel in wanted if rel in local], pool)
+                todo = [rel for rel, entry in wanted.items() if rel not in local or not same_content(local[rel], entry)]
+                sizes = {rel: wanted[rel].get("size") or 0 for rel in todo}
+                stale = sorted(rel for rel in local if rel not in wanted) if delete else []
+
+            print(f"{len(local)} local files ({hashed} hashed), {len(remote)} on the server: "
+                  f"{len(todo)} to {direction}" + (f", {len(stale)} to delete" if stale else ""))
+            report = {
+                "direction": direction,
+                "local": len(local),
+                "remote": len(remote),
+                "hashed": hashed,
+                "transferred": 0,
+                "bytes": 0,
+                "deleted": 0,
+                "errors": {},
+            }
+            if dry_run:
+                report["planned"] = todo
+                report["stale"] = stale
+                report["elapsed"] = time.monotonic() - started
+                return report
+
+            progress = Progress(len(todo), sum(sizes.values()))
+
+            def transfer(rel):
+                path = os.path.join(directory, *rel.split("/"))
+                name = remote_name(rel, prefix)
+                if direction == "push":
+                    if sizes[rel] >= LARGE_FILE_SIZE:
+                        result = client_upload.upload_file(path, base_url, workers, retries=retries,
+                                                           session=session, name=name)
+                    else:
+                        result = push_small(session, base_url, path, name, local[rel]["sha256"], retries)
+                    entry = local[rel]
+                    sha256, uploaded_at = result.get("sha256") or entry["sha256"], None
+                else:
+                    os.makedirs(os.path.dirname(path) or directory, exist_ok=True)
+                    expected = wanted[rel].get("sha256")
+                    if sizes[rel] >= LARGE_FILE_SIZE:
+                        tmp = path + TMP_SUFFIX
+                        result = client_download.download_file(name, base_url, workers, session=session,
+                                                               local_path=tmp)
+                        if expected and result.get("sha256") != expected:
+                            raise SyncError(f"'{name}' changed on the server while syncing")
+                        os.replace(tmp, path)
+                        sha256 = result.get("sha256") or expected
+                    else:
+                        sha256 = pull_small(session, base_url, name, path, expected, retries)
+                    st = os.stat(path)
+                    entry = local[rel] = {"size": st.st_size, "mtime": st.st_mtime_ns}
+                    uploaded_at = wanted[rel]["uploadedAt"]
+                # Cache the hash only if the file still is what was sent
+                st = os.stat(path)
+                if st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime"]:
+                    entry.update(sha256=sha256, uploadedAt=uploaded_at)
+                else:
+                    entry["sha256"] = None
+                progress.update(sizes[rel])
+
+            def run(rels):
+                futures = {pool.submit(transfer, rel): rel for rel in rels}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                        report["transferred"] += 1
+                        report["bytes"] += sizes[futures[future]]
+                    except (SyncError, client_upload.UploadError, client_download.DownloadError,
+                            requests.exceptions.RequestException, OSError) as e:
+                        report["errors"][futures[future]] = str(e)
+
+            # Small files share the pool; a large one gets every connection
+            run([rel for rel in todo if sizes[rel] < LARGE_FILE_SIZE])
+            for rel in sorted((rel for rel in todo if sizes[rel] >= LARGE_FILE_SIZE), key=sizes.get):
+                run([rel])
+
+        for rel in stale:
+            try:
+                os.remove(os.path.join(directory, *rel.split("/")))
+                local.pop(rel)
+                report["deleted"] += 1
+            except OSError as e:
+                report["errors"][rel] = str(e)
+
+        save_cache(directory, {rel: entry for rel, entry in local.items() if entry.get("sha256")})
+        report["elapsed"] = time.monotonic() - started
+        return report
+    except requests.exceptions.RequestException as e:
+        raise SyncError(str(e)) from e
+    finally:
+        if own_session:
+            session.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mirror a directory to (push) or from (pull) the server.")
+    parser.add_argument("direction", choices=("push", "pull"))
+    parser.add_argument("directory", help="local directory to mirror")
+    parser.add_argument("--url", default=BASE_URL, help=f"server base URL (default {BASE_URL})")
+    parser.add_argument("--prefix", default="", help="server names start with this (no '/')")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="concurrent transfers")
+    parser.add_argument("--retries", type=int, default=RETRIES, help="retries per request")
+    parser.add_argument("--delete", action="store_true", help="pull: remove local files the server does not have")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be transferred")
+    args = parser.parse_args(argv)
+    if args.delete and args.direction == "push":
+        parser.error("--delete only works with pull; the server has no delete endpoint")
+
+    try:
+        report = sync(args.direction, args.directory, args.url, args.prefix, args.workers,
+                      delete=args.delete, dry_run=args.dry_run, retries=args.retries)
+    except (SyncError, client_upload.UploadError, OSError) as e:
+        print(f"Error syncing '{args.directory}': {e}")
+        return 1
+
+    if args.dry_run:
+        for rel in report["planned"]:
+            print(f"{args.direction} {rel}")
+        for rel in report["stale"]:
+            print(f"delete {rel}")
+        return 0
+    deleted = f", deleted {report['deleted']}" if report["deleted"] else ""
+    print(f"\n{args.direction.capitalize()}ed {report['transferred']} files ({report['bytes']} bytes)"
+          f"{deleted} in {report['elapsed']:.2f}s")
+    for rel, error in report["errors"].items():
+        print(f"FAILED {rel}: {error}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,64 +1,418 @@
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import argparse
+import hashlib
+import json
 import os
 import math
+import random
 import sys
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
 
 BASE_URL = "http://localhost:8000"
-CHUNK_SIZE = 100 * 1024  # 100KB
+MIN_CHUNK_SIZE = 256 * 1024  # 256KB
+MAX_CHUNK_SIZE = 16 * 1024 * 1024  # 16MB
+TARGET_CHUNKS = 256
+WORKERS = 4
+RETRIES = 5
+BACKOFF = 0.5  # seconds, doubled on every retry
+HASH_READ_SIZE = 4 * 1024 * 1024
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)  # preferred first
+COMPRESS_MAX_RATIO = 0.9  # a chunk that shrinks less than this goes raw
+CHECKSUM = "crc32c" if crc32c is not None else "crc32"  # sent with every chunk
 
-def upload_file(file_path):
-    if not os.path.exists(file_path):
-        print(f"Error: File '{file_path}' not found.")
-        return
 
-    file_size = os.path.getsize(file_path)
-    total_chunks = math.ceil(file_size / CHUNK_SIZE)
-    filename = os.path.basename(file_path)
+class UploadError(Exception):
+    pass
+
 
-    print(f"Uploading '{filename}' ({file_size} bytes) in {total_chunks} chunks...")
+def choose_chunk_size(file_size, workers=WORKERS):
+    """Pick a chunk size that keeps every worker busy on small files and keeps
+    the number of requests reasonable on large ones.
 
+    This goes by file size alone: a session's chunk size is fixed when it is
+    created, so it cannot follow the throughput measured while sending.
+    """
+    size = max(file_size // max(TARGET_CHUNKS, workers), MIN_CHUNK_SIZE)
+    size = 1 << (size - 1).bit_length()  # round up to a power of two
+    return min(size, MAX_CHUNK_SIZE)
+
+
+def hash_file(file_path, chunk_size):
+    """SHA-256 of the whole file and of each chunk, in one read."""
+    digest = hashlib.sha256()
+    chunk_hashes = []
     with open(file_path, "rb") as f:
-        chunk_number = 1
         while True:
-            chunk = f.read(CHUNK_SIZE)
-            if not chunk:
-                break
-
-            is_started = (chunk_number == 1)
-            is_completed = (chunk_number == total_chunks)
-            
-            # Base64 encode
-            data_b64 = base64.b64encode(chunk).decode('utf-8')
-
-            payload = {
-                "data": data_b64,
-                "chunkNumber": chunk_number,
-                "totalChunks": total_chunks,
-                "fileName": filename,
-                "isStarted": is_started,
-                "isCompleted": is_completed
-            }
+            chunk = hashlib.sha256()
+            left = chunk_size
+            while left > 0:
+                data = f.read(min(HASH_READ_SIZE, left))
+                if not data:
+                    break
+                digest.update(data)
+                chunk.update(data)
+                left -= len(data)
+            if left == chunk_size:
+                return digest.hexdigest(), chunk_hashes
+            chunk_hashes.append(chunk.hexdigest())
 
-            try:
-                response = requests.post(f"{BASE_URL}/test1", json=payload)
+
+def pick_encoding(server_encodings):
+    """The first encoding both sides support, or None (old servers list none)."""
+    return next((e for e in ENCODINGS if e in (server_encodings or ())), None)
+
+
+class ChunkEncoder:
+    """Compresses chunks for the wire while that pays off: once a chunk
+    shrinks by less than 10%, the file is taken to be incompressible and
+    the remaining chunks go raw."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+
+    def encode(self, data):
+        """(body, Content-Encoding or None) to send for one chunk."""
+        encoding = self.encoding
+        if encoding is None:
+            return data, None
+        if encoding == "zstd":
+            body = zstandard.ZstdCompressor(level=3).compress(data)
+        else:
+            c = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = c.compress(data) + c.flush()
+        if len(body) > len(data) * COMPRESS_MAX_RATIO:
+            self.encoding = None
+            return data, None
+        return body, encoding
+
+
+def make_session(workers=WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def journal_path(file_path):
+    return f"{file_path}.upload.json"
+
+
+def load_journal(file_path, base_url, file_size, mtime):
+    """Return the session id and chunk layout of an unfinished upload of this
+    exact file, or None if there is nothing to resume. Which chunks are
+    still needed is asked of the server, which knows better than we do."""
+    try:
+        with open(journal_path(file_path)) as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if header.get("baseUrl") != base_url or header.get("fileSize") != file_size or header.get("mtime") != mtime:
+        return None
+    return header
+
+
+def start_journal(file_path, header):
+    with open(journal_path(file_path), "w") as f:
+        f.write(json.dumps(header) + "\n")
+
+
+def remove_journal(file_path):
+    try:
+        os.remove(journal_path(file_path))
+    except FileNotFoundError:
+        pass
+
+
+def chunk_checksum(data):
+    """X-Chunk-Checksum of a chunk's uncompressed bytes."""
+    if CHECKSUM == "crc32c":
+        return f"crc32c={crc32c.crc32c(data):08x}"
+    return f"crc32={zlib.crc32(data):08x}"
+
+
+def bad_digest(response):
+    # The server saw different bytes than were sent; sending again may fix it
+    if response.status_code != 400:
+        return False
+    try:
+        detail = response.json().get("detail")
+    except ValueError:
+        return False
+    return isinstance(detail, dict) and detail.get("code") == "BadDigest"
+
+
+def never_sent(error):
+    """Whether a request failed before it reached the server."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def refused(response):
+    # Turned away before anything was done: rate limited, or shed with a
+    # Retry-After while the server or its storage is overloaded
+    return response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers)
+
+
+def request_with_retry(session, method, url, retries=RETRIES, idempotent=None, **kwargs):
+    """Send a request, retrying connection errors, 5xx, 429 and checksum
+    mismatches with exponential backoff and jitter. Other 4xx responses fail
+    immediately.
+
+    A request that is not `idempotent` (by default any POST) is only sent
+    again when the server cannot have applied it: the connection was never
+    made, or the server refused it. Otherwise a retry could repeat work that
+    already happened, such as a commit whose response was lost.
+    """
+    if idempotent is None:
+        idempotent = method.upper() != "POST"
+    for attempt in range(retries + 1):
+        try:
+            response = session.request(method, url, timeout=(10, 120), **kwargs)
+            if response.status_code < 500 and response.status_code != 429 and not bad_digest(response):
                 response.raise_for_status()
-                result = response.json()
-                
-                print(f"Chunk {chunk_number}/{total_chunks}: {result.get('status')} - {result.get('message', '')}")
-                
-                if is_completed:
-                    print("\nUpload Complete!")
-                    print(f"Blob URL: {result.get('url')}")
-                    
-            except requests.exceptions.RequestException as e:
-                print(f"\nError uploading chunk {chunk_number}: {e}")
+                return response
+            error = UploadError(f"{method} {url} returned {response.status_code}: {response.text[:200]}")
+            if not idempotent and not refused(response) and not bad_digest(response):
+                raise error
+        except requests.exceptions.HTTPError as e:
+            raise UploadError(f"{method} {url} failed: {e.response.status_code} {e.response.text[:200]}") from e
+        except requests.exceptions.RequestException as e:
+            if not idempotent and not never_sent(e):
+                raise UploadError(f"{method} {url} failed: {e}") from e
+            error = e
+
+        if attempt == retries:
+            raise UploadError(f"{method} {url} failed after {retries + 1} attempts: {error}") from error
+        retry_after = None
+        if not isinstance(error, requests.exceptions.RequestException):
+            retry_after = response.headers.get("Retry-After")
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else BACKOFF * (2 ** attempt)
+        time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+def wait_for_job(session, base_url, job_id, retries=RETRIES, poll=30):
+    """Long-poll a server-side finalize job until it ends; returns its result."""
+    while True:
+        job = request_with_retry(session, "GET", f"{base_url}/jobs/{job_id}", retries, params={"wait": poll}).json()
+        if job["status"] == "completed":
+            return job["result"]
+        if job["status"] == "failed":
+            raise UploadError(f"Finalizing failed: {job.get('error')}")
+
+
+class Progress:
+    def __init__(self, total_bytes, done_bytes=0, interval=0.5):
+        self.total = total_bytes
+        self.done = done_bytes
+        self.sent = 0
+        self.wire = 0  # bytes actually sent, after compression
+        self.interval = interval
+        self.started = time.monotonic()
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def update(self, nbytes, wire=None):
+        with self._lock:
+            self.done += nbytes
+            self.sent += nbytes
+            self.wire += nbytes if wire is None else wire
+            now = time.monotonic()
+            if now - self._last < self.interval and self.done < self.total:
                 return
+            self._last = now
+        pct = 100 * self.done / self.total if self.total else 100
+        sys.stdout.write(f"\rUploaded {self.done}/{self.total} bytes ({pct:.1f}%) at {self.rate():.2f} MB/s")
+        sys.stdout.flush()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.sent / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+
+
+def upload_file(file_path, base_url=BASE_URL, workers=WORKERS, chunk_size=None,
+                retries=RETRIES, resume=True, session=None, dedup=True, compress=True, name=None):
+    """Upload a file through the chunk session API with a pool of workers.
+
+    The session is journaled next to the file, so running this again after
+    a crash asks the server which chunks it still needs and sends only those. With `dedup`, the file
+    is hashed first: content the server already stores is linked in one
+    request, and chunks it already has are not sent. With `compress`,
+    chunks are sent compressed in an encoding the server offers, for as
+    long as they shrink. The file is stored under `name`, by default its
+    own name. Returns the commit response plus transfer statistics; raises
+    UploadError on failure.
+    """
+    if not os.path.exists(file_path):
+        raise UploadError(f"File '{file_path}' not found.")
+
+    file_size = os.path.getsize(file_path)
+    mtime = os.path.getmtime(file_path)
+    filename = name or os.path.basename(file_path)
+    if file_size == 0:
+        raise UploadError("Empty files cannot be uploaded in chunks.")
+
+    sha256 = None
+    own_session = session is None
+    if own_session:
+        session = make_session(workers)
+
+    try:
+        header = load_journal(file_path, base_url, file_size, mtime) if resume else None
+        missing = None
+        if header:
+            try:
+                status = request_with_retry(session, "GET", f"{base_url}/sessions/{header['sessionId']}", retries).json()
+                missing = status["missing"]
+                sha256 = header.get("sha256")
+                print(f"Resuming upload of '{filename}': {len(missing)}/{header['totalChunks']} chunks left")
+            except UploadError:
+                header = None
+
+        if not header:
+            chunk_size = chunk_size or choose_chunk_size(file_size, workers)
+            total_chunks = math.ceil(file_size / chunk_size)
+            init = {
+                "fileName": filename,
+                "totalChunks": total_chunks,
+                "chunkSize": chunk_size,
+                "fileSize": file_size,
+            }
+            if dedup:
+                started = time.monotonic()
+                sha256, chunk_hashes = hash_file(file_path, chunk_size)
+                try:
+                    # Safe to repeat: at most it links the same content to the name again
+                    check = request_with_retry(session, "POST", f"{base_url}/check-hashes", retries, idempotent=True, json={
+                        "fileName": filename, "sha256": sha256, "size": file_size, "chunkHashes": chunk_hashes,
+                    }).json()
+                except UploadError as e:
+                    print(f"Hash check failed, uploading everything: {e}")
+                    check = {}
+                if check.get("status") == "completed":
+                    check["elapsed"] = time.monotonic() - started
+                    check["mbps"] = 0.0
+                    print(f"'{filename}' is already on the server, linked without sending it.")
+                    print(f"Blob URL: {check.get('url')}")
+                    return check
+                init["sha256"] = sha256
+                init["chunkHashes"] = chunk_hashes
+            # A repeat after a lost response leaves an unused session behind to expire
+            init = request_with_retry(session, "POST", f"{base_url}/sessions", retries, idempotent=True, json=init).json()
+            header = {
+                "sessionId": init["sessionId"],
+                "baseUrl": base_url,
+                "fileSize": file_size,
+                "mtime": mtime,
+                "chunkSize": chunk_size,
+                "totalChunks": total_chunks,
+                "encoding": pick_encoding(init.get("encodings")),
+                "sha256": sha256,
+            }
+            start_journal(file_path, header)
+            missing = init.get("missing", list(range(total_chunks)))
+            if len(missing) < total_chunks:
+                print(f"Server already has {total_chunks - len(missing)}/{total_chunks} chunks")
+            print(f"Uploading '{filename}' ({file_size} bytes) in {total_chunks} chunks of {chunk_size} bytes with {workers} workers...")
+
+        session_url = f"{base_url}/sessions/{header['sessionId']}"
+        chunk_size = header["chunkSize"]
+        done_bytes = file_size - sum(min(chunk_size, file_size - i * chunk_size) for i in missing)
+        progress = Progress(file_size, done_bytes)
+        encoder = ChunkEncoder(header.get("encoding") if compress else None)
+
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            def send_chunk(index):
+                data = os.pread(fd, chunk_size, index * chunk_size)
+                body, encoding = encoder.encode(data)
+                headers = {"Content-Type": "application/octet-stream", "X-Chunk-Checksum": chunk_checksum(data)}
+                if encoding:
+                    headers["Content-Encoding"] = encoding
+                request_with_retry(
+                    session, "PUT", f"{session_url}/chunks/{index}", retries, data=body, headers=headers,
+                )
+                progress.update(len(data), len(body))
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(send_chunk, index) for index in missing]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
+
+        result = request_with_retry(session, "POST", f"{session_url}/commit", retries).json()
+        if "jobId" in result:
+            print("\nFinalizing on the server...")
+            result = wait_for_job(session, base_url, result["jobId"], retries)
+        remove_journal(file_path)
+        # The server hashed the chunks as they arrived; with the file hashed
+        # here too, both ends agree on the whole content
+        if sha256 is not None and result.get("sha256") not in (None, sha256):
+            raise UploadError(f"Server stored sha256 {result['sha256']}, the file has {sha256}")
+
+        result["elapsed"] = progress.elapsed()
+        result["mbps"] = progress.rate()
+        result["wireBytes"] = progress.wire
+        print(f"\n\nUpload Complete! {progress.sent} bytes in {result['elapsed']:.2f}s ({result['mbps']:.2f} MB/s)")
+        if progress.wire != progress.sent:
+            print(f"Sent {progress.wire} bytes on the wire ({header['encoding']})")
+        print(f"Blob URL: {result.get('url')}")
+        if result.get("sha256"):
+            print(f"SHA-256: {result['sha256']}{' (verified)' if sha256 else ''}")
+        return result
+    finally:
+        if own_session:
+            session.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload a file in parallel, resumable chunks.")
+    parser.add_argument("file", help="path of the file to upload")
+    parser.add_argument("--url", default=BASE_URL, help=f"server base URL (default {BASE_URL})")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="concurrent chunk uploads")
+    parser.add_argument("--chunk-size", type=int, help="chunk size in bytes (default: chosen from file size)")
+    parser.add_argument("--retries", type=int, default=RETRIES, help="retries per chunk")
+    parser.add_argument("--no-resume", action="store_true", help="ignore any existing resume journal")
+    parser.add_argument("--no-dedup", action="store_true", help="send every chunk without asking what the server has")
+    parser.add_argument("--no-compress", action="store_true", help="send chunks uncompressed")
+    args = parser.parse_args(argv)
+
+    try:
+        upload_file(args.file, args.url, args.workers, args.chunk_size, args.retries,
+                    resume=not args.no_resume, dedup=not args.no_dedup, compress=not args.no_compress)
+    except UploadError as e:
+        print(f"\nError uploading '{args.file}': {e}")
+        if os.path.exists(journal_path(args.file)):
+            print("Run the same command again to resume.")
+        return 1
+    return 0
 
-            chunk_number += 1
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-    else:
-        upload_file(sys.argv[1])
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import asyncio
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Preferred first; zstd only when the zstandard package is installed
+SUPPORTED = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", 3))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+# Re-encoding plain objects per download costs CPU and drops Content-Length,
+# so it is opt-in; objects stored compressed are sent as they are regardless
+COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "0") == "1"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 4096))
+COMPRESS_MAX_SIZE = int(os.getenv("COMPRESS_MAX_SIZE", 64 * 1024 * 1024))
+# A sample that shrinks less than this is not worth the CPU
+COMPRESS_MAX_RATIO = 0.9
+SAMPLE_SIZE = 64 * 1024
+DECODE_PIECE = 1024 * 1024  # most decompressed output produced at a time
+
+# Formats that are compressed already; not worth another pass
+INCOMPRESSIBLE = {
+    ".gz", ".tgz", ".zst", ".zip", ".7z", ".xz", ".bz2", ".br", ".lz4", ".rar",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".heic",
+    ".mp3", ".mp4", ".m4a", ".mkv", ".mov", ".webm", ".ogg", ".flac",
+    ".parquet", ".jar", ".whl", ".apk", ".docx", ".xlsx", ".pptx",
+}
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def store_encoding():
+    """The encoding objects are stored in (STORE_COMPRESSED), or None."""
+    value = os.getenv("STORE_COMPRESSED", "").strip().lower()
+    if value in ("", "0", "none", "identity"):
+        return None
+    if value not in SUPPORTED:
+        raise UnsupportedEncoding(f"STORE_COMPRESSED={value} is not one of {', '.join(SUPPORTED)}")
+    return value
+
+
+def request_encoding(content_encoding):
+    """The encoding of a request body from its Content-Encoding header;
+    None for identity."""
+    value = (content_encoding or "").strip().lower()
+    if value in ("", "identity"):
+        return None
+    if value not in SUPPORTED:
+        raise UnsupportedEncoding(f"Content-Encoding {value} is not supported; use {', '.join(SUPPORTED)}")
+    return value
+
+
+def _accepted(accept_encoding):
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate(accept_encoding, prefer=None):
+    """The encoding to answer with for an Accept-Encoding header, or None
+    for identity. `prefer` (the stored encoding) wins any tie, since it can
+    be sent as is."""
+    accepted = _accepted(accept_encoding)
+    candidates = [prefer] if prefer in SUPPORTED else []
+    candidates += [e for e in SUPPORTED if e != prefer]
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressible(name, size):
+    if size is None or not COMPRESS_MIN_SIZE <= size <= COMPRESS_MAX_SIZE:
+        return False
+    return os.path.splitext(name)[1].lower() not in INCOMPRESSIBLE
+
+
+class _Gzip:
+    def __init__(self):
+        self._z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._z.compress(data)
+
+    def flush(self):
+        return self._z.flush()
+
+
+class _Zstd:
+    def __init__(self):
+        self._z = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._z.compress(data)
+
+    def flush(self):
+        return self._z.flush()
+
+
+def compressor(encoding):
+    return _Zstd() if encoding == "zstd" else _Gzip()
+
+
+def compress(data, encoding):
+    c = compressor(encoding)
+    return c.compress(data) + c.flush()
+
+
+def ratio(sample, encoding):
+    """Compressed size over raw size for a sample of a body."""
+    return len(compress(sample, encoding)) / len(sample) if sample else 1.0
+
+
+# Both zlib and zstandard release the GIL, so every call but the tiny ones
+# goes to a thread and the event loop keeps serving other requests
+async def _run(fn, data):
+    if len(data) < 16 * 1024:
+        return fn(data)
+    return await asyncio.to_thread(fn, data)
+
+
+async def encode(chunks, encoding):
+    """Compress an async stream of chunks."""
+    c = compressor(encoding)
+    async for data in chunks:
+        out = await _run(c.compress, data)
+        if out:
+            yield out
+    out = c.flush()
+    if out:
+        yield out
+
+
+async def _gunzip(chunks):
+    z = zlib.decompressobj(31)
+    async for data in chunks:
+        while data:
+            out = await _run(lambda data: z.decompress(data, DECODE_PIECE), data)
+            data = z.unconsumed_tail
+            if out:
+                yield out
+    # Output held back by the last call's limit
+    while not z.eof:
+        out = z.decompress(b"", DECODE_PIECE)
+        if not out:
+            raise ValueError("Truncated gzip stream")
+        yield out
+
+
+class _Feed:
+    """The request body as a file for zstandard's read_to_iter, which runs
+    in a worker thread: each read() takes the next chunk from the event
+    loop, so input is pulled only as fast as output is consumed."""
+
+    def __init__(self, chunks, loop):
+        self.chunks = chunks
+        self.loop = loop
+        self.buffer = b""
+        self.eof = False
+        self.closed = False
+        self.pending = None
+
+    def read(self, size):
+        while not self.buffer and not self.eof:
+            if self.closed:
+                raise ValueError("Body closed")
+            self.pending = asyncio.run_coroutine_threadsafe(self._next(), self.loop)
+            self.buffer = self.pending.result()
+            self.eof = not self.buffer
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    async def _next(self):
+        async for data in self.chunks:
+            if data:
+                return data
+        return b""
+
+    def close(self):
+        self.closed = True
+        if self.pending is not None:
+            self.pending.cancel()
+
+
+async def _unzstd(chunks):
+    # decompressobj() returns all the output of a call at once, and a few
+    # bytes of zstd can expand to megabytes; read_to_iter yields bounded pieces
+    feed = _Feed(chunks, asyncio.get_running_loop())
+    pieces = zstandard.ZstdDecompressor().read_to_iter(feed, read_size=DECODE_PIECE, write_size=DECODE_PIECE)
+    try:
+        while True:
+            out = await asyncio.to_thread(next, pieces, None)
+            if out is None:
+                break
+            if out:
+                yield out
+    finally:
+        feed.close()
+    # read_to_iter stops quietly at the end of the input; it only reaches
+    # it before the end of the frame when the stream was cut short
+    if feed.eof:
+        raise ValueError("Truncated zstd stream")
+
+
+async def decode(chunks, encoding):
+    """Decompress an async stream of chunks into pieces of at most
+    DECODE_PIECE bytes; DecodeError if it is corrupt or cut short."""
+    pieces = _unzstd(chunks) if encoding == "zstd" else _gunzip(chunks)
+    try:
+        async for out in pieces:
+            yield out
+    except (zlib.error, ValueError) as e:
+        raise DecodeError(f"Bad {encoding} body: {e}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise DecodeError(f"Bad {encoding} body: {e}")
+        raise
+    finally:
+        await pieces.aclose()
+
+
+async def decode_range(chunks, encoding, start=None, end=None):
+    """Bytes start..end (inclusive) of the decompressed stream. A compressed
+    stream cannot be entered in the middle, so everything before `start`
+    is decoded and dropped."""
+    start = 0 if start is None else start
+    position = 0
+    async for data in decode(chunks, encoding):
+        piece_end = position + len(data)
+        if piece_end > start:
+            lo = max(start - position, 0)
+            hi = len(data) if end is None else min(len(data), end + 1 - position)
+            if hi > lo:
+                yield data[lo:hi]
+        position = piece_end
+        if end is not None and position > end:
+            return
+
+
+class EncodedUpload:
+    """A storage upload that compresses what is written to it. `size` counts
+    the bytes written (the content), `stored_size` what went to storage."""
+
+    def __init__(self, upload, encoding):
+        self.pathname = upload.pathname
+        self.encoding = encoding
+        self.size = 0
+        self._upload = upload
+        self._compressor = compressor(encoding)
+
+    @property
+    def stored_size(self):
+        return self._upload.size
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        out = await _run(self._compressor.compress, data)
+        if out:
+            await self._upload.write(out)
+
+    async def close(self) -> dict:
+        await self._upload.write(self._compressor.flush())
+        return await self._upload.close()
+
+    async def abort(self):
+        await self._upload.abort()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+CONTENT_CACHE_MAX_BYTES = int(os.getenv("CONTENT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CONTENT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("CONTENT_CACHE_MAX_ENTRY_BYTES", CONTENT_CACHE_MAX_BYTES // 4))
+
+
+class ContentCache:
+    """Byte-budgeted LRU cache of blob bodies on local disk.
+
+    Entries are keyed by blob URL, which already changes with every upload
+    because pathnames carry a timestamp, so an entry never goes stale; it
+    only has to be dropped when the blob is deleted. Bodies are added by
+    tee(), which writes a full upstream response to disk while it is being
+    relayed to the client.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = CONTENT_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = CONTENT_CACHE_MAX_ENTRY_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._filling = set()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        # Pick up what a previous process left behind, oldest first. Done
+        # under the lock by the first call that needs it, not at import.
+        if self._loaded:
+            return
+        self._loaded = True
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.directory.iterdir():
+            if path.suffix == ".tmp":
+                path.unlink(missing_ok=True)
+            elif path.is_file():
+                stat = path.stat()
+                files.append((stat.st_mtime, path.name, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._bytes += size
+        self._evict()
+
+    def _key(self, blob):
+        return hashlib.sha256(blob["url"].encode()).hexdigest()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            (self.directory / key).unlink(missing_ok=True)
+
+    def get(self, blob):
+        """Path of the cached body of `blob`, or None on a miss."""
+        key = self._key(blob)
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        return self.directory / key
+
+    def cacheable(self, blob):
+        size = blob.get("size")
+        return size is not None and 0 < size <= self.max_entry_bytes
+
+    async def tee(self, blob, chunks):
+        """Relay `chunks` (the full body of `blob`) and store them on the way.
+        The file is written from a worker thread; `chunks` is closed however
+        the relay ends, and a partial file is dropped."""
+        key = self._key(blob)
+        with self._lock:
+            self._load()
+            skip = not self.cacheable(blob) or key in self._entries or key in self._filling
+            if not skip:
+                self._filling.add(key)
+        if skip:
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await chunks.aclose()
+            return
+
+        tmp = self.directory / f"{key}.{uuid.uuid4().hex}.tmp"
+        written = 0
+        f = None
+        try:
+            f = await asyncio.to_thread(open, tmp, "wb")
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                written += len(chunk)
+                yield chunk
+            await asyncio.to_thread(f.close)
+            if written == blob["size"]:
+                os.replace(tmp, self.directory / key)
+                with self._lock:
+                    self._entries[key] = written
+                    self._bytes += written
+                    self._evict()
+        finally:
+            if f is not None:
+                f.close()
+            await chunks.aclose()
+            tmp.unlink(missing_ok=True)
+            with self._lock:
+                self._filling.discard(key)
+
+    def invalidate(self, blob):
+        key = self._key(blob)
+        with self._lock:
+            self._load()
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._bytes -= size
+        (self.directory / key).unlink(missing_ok=True)
+
+
+def iter_file(path, start, end, chunk_size):
+    """Bytes start..end (inclusive) of a local file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
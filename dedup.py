@@ -0,0 +1,229 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import compression
+from blob_index import STAGING_PREFIX, object_pathname, ref_pathname
+
+HASH_READ_SIZE = 4 * 1024 * 1024
+
+
+class ContentHasher:
+    """SHA-256 of a body fed in pieces, and of each `chunk_size` chunk of it."""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._chunk = hashlib.sha256()
+        self._chunk_left = chunk_size
+        self._chunk_hashes = []
+
+    def update(self, data):
+        self._digest.update(data)
+        view = memoryview(data)
+        while view:
+            piece = view[:self._chunk_left]
+            self._chunk.update(piece)
+            self._chunk_left -= len(piece)
+            view = view[len(piece):]
+            if self._chunk_left == 0:
+                self._chunk_hashes.append(self._chunk.hexdigest())
+                self._chunk = hashlib.sha256()
+                self._chunk_left = self.chunk_size
+        self.size += len(data)
+
+    def finish(self):
+        """(sha256, chunk hashes); a trailing partial chunk counts as a chunk."""
+        chunk_hashes = list(self._chunk_hashes)
+        if self._chunk_left != self.chunk_size:
+            chunk_hashes.append(self._chunk.hexdigest())
+        return self._digest.hexdigest(), chunk_hashes
+
+
+def hash_file(path, size, chunk_size):
+    """SHA-256 of the first `size` bytes of a file, and of each
+    `chunk_size` chunk of it, in one pass."""
+    hasher = ContentHasher(chunk_size)
+    with open(path, "rb") as f:
+        while hasher.size < size:
+            data = f.read(min(HASH_READ_SIZE, size - hasher.size))
+            if not data:
+                raise ValueError(f"File is shorter than {size} bytes")
+            hasher.update(data)
+    return hasher.finish()
+
+
+def is_sha256(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def staging_pathname():
+    return f"{STAGING_PREFIX}{uuid.uuid4().hex}"
+
+
+class ContentStore:
+    """Content-addressed objects in a storage backend.
+
+    Every distinct body is stored once under objects/{sha256}, and names
+    point at it through ref blobs (see blob_index.ref_pathname). Objects
+    never change, so which ones exist is remembered in-process. A local
+    SQLite table records where each chunk hash seen in a committed upload
+    sits inside its object, so a new session can be filled from the store
+    instead of the client resending those bytes. That table is only a hint:
+    losing it just means chunks get sent again.
+
+    With an `encoding`, objects are stored compressed under
+    objects/{sha256}.{suffix}; their blobs carry "encoding", and "size" is
+    the content's size when known (None after a restart, as only the
+    stored size can be looked up).
+    """
+
+    def __init__(self, storage, path: Path, encoding=None):
+        self.storage = storage
+        self.encoding = encoding
+        self._objects = {}
+        self._lock = threading.Lock()
+        self.path = path
+        self._connection = None
+        self._open_lock = threading.Lock()
+
+    @property
+    def _db(self):
+        # Opened by the first lookup or record rather than at import
+        if self._connection is None:
+            with self._open_lock:
+                if self._connection is None:
+                    self._connection = self._open()
+        return self._connection
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                sha256 TEXT PRIMARY KEY,
+                object TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS chunks_object ON chunks (object)")
+        return db
+
+    def object_pathname(self, sha256):
+        return object_pathname(sha256, self.encoding)
+
+    def _object(self, blob, size=None):
+        if self.encoding is None:
+            return blob
+        return {**blob, "encoding": self.encoding, "storedSize": blob.get("size"), "size": size}
+
+    def find(self, sha256):
+        """The object holding content `sha256`, or None. Blocks on a miss."""
+        blob = self._objects.get(sha256)
+        if blob is None:
+            blob = self.storage.stat(self.object_pathname(sha256))
+            if blob is not None:
+                blob = self._object(blob)
+                self._objects[sha256] = blob
+        return blob
+
+    def added(self, sha256, blob, size=None):
+        """Remember a stored object; `size` is its content size."""
+        self._objects[sha256] = self._object(blob, size)
+
+    def open_upload(self, sha256=None):
+        """A streaming upload of content: straight to the object for
+        `sha256`, or to a staging name when the hash is not known yet."""
+        upload = self.storage.open_upload(self.object_pathname(sha256) if sha256 else staging_pathname())
+        return compression.EncodedUpload(upload, self.encoding) if self.encoding else upload
+
+    def _put(self, sha256, data):
+        stored = compression.compress(data, self.encoding) if self.encoding else data
+        blob = self.storage.put(self.object_pathname(sha256), stored)
+        self.added(sha256, blob, len(data))
+        return self._objects[sha256]
+
+    def put(self, sha256, data):
+        """Store `data` unless its object already exists; returns the object."""
+        blob = self.find(sha256)
+        if blob is None:
+            blob = self._put(sha256, data)
+        return blob
+
+    def store(self, sha256, data):
+        """Like put(), without asking the store first. For small bodies
+        rewriting an object with the same bytes costs less than the lookup."""
+        blob = self._objects.get(sha256)
+        if blob is None:
+            blob = self._put(sha256, data)
+        return blob
+
+    def adopt(self, staged, sha256, size=None):
+        """Turn a blob uploaded under a staging name into the object for
+        `sha256`, or drop it if that object already exists."""
+        blob = self.find(sha256)
+        if blob is not None:
+            self.storage.delete([staged["url"]])
+            return blob
+        blob = self.storage.rename(staged, self.object_pathname(sha256))
+        self.added(sha256, blob, size)
+        return self._objects[sha256]
+
+    def link(self, name, sha256, size):
+        """Point `name` at content `sha256` with a new ref; returns the ref."""
+        return self.storage.put(ref_pathname(int(time.time()), sha256, size, name, self.encoding), b"")
+
+    def forget(self, sha256):
+        """Drop what is known of an object about to be deleted: the next
+        find() asks the store, and its chunks are no longer offered for
+        copying."""
+        self._objects.pop(sha256, None)
+        with self._lock:
+            self._db.execute("DELETE FROM chunks WHERE object = ?", (sha256,))
+
+    def index_chunks(self, sha256, size, chunk_size, chunk_hashes):
+        rows = [
+            (h, sha256, i * chunk_size, min(chunk_size, size - i * chunk_size))
+            for i, h in enumerate(chunk_hashes)
+        ]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+
+    def locate_chunks(self, chunk_hashes):
+        """{index: (object sha256, offset, length)} for the chunk hashes
+        whose bytes are already in the store."""
+        wanted = {}
+        for i, h in enumerate(chunk_hashes):
+            wanted.setdefault(h, []).append(i)
+        found = {}
+        hashes = list(wanted)
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT sha256, object, offset, length FROM chunks WHERE sha256 IN ({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for h, obj, offset, length in rows:
+                    for i in wanted[h]:
+                        found[i] = (obj, offset, length)
+        return found
+
+    def object_chunks(self, sha256):
+        """[(offset, length, chunk sha256)] recorded for an object, in order.
+        A chunk hash is recorded for the first object seen with it only, so
+        the list may have gaps."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT offset, length, sha256 FROM chunks WHERE object = ? ORDER BY offset", (sha256,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
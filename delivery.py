@@ -0,0 +1,41 @@
+import os
+
+from blob_index import OBJECT_PREFIX
+
+DELIVERY_MODES = ("proxy", "redirect", "auto")
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "proxy")
+# In auto mode, blobs smaller than this are cheaper to proxy than to bounce
+AUTO_REDIRECT_MIN_BYTES = int(os.getenv("AUTO_REDIRECT_MIN_BYTES", 4 * 1024 * 1024))
+
+if DELIVERY_MODE not in DELIVERY_MODES:
+    raise ValueError(f"DELIVERY_MODE must be one of {', '.join(DELIVERY_MODES)}")
+
+
+def choose(blob, request, mode=None):
+    """Return "proxy" or "redirect" for this request.
+
+    `mode` (from the query string) overrides DELIVERY_MODE. Clients that
+    cannot follow redirects opt out with `X-Delivery: proxy`.
+    """
+    mode = mode or DELIVERY_MODE
+    if request.headers.get("x-delivery", "").lower() == "proxy":
+        return "proxy"
+    if named_by_hash(blob) and navigating(request):
+        return "proxy"
+    if mode == "auto":
+        size = blob.get("size")
+        return "redirect" if size is not None and size >= AUTO_REDIRECT_MIN_BYTES else "proxy"
+    return mode
+
+
+def named_by_hash(blob):
+    """Whether the blob's URL names its content, not the file: uploads are
+    stored once under objects/{sha256}, and the store's downloadUrl for
+    one would save it under the hash."""
+    return f"/{OBJECT_PREFIX}" in blob["url"]
+
+
+def navigating(request):
+    # A browser saves what it was sent to under the URL's name, while our
+    # clients and scripts name files themselves
+    return request.headers.get("sec-fetch-mode") == "navigate" or "text/html" in request.headers.get("accept", "")
@@ -0,0 +1,127 @@
+import asyncio
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+RELAY_CHUNK_SIZE = int(os.getenv("RELAY_CHUNK_SIZE", 256 * 1024))  # 256 KB
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 200))
+MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", 50))
+HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1"
+
+_client = None
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401  (httpx only speaks HTTP/2 when it is installed)
+    except ImportError:
+        return False
+    return True
+
+
+def get_client() -> "httpx.AsyncClient":
+    """The app-wide pooled client for upstream blob fetches, created on first use.
+
+    httpx is imported here rather than at module level: a cold start that
+    only answers /health, or runs on a backend without upstream fetches,
+    never pays for it.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx
+
+        _client = httpx.AsyncClient(
+            http2=HTTP2 and http2_available(),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE),
+            timeout=httpx.Timeout(30.0, connect=10.0, pool=30.0),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def open_stream(url, headers=None) -> "httpx.Response":
+    """Start a GET and return once the headers are in; the caller must aclose().
+
+    Asks for identity encoding so the body can be relayed with aiter_raw()
+    without a decode/re-encode pass.
+    """
+    client = get_client()
+    request = client.build_request("GET", url, headers={"Accept-Encoding": "identity", **(headers or {})})
+    return await client.send(request, stream=True)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Upstream returned {status_code}")
+        self.status_code = status_code
+
+
+async def open_range(url, start=None, end=None) -> "httpx.Response":
+    """open_stream() for bytes start..end (inclusive) of `url`, or all of it."""
+    headers = {"Range": f"bytes={start}-{end}"} if start is not None else None
+    r = await open_stream(url, headers)
+    if r.status_code not in (200, 206):
+        await r.aclose()
+        raise UpstreamError(r.status_code)
+    return r
+
+
+async def iter_body(r, start=None, end=None, chunk_size=RELAY_CHUNK_SIZE):
+    """Relay the body of an open_range() response and close it.
+
+    If the upstream ignored the Range header and sent the whole body, the
+    requested bytes are cut out here instead.
+    """
+    try:
+        if start is None or r.status_code == 206:
+            async for chunk in r.aiter_raw(chunk_size):
+                yield chunk
+            return
+
+        skip, remaining = start, end - start + 1
+        async for chunk in r.aiter_raw(chunk_size):
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:]
+                skip = 0
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+            if not remaining:
+                break
+    finally:
+        await r.aclose()
+
+
+async def content_length(url):
+    r = await get_client().head(url, headers={"Accept-Encoding": "identity"})
+    if r.status_code != 200 or "content-length" not in r.headers:
+        raise UpstreamError(r.status_code)
+    return int(r.headers["content-length"])
+
+
+async def warm_up(url, connections=1):
+    """Open up to `connections` pooled connections to the host of `url` with
+    concurrent HEADs, so the first real fetches skip connect and TLS.
+    Returns the status codes seen (None for a failed attempt)."""
+    client = get_client()
+
+    async def head():
+        try:
+            return (await client.head(url, headers={"Accept-Encoding": "identity"})).status_code
+        except Exception as e:
+            print(f"Warning: warm-up request to {url} failed: {e}")
+            return None
+
+    return await asyncio.gather(*(head() for _ in range(connections)))
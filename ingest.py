@@ -0,0 +1,191 @@
+import asyncio
+import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 16))
+INGEST_MAX_ITEM_BYTES = int(os.getenv("INGEST_MAX_ITEM_BYTES", 8 * 1024 * 1024))
+
+TAR_BLOCK = 512
+
+
+class IngestError(ValueError):
+    pass
+
+
+class TooLarge:
+    """Stands in for the data of an item over INGEST_MAX_ITEM_BYTES."""
+
+    def __init__(self, size):
+        self.size = size
+
+
+# Puts block a thread each; the default executor can be as small as 5
+# threads, which would cap INGEST_CONCURRENCY below what was asked for
+_executor = ThreadPoolExecutor(INGEST_CONCURRENCY, thread_name_prefix="ingest")
+
+
+async def call(fn, *args):
+    """fn(*args) on the ingest thread pool. Storage calls retry transient
+    failures themselves (see upstream.Governor)."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+class _Reader:
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._buffer = bytearray()
+        self._eof = False
+
+    async def _fill(self, n):
+        while len(self._buffer) < n and not self._eof:
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+
+    async def read(self, n):
+        """Exactly n bytes, or fewer only at the end of the stream."""
+        await self._fill(n)
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    async def skip(self, n):
+        while n > 0:
+            await self._fill(min(n, 1024 * 1024))
+            if not self._buffer:
+                return
+            step = min(n, len(self._buffer))
+            del self._buffer[:step]
+            n -= step
+
+
+def _padded(size):
+    return size + (-size % TAR_BLOCK)
+
+
+def _pax_records(data):
+    records = {}
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        length = int(data[pos:space])
+        key, _, value = data[space + 1:pos + length - 1].partition(b"=")
+        records[key.decode("utf-8")] = value.decode("utf-8", "surrogateescape")
+        pos += length
+    return records
+
+
+async def iter_tar(chunks, max_item=INGEST_MAX_ITEM_BYTES):
+    """(name, data) for every regular file in a tar stream, read as it
+    arrives. Items larger than `max_item` are skipped and yield TooLarge."""
+    reader = _Reader(chunks)
+    pending = {}
+    while True:
+        header = await reader.read(TAR_BLOCK)
+        if len(header) < TAR_BLOCK:
+            if header:
+                raise IngestError("Truncated tar header")
+            return
+        try:
+            info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+        except tarfile.EOFHeaderError:
+            return  # end-of-archive marker
+        except tarfile.HeaderError as e:
+            raise IngestError(f"Bad tar header: {e}")
+
+        if info.type in (tarfile.XHDTYPE, tarfile.XGLTYPE, tarfile.GNUTYPE_LONGNAME):
+            data = await reader.read(_padded(info.size))
+            if len(data) < _padded(info.size):
+                raise IngestError("Truncated tar stream")
+            data = data[:info.size]
+            if info.type == tarfile.XHDTYPE:
+                try:
+                    pending.update(_pax_records(data))
+                except ValueError as e:
+                    raise IngestError(f"Bad pax header: {e}")
+            elif info.type == tarfile.GNUTYPE_LONGNAME:
+                pending["path"] = data.rstrip(b"\0").decode("utf-8", "surrogateescape")
+            continue
+
+        name = pending.get("path", info.name)
+        size = int(pending.get("size", info.size))
+        pending = {}
+        if not info.isreg():
+            await reader.skip(_padded(size))
+            continue
+        if size > max_item:
+            await reader.skip(_padded(size))
+            yield name, TooLarge(size)
+            continue
+        data = await reader.read(size)
+        if len(data) < size:
+            raise IngestError(f"Truncated tar stream in {name}")
+        await reader.skip(_padded(size) - size)
+        yield name, data
+
+
+async def iter_multipart(content_type, chunks, max_item=INGEST_MAX_ITEM_BYTES):
+    """(filename, data) for every file part of a multipart/form-data body,
+    whatever its field name, read as the body arrives."""
+    content_type, params = parse_options_header(content_type or "")
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise IngestError("Expected a multipart/form-data body")
+
+    done = []
+    state = {"headers": {}, "field": b"", "value": b"", "name": None, "data": bytearray(), "size": 0}
+
+    def on_part_begin():
+        state.update(headers={}, name=None, data=bytearray(), size=0)
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"] = state["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        if b"filename" in disposition:
+            state["name"] = disposition[b"filename"].decode("utf-8", errors="replace")
+
+    def on_part_data(data, start, end):
+        if state["name"] is not None:
+            state["size"] += end - start
+            if state["size"] <= max_item:
+                state["data"] += data[start:end]
+
+    def on_part_end():
+        if state["name"] is not None:
+            over = state["size"] > max_item
+            done.append((state["name"], TooLarge(state["size"]) if over else bytes(state["data"])))
+            state["data"] = bytearray()
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    async for chunk in chunks:
+        if chunk:
+            try:
+                parser.write(chunk)
+            except Exception as e:
+                raise IngestError(f"Bad multipart body: {e}")
+        while done:
+            yield done.pop(0)
+    parser.finalize()
+    while done:
+        yield done.pop(0)
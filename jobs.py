@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+import uuid
+
+from fastapi import HTTPException
+
+import upstream
+
+FINALIZE_WORKERS = int(os.getenv("FINALIZE_WORKERS", 4))
+FINALIZE_QUEUE_SIZE = int(os.getenv("FINALIZE_QUEUE_SIZE", 64))
+JOB_TTL = 3600  # seconds a finished job stays queryable
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, run, total=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.done_bytes = 0
+        self.total_bytes = total
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._run = run
+        self._finished = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def progress(self, nbytes):
+        self.done_bytes += nbytes
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def to_dict(self):
+        data = {
+            "jobId": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "doneBytes": self.done_bytes,
+            "totalBytes": self.total_bytes,
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+            data["statusCode"] = self.status_code
+        return data
+
+
+class JobQueue:
+    """A bounded queue of background jobs run by a fixed pool of workers.
+
+    A job is an async callable taking the Job, so it can report progress,
+    and returning the result dict. Jobs live in this process only: a job
+    that was queued or running when the server stopped is gone, and its
+    upload has to be committed again.
+
+    A job can be submitted under a `key` (what it works on), so a repeated
+    request finds it with find() for as long as the job itself is kept.
+    """
+
+    def __init__(self, workers=FINALIZE_WORKERS, max_pending=FINALIZE_QUEUE_SIZE, ttl=JOB_TTL):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._jobs = {}
+        self._keys = {}
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        self._queue = asyncio.Queue(self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def pending(self):
+        """Jobs queued or running."""
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def submit(self, kind, run, total=None, key=None):
+        if self._queue is None:
+            # Workers belong to the event loop that serves the app, so they
+            # are started by its lifespan rather than by whoever comes first
+            raise RuntimeError("Job queue is not running; start() it in the app's lifespan")
+        self.expire()
+        job = Job(kind, run, total)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull(f"{self.max_pending} jobs already queued")
+        self._jobs[job.id] = job
+        if key is not None:
+            self._keys[key] = job.id
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def find(self, key):
+        """The newest job submitted under `key`, or None."""
+        return self._jobs.get(self._keys.get(key))
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+        for key, job_id in list(self._keys.items()):
+            if job_id not in self._jobs:
+                del self._keys[key]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            try:
+                job.result = await job._run(job)
+                job.status = "completed"
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Server shut down"
+                raise
+            except HTTPException as e:
+                job.status = "failed"
+                job.error = e.detail
+                job.status_code = e.status_code
+            except upstream.Overloaded as e:
+                job.status = "failed"
+                job.error = str(e)
+                job.status_code = 503
+            except Exception as e:
+                print(f"Job {job.id} ({job.kind}) failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+                job.status_code = 500
+            finally:
+                job.finished_at = time.time()
+                job._finished.set()
+                self._queue.task_done()
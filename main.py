@@ -1,29 +1,136 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from pathlib import Path
+from typing import Literal
 import tempfile
-from dotenv import load_dotenv
+import threading
+import asyncio
 import time
 import os
-import uvicorn
-import vercel_blob
-import requests
-import base64
+import hashlib
+import uuid
 
-load_dotenv()
+import archive
+import checksums
+import compression
+from blob_index import BlobIndex, etag, logical_name, resolve
+from blob_manifest import BlobManifest
+from byte_ranges import (
+    MAX_RANGES, MultipartByteranges, RangeNotSatisfiable, content_range, http_date, if_range_matches, not_modified, parse_range,
+)
+from chunk_sessions import ChunkSessionStore, pwrite_all
+from content_cache import ContentCache, iter_file
+from dedup import ContentHasher, ContentStore, hash_file, is_sha256
+import delivery
+import http_client
+import ingest
+from jobs import JobQueue, QueueFull
+import metrics
+from singleflight import SingleFlight, coalescing_stats
+from storage import Body, create_backend
+from streaming import PART_SIZE, MultipartFileStream
+import upstream
 
-token = os.getenv("BLOB_READ_WRITE_TOKEN")
-print(f"Token loaded: {'Yes' if token else 'No'}")
-if token:
-    print(f"Token prefix: {token[:5]}...")
+# On Vercel the environment is already set; skip reading a .env file there
+if not os.getenv("VERCEL"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
-app = FastAPI()
+# Pooled connections to open at startup, before the first request needs one
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", 0))
 
+@asynccontextmanager
+async def lifespan(app):
+    token = os.getenv("BLOB_READ_WRITE_TOKEN")
+    print(f"Token loaded: {'Yes' if token else 'No'}")
+    if token:
+        print(f"Token prefix: {token[:5]}...")
+    finalize_jobs.start()
+    if WARMUP_CONNECTIONS > 0:
+        warmup.start()
+    yield
+    await finalize_jobs.stop()
+    await http_client.close_client()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.exception_handler(upstream.Overloaded)
+async def upstream_overloaded(request, e):
+    # Storage is saturated or failing: shed the request now rather than queue it
+    return JSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+# Created by whatever first writes under it, not at import
 UPLOAD_DIR = Path(tempfile.gettempdir()) / "uploads"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 CHUNK_SIZE = 1024 * 1024  # 1 MB
+MAX_SESSION_CHUNK_SIZE = int(os.getenv("MAX_SESSION_CHUNK_SIZE", 64 * 1024 * 1024))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 5 * 1024 * 1024 * 1024))
+# Most bytes one /checksum request may hash
+MAX_CHECKSUM_BYTES = int(os.getenv("MAX_CHECKSUM_BYTES", 256 * 1024 * 1024))
+# A name can move to new content at any time, so caches must revalidate;
+# an exact `{timestamp}_name` version never changes
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+CHUNK_FILL_CONCURRENCY = 8
+
+chunk_sessions = ChunkSessionStore(UPLOAD_DIR / "sessions")
+
+storage = create_backend()
+blob_index = BlobIndex(BlobManifest(UPLOAD_DIR / f"manifest_{storage.name}.sqlite", storage))
+content_store = ContentStore(storage, UPLOAD_DIR / f"chunks_{storage.name}.sqlite", compression.store_encoding())
+content_cache = ContentCache(UPLOAD_DIR / "cache")
+single_flight = SingleFlight(lambda blob, start=None, end=None: open_content(blob, start, end))
+finalize_jobs = JobQueue()
+
+metrics.Gauge("chunk_sessions_active", "Chunk upload sessions in progress.", function=chunk_sessions.active)
+session_events = metrics.Counter("chunk_session_events_total", "Chunk session lifecycle events.", ("event",))
+ingested_files = metrics.Counter("ingest_files_total", "Files received by /ingest.", ("status",))
+overwrite_failures = metrics.Counter(
+    "overwrite_delete_failures_total", "Older versions left in place because deleting them failed.",
+)
+metrics.Gauge("finalize_jobs_pending", "Finalize jobs queued or running.", function=finalize_jobs.pending)
+
+
+class Warmup:
+    """Startup work done in the background instead of on the first request:
+    load the blob index and open pooled connections to storage."""
+
+    def __init__(self):
+        self.timings = {}
+        self.task = None
+
+    def start(self, connections=WARMUP_CONNECTIONS):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(connections))
+        return self.task
+
+    async def run(self, connections):
+        started = time.perf_counter()
+        try:
+            await run_in_threadpool(blob_index.refresh)
+            self.timings["index_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            latest = blob_index.latest()
+            if storage.remote and connections > 0 and latest is not None:
+                began = time.perf_counter()
+                statuses = await http_client.warm_up(storage.public_url(latest), connections)
+                self.timings["connections"] = sum(1 for status in statuses if status is not None)
+                self.timings["connect_ms"] = round((time.perf_counter() - began) * 1000, 1)
+        except Exception as e:
+            print(f"Warning: warm-up failed: {e}")
+            self.timings["error"] = str(e)
+        self.timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"Warm-up done: {self.timings}")
+        return self.timings
+
+
+warmup = Warmup()
 
 
 @app.get("/")
@@ -35,6 +142,22 @@ def read_root():
 def health_check():
     return {"status": "ok"}
 
+
+@app.get("/warmup")
+async def run_warmup(connections: int = Query(default=max(WARMUP_CONNECTIONS, 1), ge=0, le=64)):
+    """Run (or wait for) the startup warm-up and report how long it took."""
+    return await asyncio.shield(warmup.start(connections))
+
+
+@app.get("/stats")
+def get_stats():
+    return {"storage": storage.name, "coalescing": coalescing_stats(blob_index.stats), "upstream": upstream.governor.stats()}
+
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # check text post working or not
 class TestPayload(BaseModel):
     data: str
@@ -43,220 +166,1305 @@ class TestPayload(BaseModel):
     fileName: str
     isCompleted: bool
     isStarted: bool
+    # "<algorithm>=<hex>" of the decoded chunk, see checksums.ALGORITHMS
+    checksum: str | None = None
+
+def delete_existing_blobs(safe_filename, keep=None):
+    # Overwrite Logic: Delete existing blobs with same suffix, in one batch
+    try:
+        existing = [b for b in blob_index.versions(safe_filename) if keep is None or b["url"] != keep["url"]]
+        for b in existing:
+            print(f"Deleting existing blob: {b['pathname']}")
+        storage.delete([b["url"] for b in existing])
+        for b in existing:
+            blob_index.remove(b)
+            content_cache.invalidate(b)
+        delete_unreferenced(resolve(b) for b in existing)
+    except Exception as e:
+        # The upload itself succeeded. The old versions stay listed under
+        # the name, so the next overwrite of it deletes them again.
+        overwrite_failures.inc()
+        print(f"Warning: Failed to delete existing blobs of {safe_filename}, left for the next overwrite: {e}")
+
+
+# Linking content and deleting it once unreferenced exclude each other per
+# object, so an object is never deleted under a ref being added to it
+content_locks = [threading.Lock() for _ in range(64)]
+
+
+def content_lock(sha256):
+    return content_locks[int(sha256[:8], 16) % len(content_locks)]
+
+
+def delete_unreferenced(objects):
+    """Delete the objects among `objects` (resolved blobs) that no ref in
+    the index points at any more, with their recorded chunks."""
+    for obj in {o["sha256"]: o for o in objects if o.get("sha256")}.values():
+        with content_lock(obj["sha256"]):
+            if blob_index.referenced(obj["sha256"]):
+                continue
+            print(f"Deleting unreferenced object: {obj['url']}")
+            content_store.forget(obj["sha256"])
+            storage.delete([obj["url"]])
+        content_cache.invalidate(obj)
+
+
+def link_content(safe_filename, sha256, size, replace=False):
+    # A name points at stored content through a small ref blob, so uploading
+    # bytes the store already has costs one empty put. With `replace`, older
+    # versions are deleted only once the new ref is in place, so the name
+    # never goes missing in between.
+    with content_lock(sha256):
+        if content_store.find(sha256) is None:
+            # Its last ref was replaced while this upload was on its way
+            raise HTTPException(status_code=409, detail="The uploaded content was deleted meanwhile; send it again")
+        ref = content_store.link(safe_filename, sha256, size)
+        blob_index.add(ref)
+    if replace:
+        delete_existing_blobs(safe_filename, keep=ref)
+    return resolve(ref)
+
+
+def request_body(request, limit=None):
+    """The request body as a stream of chunks, decompressed per its
+    Content-Encoding; a bad body raises compression.DecodeError as it is read.
+    With `limit`, a body that decodes to more bytes is a 413 once it does."""
+    try:
+        encoding = compression.request_encoding(request.headers.get("content-encoding"))
+    except compression.UnsupportedEncoding as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    body = request.stream() if encoding is None else compression.decode(request.stream(), encoding)
+    return body if limit is None else limited(body, limit)
+
+
+async def limited(chunks, limit):
+    size = 0
+    async for data in chunks:
+        size += len(data)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Body larger than {limit} bytes")
+        yield data
+
+
+def bad_digest(message):
+    # Clients retry a BadDigest: the bytes were damaged on the way
+    return HTTPException(status_code=400, detail={"message": message, "code": "BadDigest"})
+
+
+async def store_file(path, size, chunk_size, job, sha256=None, chunk_hashes=None):
+    """Make sure the content of a local file is stored, uploading it only if
+    the store does not have it yet. A declared `sha256` is checked against
+    the bytes, unless `chunk_hashes` come with it: then both were computed
+    from the bytes as they arrived. Returns (sha256, chunk hashes, whether
+    it was already stored)."""
+    if sha256 is None:
+        with metrics.span("finalize.hash"):
+            sha256, chunk_hashes = await asyncio.to_thread(hash_file, path, size, chunk_size)
+    existing = await asyncio.to_thread(content_store.find, sha256)
+    if existing is not None and chunk_hashes is not None:
+        job.progress(size)
+        return sha256, chunk_hashes, True
+
+    # Hash while reading when the hash still has to be checked
+    hasher = ContentHasher(chunk_size) if chunk_hashes is None else None
+    upload = content_store.open_upload(sha256) if existing is None else None
+
+    def read(f, n):
+        data = f.read(n)
+        if hasher is not None:
+            hasher.update(data)
+        return data
+
+    try:
+        with open(path, "rb") as f:
+            remaining = size
+            while remaining > 0:
+                chunk = await asyncio.to_thread(read, f, min(PART_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                if upload is not None:
+                    await upload.write(chunk)
+                job.progress(len(chunk))
+
+        if hasher is not None:
+            actual, chunk_hashes = hasher.finish()
+            if actual != sha256:
+                raise bad_digest("Upload does not match its declared sha256")
+        if upload is not None:
+            content_store.added(sha256, await upload.close(), size)
+    except BaseException:
+        if upload is not None:
+            await upload.abort()
+        raise
+    return sha256, chunk_hashes, existing is not None
+
+
+def enqueue_finalize(kind, run, total, key=None):
+    try:
+        job = finalize_jobs.submit(kind, run, total, key)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Too many uploads finalizing: {e}", headers={"Retry-After": "5"})
+    return job
+
+
+def finalize_accepted(job):
+    # 202: the upload is in; poll the job (or long-poll with ?wait=) for the URL
+    return JSONResponse(status_code=202, content={
+        "status": "finalizing",
+        "jobId": job.id,
+        "statusUrl": f"/jobs/{job.id}",
+    })
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    job = finalize_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if wait > 0 and not job.finished:
+        await job.wait(min(wait, 60))
+    return job.to_dict()
+
+# /test1 uploads in progress by filename: the digest so far, fed as chunks
+# are appended, and the last chunk so a retried one is not appended twice.
+# Lost on restart; such an upload is hashed from its file when it completes.
+test_uploads = {}
+
+
+class TestUpload:
+    def __init__(self, chunk_number):
+        self.hasher = ContentHasher(PART_SIZE)
+        self.last_chunk = chunk_number - 1
+        self.last_sha256 = None
+
 
 # this is for client side testing
 @app.post("/test1")
-def testText(payload: TestPayload):
+async def testText(payload: TestPayload):
     safe_filename = Path(payload.fileName).name
     temp_file_path = UPLOAD_DIR / f"temp_{safe_filename}"
     
     try:
+        try:
+            declared = checksums.parse(payload.checksum)
+        except checksums.UnsupportedChecksum as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         chunk_data = b""
         if payload.data:
+            import base64
             chunk_data = base64.b64decode(payload.data)
-            
+        if declared and checksums.compute(chunk_data, declared[0]) != declared[1]:
+            raise bad_digest(f"Chunk {payload.chunkNumber} does not match its checksum ({declared[0]})")
+
         if payload.isStarted:
-            with open(temp_file_path, "wb") as f:
-                f.write(chunk_data)
-        elif chunk_data:
-            with open(temp_file_path, "ab") as f:
-                f.write(chunk_data)
+            test_uploads[safe_filename] = TestUpload(payload.chunkNumber)
+        state = test_uploads.get(safe_filename)
+        duplicate = False
+        if state is not None:
+            chunk_sha256 = hashlib.sha256(chunk_data).hexdigest()
+            if payload.chunkNumber == state.last_chunk and chunk_sha256 == state.last_sha256:
+                # A retry of a chunk whose answer was lost; it is in already
+                duplicate = True
+            elif payload.chunkNumber != state.last_chunk + 1:
+                raise HTTPException(status_code=409, detail={
+                    "message": f"Expected chunk {state.last_chunk + 1}, got {payload.chunkNumber}",
+                    "expectedChunk": state.last_chunk + 1,
+                })
+            else:
+                state.last_chunk, state.last_sha256 = payload.chunkNumber, chunk_sha256
+
+        if not duplicate and (payload.isStarted or chunk_data):
+            hasher = state.hasher if state is not None else None
+            await asyncio.to_thread(write_test_chunk, temp_file_path, chunk_data, payload.isStarted, hasher)
         
         if payload.isCompleted:
             if not temp_file_path.exists():
                  raise HTTPException(status_code=400, detail="Upload session not found (file missing)")
-                 
-            with open(temp_file_path, "rb") as f:
-                content = f.read()
-            
-            # Overwrite Logic: Delete existing blobs with same suffix
-            try:
-                list_resp = vercel_blob.list()
-                existing_blobs = list_resp.get("blobs", [])
-                for b in existing_blobs:
-                    if b["pathname"].endswith(f"_{safe_filename}") or b["pathname"] == safe_filename:
-                        print(f"Deleting existing blob: {b['pathname']}")
-                        vercel_blob.delete(b["url"])
-            except Exception as e:
-                print(f"Warning: Failed to delete existing blob: {e}")
-
-            # Upload to Vercel Blob
-            blob_name = f"{int(time.time())}_{safe_filename}"
-            resp = vercel_blob.put(
-                blob_name,
-                content,
-                options={"add_random_suffix": False},
+
+            # Hand the file to a finalize job under a name of its own, so a
+            # new upload of the same filename can start right away
+            finalize_path = UPLOAD_DIR / f"finalize_{uuid.uuid4().hex}_{safe_filename}"
+            size = temp_file_path.stat().st_size
+            digest = None
+            if state is not None and state.hasher.size == size:
+                digest = state.hasher.finish()
+            job = enqueue_finalize(
+                "test1", lambda job: finalize_test_upload(finalize_path, safe_filename, size, job, digest), size,
             )
-            
-            # Cleanup
-            try:
-                temp_file_path.unlink()
-            except Exception:
-                pass
-                
-            return {
-                "status": "completed", 
-                "url": resp["url"],
-                "filename": blob_name
-            }
+            os.replace(temp_file_path, finalize_path)
+            test_uploads.pop(safe_filename, None)
+            return finalize_accepted(job)
             
         if payload.isStarted:
              return {"status": "started", "message": "File initialized"}
         else:
              return {"status": "appending", "message": "Chunk appended"}
             
+    except (HTTPException, upstream.Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chunk: {str(e)}")
 
 
+def write_test_chunk(path, data, started, hasher=None):
+    if started:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb" if started else "ab") as f:
+        f.write(data)
+    if hasher is not None:
+        hasher.update(data)
 
-@app.put("/pupload")
-async def upload_file(file: UploadFile = File(...)):
-    
-    if not file.filename:
+
+async def finalize_test_upload(path, safe_filename, size, job, digest=None):
+    # `digest` is (sha256, chunk hashes) when the chunks were hashed as they came
+    sha256, chunk_hashes = digest or (None, None)
+    try:
+        sha256, _, _ = await store_file(path, size, PART_SIZE, job, sha256, chunk_hashes)
+        blob = await asyncio.to_thread(link_content, safe_filename, sha256, size, True)
+    finally:
+        path.unlink(missing_ok=True)
+    return {
+        "status": "completed", 
+        "url": blob["url"],
+        "filename": blob["pathname"]
+    }
+
+
+
+class SessionInit(BaseModel):
+    fileName: str
+    totalChunks: int
+    chunkSize: int
+    fileSize: int | None = None
+    sha256: str | None = None
+    chunkHashes: list[str] | None = None
+
+
+class HashCheck(BaseModel):
+    fileName: str | None = None
+    sha256: str | None = None
+    size: int | None = None
+    chunkHashes: list[str] | None = None
+
+
+def check_hashes_valid(sha256=None, chunk_hashes=None):
+    if sha256 is not None and not is_sha256(sha256):
+        raise HTTPException(status_code=400, detail="sha256 must be 64 lowercase hex digits")
+    if chunk_hashes is not None and not all(is_sha256(h) for h in chunk_hashes):
+        raise HTTPException(status_code=400, detail="chunkHashes must be 64 lowercase hex digits each")
+
+
+def get_session(session_id):
+    session = chunk_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+@app.post("/check-hashes")
+async def check_hashes(payload: HashCheck):
+    # Pre-flight for uploads: if the whole body is already stored, naming it
+    # is all that is left; otherwise say which chunks the store can supply
+    check_hashes_valid(payload.sha256, payload.chunkHashes)
+    if payload.sha256:
+        obj = await asyncio.to_thread(content_store.find, payload.sha256)
+        size = None if obj is None else obj["size"] if obj.get("size") is not None else payload.size
+        if size is not None and payload.size in (None, size):
+            safe_filename = Path(payload.fileName).name if payload.fileName else ""
+            if not safe_filename:
+                return {"status": "present", "size": size}
+            blob = await asyncio.to_thread(link_content, safe_filename, payload.sha256, size, True)
+            return {
+                "status": "completed",
+                "url": blob["url"],
+                "filename": blob["pathname"],
+                "size": size,
+                "deduplicated": True,
+            }
+
+    known = []
+    if payload.chunkHashes:
+        known = sorted(await asyncio.to_thread(content_store.locate_chunks, payload.chunkHashes))
+    return {"status": "missing", "knownChunks": known, "encodings": list(compression.SUPPORTED)}
+
+
+async def fill_chunk(session, index, sha256, offset, length):
+    """Copy chunk `index` out of a stored object instead of waiting for the
+    client to send it. Returns whether the chunk was filled."""
+    if length != session.expected_length(index):
+        return False
+    try:
+        obj = await asyncio.to_thread(content_store.find, sha256)
+        if obj is None:
+            return False
+        body = await open_content(obj, offset, offset + length - 1)
+    except Exception as e:
+        print(f"Warning: Failed to read chunk {index} from object {sha256}: {e}")
+        return False
+
+    digest = hashlib.sha256()
+    start = index * session.chunk_size
+    position = start
+    fd = chunk_sessions.open_for_write(session)
+    try:
+        async for data in body:
+            digest.update(data)
+            position = pwrite_all(fd, data, position)
+    except Exception as e:
+        print(f"Warning: Failed to read chunk {index} from object {sha256}: {e}")
+        return False
+    finally:
+        os.close(fd)
+        await body.aclose()
+
+    # The chunk table is only a hint; trust the bytes, not the row
+    if position - start != length or digest.hexdigest() != session.chunk_hashes[index]:
+        return False
+    chunk_sessions.mark_received(session, index)
+    return True
+
+
+def hash_session_chunk(session, digest, index):
+    data = session.read_chunk(index)
+    digest.update(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+async def advance_digest(session, wait=False):
+    """Feed the session digest the chunks that arrived ahead of it, reading
+    them back from the file. Only one caller advances at a time; the others
+    return at once unless they `wait`."""
+    if session.digest_lock.locked() and not wait:
+        return
+    async with session.digest_lock:
+        while session.hashed < session.total_chunks:
+            index = session.hashed
+            if index not in session.received or session.writing[index]:
+                return
+            digest, writes = session.digest, session.writes[index]
+            chunk_sha256 = await asyncio.to_thread(hash_session_chunk, session, digest, index)
+            if session.digest is not digest or session.writing[index] or session.writes[index] != writes:
+                # Rewritten or reset meanwhile; start over from the new state
+                if session.digest is digest:
+                    session.reset_digest()
+                continue
+            session.hashed_chunks.append(chunk_sha256)
+            session.hashed += 1
+
+
+# Binary chunk protocol: init a session, PUT raw chunks at their index (any
+# order, in parallel), then commit once every chunk has arrived.
+@app.post("/sessions")
+async def create_session(payload: SessionInit):
+    safe_filename = Path(payload.fileName).name
+    if not safe_filename:
         raise HTTPException(status_code=400, detail="Filename is required")
+    if payload.totalChunks < 1:
+        raise HTTPException(status_code=400, detail="totalChunks must be at least 1")
+    if not 0 < payload.chunkSize <= MAX_SESSION_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"chunkSize must be between 1 and {MAX_SESSION_CHUNK_SIZE}")
+    if payload.fileSize is not None and not (
+        (payload.totalChunks - 1) * payload.chunkSize < payload.fileSize <= payload.totalChunks * payload.chunkSize
+    ):
+        raise HTTPException(status_code=400, detail="fileSize does not match totalChunks and chunkSize")
+    check_hashes_valid(payload.sha256, payload.chunkHashes)
+    if payload.chunkHashes is not None and len(payload.chunkHashes) != payload.totalChunks:
+        raise HTTPException(status_code=400, detail="chunkHashes must have one hash per chunk")
+
+    session = chunk_sessions.create(
+        safe_filename, payload.totalChunks, payload.chunkSize, payload.fileSize,
+        sha256=payload.sha256, chunk_hashes=payload.chunkHashes,
+    )
+    session_events.inc("created")
+
+    filled = 0
+    if payload.chunkHashes:
+        known = await asyncio.to_thread(content_store.locate_chunks, payload.chunkHashes)
+        limit = asyncio.Semaphore(CHUNK_FILL_CONCURRENCY)
+
+        async def fill(index, location):
+            async with limit:
+                return await fill_chunk(session, index, *location)
+
+        with metrics.span("session.fill"):
+            results = await asyncio.gather(*(fill(i, location) for i, location in known.items()))
+        filled = sum(results)
 
-    timestamp = int(time.time())
-    safe_name = Path(file.filename).name 
-    blob_name = f"{timestamp}_{safe_name}"
+    # Chunks may be sent compressed in any of these (Content-Encoding)
+    return {**session.to_dict(), "filled": filled, "encodings": list(compression.SUPPORTED)}
 
-    tmp_path = UPLOAD_DIR / blob_name
+
+@app.get("/sessions/{session_id}")
+def get_session_status(session_id: str):
+    return get_session(session_id).to_dict()
+
+
+@app.put("/sessions/{session_id}/chunks/{index}")
+async def put_chunk(session_id: str, index: int, request: Request):
+    session = get_session(session_id)
+    if session.committing:
+        raise HTTPException(status_code=409, detail="Upload session is already committing")
+    if not 0 <= index < session.total_chunks:
+        raise HTTPException(status_code=400, detail=f"Chunk index must be between 0 and {session.total_chunks - 1}")
 
     try:
-        with tmp_path.open("wb") as out_file:
-            while True:
-                chunk = await file.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                out_file.write(chunk)
+        declared = checksums.parse(request.headers.get(checksums.CHUNK_CHECKSUM_HEADER))
+    except checksums.UnsupportedChecksum as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    expected = session.expected_length(index)
+    limit = expected if expected is not None else session.chunk_size
+    start = index * session.chunk_size
+    offset = start
+    # The next chunk in order is hashed into a copy of the session digest as
+    # it streams in; the copy replaces the digest once the chunk is accepted
+    inline = index == session.hashed and index not in session.received
+    base = session.digest
+    whole = base.copy() if inline else None
+    resent = index < session.hashed
+    digest = hashlib.sha256() if inline or resent or session.chunk_hashes else None
+    checksum = checksums.Checksum(declared[0]) if declared else None
+    body = request_body(request)
+
+    session.writing[index] += 1
+    session.writes[index] += 1
+    fd = chunk_sessions.open_for_write(session)
+    try:
+        async for data in body:
+            if offset - start + len(data) > limit:
+                raise HTTPException(status_code=400, detail=f"Chunk {index} is larger than {limit} bytes")
+            if whole is not None:
+                whole.update(data)
+            if digest is not None:
+                digest.update(data)
+            if checksum is not None:
+                checksum.update(data)
+            offset = pwrite_all(fd, data, offset)
+
+        received = offset - start
+        if received == 0 or (expected is not None and received != expected):
+            raise HTTPException(status_code=400, detail=f"Chunk {index} has {received} bytes, expected {expected or limit}")
+        if checksum is not None and checksum.hexdigest() != declared[1]:
+            raise bad_digest(f"Chunk {index} does not match its {checksums.CHUNK_CHECKSUM_HEADER} ({declared[0]})")
+        chunk_sha256 = digest.hexdigest() if digest is not None else None
+        if session.chunk_hashes and chunk_sha256 != session.chunk_hashes[index]:
+            raise bad_digest(f"Chunk {index} does not match its declared sha256")
+    except BaseException as e:
+        if offset > start:
+            # Whatever was in this chunk's slot is overwritten now
+            chunk_sessions.unmark_received(session, index)
+            if index < session.hashed:
+                session.reset_digest()
+        if isinstance(e, compression.DecodeError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
+    finally:
+        os.close(fd)
+        session.writing[index] -= 1
+
+    if resent and index < session.hashed and chunk_sha256 != session.hashed_chunks[index]:
+        # A chunk already in the digest came again with other bytes
+        session.reset_digest()
+    chunk_sessions.mark_received(session, index)
+    # Only onto the digest it was copied from: a resent earlier chunk resets
+    # it, and advance_digest may have brought a new one back up to here
+    if inline and session.digest is base and session.hashed == index and not session.digest_lock.locked():
+        session.digest = whole
+        session.hashed_chunks.append(chunk_sha256)
+        session.hashed += 1
+    await advance_digest(session)
+    session_events.inc("chunk")
+    return {"status": "received", "index": index, "received": len(session.received)}
 
-        with tmp_path.open("rb") as f:
-            content = f.read()
 
-        resp = vercel_blob.put(
-            blob_name,
-            content,
-            options={"add_random_suffix": False},
+@app.post("/sessions/{session_id}/commit")
+async def commit_session(session_id: str):
+    # A retried commit gets the job that is committing the session, or did
+    # so: the session is gone once that succeeds, but the job is kept for
+    # its TTL. A failed one leaves the session to commit again.
+    job = finalize_jobs.find(("session", session_id))
+    if job is not None and job.status != "failed":
+        return finalize_accepted(job)
+    session = get_session(session_id)
+    missing = session.missing()
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"{len(missing)} chunks missing", "missing": missing[:100]},
         )
+    if session.committing:
+        raise HTTPException(status_code=409, detail="Upload session is already committing")
+
+    job = enqueue_finalize("session", lambda job: finalize_session(session, job), session.size(), ("session", session_id))
+    session.committing = True
+    return finalize_accepted(job)
+
+
+async def finalize_session(session, job):
+    # With a declared sha256 the body goes straight to its object, or
+    # nowhere if that object already exists
+    size = session.size()
+    try:
+        # Chunks that arrived out of order are all in now
+        with metrics.span("finalize.hash"):
+            await advance_digest(session, wait=True)
+        sha256, chunk_hashes = session.sha256, None
+        if session.hashed == session.total_chunks:
+            sha256, chunk_hashes = session.digest.hexdigest(), session.hashed_chunks
+            if session.sha256 is not None and sha256 != session.sha256:
+                raise bad_digest("Upload does not match its declared sha256")
+        sha256, chunk_hashes, deduplicated = await store_file(
+            session.path, size, session.chunk_size, job, sha256, chunk_hashes,
+        )
+        blob = await asyncio.to_thread(link_content, session.filename, sha256, size, True)
+    except (HTTPException, upstream.Overloaded):
+        session.committing = False
+        session_events.inc("commit_failed")
+        raise
+    except Exception as e:
+        session.committing = False
+        session_events.inc("commit_failed")
+        raise HTTPException(status_code=500, detail=f"Commit failed: {str(e)}")
+
+    chunk_sessions.remove(session)
+    session_events.inc("committed")
+    await asyncio.to_thread(content_store.index_chunks, sha256, size, session.chunk_size, chunk_hashes)
+    return {
+        "status": "completed",
+        "url": blob["url"],
+        "filename": blob["pathname"],
+        "size": size,
+        "sha256": sha256,
+        "deduplicated": deduplicated,
+    }
+
+
+@app.put(
+    "/pupload",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"file": {"type": "string", "format": "binary"}},
+                        "required": ["file"],
+                    }
+                }
+            },
+        }
+    },
+)
+async def upload_file(request: Request):
+    # Parse the multipart body ourselves so parts go to blob storage while the
+    # rest of the body is still arriving, instead of UploadFile spooling it all.
+    try:
+        stream = MultipartFileStream(request, field_name="file")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = await stream.open()
+    if not filename:
+        raise HTTPException(status_code=400, detail="Filename is required")
+
+    safe_name = Path(filename).name
+
+    # The hash is only known at the end, so the body is staged and then
+    # moved under it (or dropped, if that content is already stored)
+    upload = content_store.open_upload()
+    digest = hashlib.sha256()
+
+    try:
+        while True:
+            chunk = await stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            await upload.write(chunk)
+
+        staged = await upload.close()
+        await asyncio.to_thread(content_store.adopt, staged, digest.hexdigest(), upload.size)
+        blob = await asyncio.to_thread(link_content, safe_name, digest.hexdigest(), upload.size)
 
         return {
-            "filename": blob_name,
-            "url": resp["url"],
+            "filename": blob["pathname"],
+            "url": blob["url"],
             "status": "uploaded",
         }
 
+    except upstream.Overloaded:
+        await upload.abort()
+        raise
+    except Exception as e:
+        await upload.abort()
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+@app.put("/upload/{name}")
+async def upload_raw(name: str, request: Request):
+    # Raw body straight into storage parts: no multipart parsing, no spooling.
+    # Everything is checked before the first receive(), which is what makes
+    # the server send "100 Continue", so a rejected client never sends the body.
+    safe_name = Path(name).name
+    if not safe_name:
+        raise HTTPException(status_code=400, detail="Filename is required")
+
+    declared = request.headers.get("content-length")
+    if declared is not None:
+        if not declared.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid Content-Length")
+        declared = int(declared)
+        if declared > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Body larger than {MAX_UPLOAD_BYTES} bytes")
+    body = request_body(request)
+    if compression.request_encoding(request.headers.get("content-encoding")) is not None:
+        # Content-Length counts the compressed bytes; only the limit applies
+        declared = None
+    limit = declared if declared is not None else MAX_UPLOAD_BYTES
+
+    # With X-Content-SHA256 the object name is known up front: content the
+    # store already has is linked without reading the body at all
+    sha256 = request.headers.get(checksums.CONTENT_SHA256_HEADER)
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        check_hashes_valid(sha256)
+        existing = await asyncio.to_thread(content_store.find, sha256)
+        if existing is not None and existing.get("size") is not None and declared in (None, existing["size"]):
+            blob = await asyncio.to_thread(link_content, safe_name, sha256, existing["size"])
+            return {
+                "filename": blob["pathname"],
+                "url": blob["url"],
+                "status": "uploaded",
+                "size": existing["size"],
+                "sha256": sha256,
+                "deduplicated": True,
+            }
+
+    upload = content_store.open_upload(sha256)
+    digest = hashlib.sha256()
+
+    try:
+        async for chunk in body:
+            if upload.size + len(chunk) > limit:
+                if declared is not None:
+                    raise HTTPException(status_code=400, detail="Body longer than Content-Length")
+                raise HTTPException(status_code=413, detail=f"Body larger than {MAX_UPLOAD_BYTES} bytes")
+            digest.update(chunk)
+            await upload.write(chunk)
+
+        if declared is not None and upload.size != declared:
+            raise HTTPException(status_code=400, detail=f"Body has {upload.size} bytes, Content-Length said {declared}")
+        if sha256 is not None and digest.hexdigest() != sha256:
+            raise bad_digest("Body does not match X-Content-SHA256")
+
+        stored = await upload.close()
+    except (HTTPException, upstream.Overloaded):
+        await upload.abort()
+        raise
+    except compression.DecodeError as e:
+        await upload.abort()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await upload.abort()
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    try:
+        if sha256 is not None:
+            content_store.added(sha256, stored, upload.size)
+        else:
+            await asyncio.to_thread(content_store.adopt, stored, digest.hexdigest(), upload.size)
+        blob = await asyncio.to_thread(link_content, safe_name, digest.hexdigest(), upload.size)
+    except upstream.Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    return {
+        "filename": blob["pathname"],
+        "url": blob["url"],
+        "status": "uploaded",
+        "size": upload.size,
+        "sha256": digest.hexdigest(),
+        "deduplicated": False,
+    }
+
+
+async def ingest_item(name, data):
+    safe_name = Path(name).name
+    if not safe_name:
+        return {"name": name, "status": "failed", "error": "Filename is required"}
+    if isinstance(data, ingest.TooLarge):
+        return {"name": name, "status": "failed",
+                "error": f"{data.size} bytes is over {ingest.INGEST_MAX_ITEM_BYTES}; use /upload/{{name}}"}
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        await ingest.call(content_store.store, sha256, data)
+        blob = await ingest.call(link_content, safe_name, sha256, len(data))
+    except Exception as e:
+        return {"name": name, "status": "failed", "error": str(e)}
+    return {
+        "name": name,
+        "status": "uploaded",
+        "filename": blob["pathname"],
+        "url": blob["url"],
+        "size": len(data),
+        "sha256": sha256,
+    }
+
+
+@app.post("/ingest")
+async def ingest_files(request: Request):
+    # Many small files in one request: a tar stream (any Content-Type but
+    # multipart) or a multipart body with one part per file. Items are
+    # unpacked as they arrive and stored concurrently; reading pauses while
+    # INGEST_CONCURRENCY items are in flight, which bounds memory.
+    body = request_body(request, MAX_UPLOAD_BYTES)
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/"):
+        items = ingest.iter_multipart(content_type, body)
+    else:
+        items = ingest.iter_tar(body)
+
+    results = []
+    slots = asyncio.Semaphore(ingest.INGEST_CONCURRENCY)
+    tasks = []
+
+    async def store(index, name, data):
+        try:
+            results[index] = await ingest_item(name, data)
+        finally:
+            slots.release()
+        ingested_files.inc(results[index]["status"])
+
+    error = None
+    try:
+        async for name, data in items:
+            await slots.acquire()
+            results.append(None)
+            tasks.append(asyncio.create_task(store(len(results) - 1, name, data)))
+    except (ingest.IngestError, compression.DecodeError) as e:
+        error = HTTPException(status_code=400, detail=str(e))
+    except HTTPException as e:
+        # The body decoded to more than MAX_UPLOAD_BYTES
+        error = e
     finally:
-        if tmp_path.exists():
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    failed = sum(1 for r in results if r["status"] != "uploaded")
+    summary = {"uploaded": len(results) - failed, "failed": failed, "files": results}
+    if error is not None:
+        # Files before the bad spot are stored; say which
+        raise HTTPException(status_code=error.status_code, detail={"message": error.detail, **summary})
+    return {"status": "completed", **summary}
+
+
+async def find_blob(filename=None):
+    # Only hop to a thread when the index has to go upstream
+    if blob_index.stale():
+        with metrics.span("index.refresh"):
+            await run_in_threadpool(blob_index.refresh)
+    blob = blob_index.lookup(filename) if filename else blob_index.latest()
+    return resolve(blob) if blob else None
+
+
+async def blob_size(blob):
+    if blob.get("size") is None:
+        blob["size"] = await storage.size(blob)
+    return blob["size"]
+
+
+async def open_content(blob, start=None, end=None):
+    """Bytes start..end (inclusive) of a blob's content, or all of it. An
+    object stored compressed is decoded on the way out; a range of it has
+    to be decoded from the start."""
+    if not blob.get("encoding"):
+        return await storage.open_range(blob, start, end)
+    body = await storage.open_range(blob)
+    return Body(compression.decode_range(body, blob["encoding"], start, end), body.aclose)
+
+
+async def open_whole_body(blob):
+    # A remote blob already in the disk cache is read from there
+    cached = content_cache.get(blob) if storage.remote else None
+    if cached is None:
+        return await open_content(blob)
+    chunks = iter_file(cached, 0, blob["size"] - 1, http_client.RELAY_CHUNK_SIZE)
+
+    async def read():
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+
+    return Body(read(), chunks.close)
+
+
+def representation_etag(blob, encoding=None):
+    # Each content coding of a body is its own representation
+    tag = etag(blob)
+    return f'{tag[:-1]}-{encoding}"' if encoding else tag
+
+
+def blob_headers(blob, cache_control=REVALIDATE, disposition_name=None):
+    headers = {
+        "Content-Disposition": f"attachment; filename={disposition_name or blob['pathname']}",
+        "Accept-Ranges": "bytes",
+        "Last-Modified": http_date(blob["uploadedAt"]),
+        "ETag": etag(blob),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    # The content's digest, so a client can check what it downloaded
+    if blob.get("sha256"):
+        headers[checksums.CONTENT_SHA256_HEADER] = blob["sha256"]
+    return headers
+
+
+def not_modified_response(blob, request, cache_control=REVALIDATE):
+    """A 304 if the request's validators still match a representation of
+    `blob`, else None."""
+    last_modified = http_date(blob["uploadedAt"])
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    for encoding in (None, *compression.SUPPORTED):
+        tag = representation_etag(blob, encoding)
+        if not_modified(if_none_match, if_modified_since, tag, last_modified):
+            return Response(status_code=304, headers={
+                "ETag": tag, "Last-Modified": last_modified, "Cache-Control": cache_control, "Vary": "Accept-Encoding",
+            })
+    return None
+
+
+compress_samples = {}  # etag -> compressed/raw ratio of the first SAMPLE_SIZE bytes
+MAX_COMPRESS_SAMPLES = 4096
+
+
+async def worth_compressing(blob, encoding):
+    key = etag(blob)
+    ratio = compress_samples.get(key)
+    if ratio is None:
+        body = await open_content(blob, 0, compression.SAMPLE_SIZE - 1)
+        try:
+            sample = b"".join([chunk async for chunk in body])
+        finally:
+            await body.aclose()
+        ratio = await asyncio.to_thread(compression.ratio, sample, encoding)
+        if len(compress_samples) >= MAX_COMPRESS_SAMPLES:
+            compress_samples.pop(next(iter(compress_samples)))
+        compress_samples[key] = ratio
+    return ratio <= compression.COMPRESS_MAX_RATIO
+
+
+async def response_encoding(blob, request, size):
+    """The content coding to send a whole blob in, or None for identity."""
+    # A Range names bytes of the identity body, so ranged requests stay raw
+    if "range" in request.headers:
+        return None
+    stored = blob.get("encoding")
+    if stored is None and not compression.COMPRESS_RESPONSES:
+        return None
+    encoding = compression.negotiate(request.headers.get("accept-encoding"), prefer=stored)
+    if encoding is None or encoding == stored:
+        return encoding
+    if not compression.compressible(blob["pathname"], size) or not await worth_compressing(blob, encoding):
+        return None
+    return encoding
+
+
+async def serve_encoded(blob, headers, encoding):
+    # Stored in this encoding already: the object's bytes go out as they are
+    if blob.get("encoding") == encoding:
+        body = await storage.open_range(blob)
+    else:
+        source = await open_whole_body(blob)
+        body = Body(compression.encode(source, encoding), source.aclose)
+    headers["Content-Encoding"] = encoding
+    headers["ETag"] = representation_etag(blob, encoding)
+    return StreamingResponse(
+        body, media_type="application/octet-stream", headers=headers, background=BackgroundTask(body.aclose),
+    )
+
+
+async def serve_blob(blob, request, disposition_name=None, ranges=None, cache_control=REVALIDATE):
+    """Stream a blob to the client, honouring conditional requests,
+    Accept-Encoding and Range/If-Range unless explicit `ranges` are given."""
+    # Validators come from blob metadata, so a 304 costs no upstream body
+    unchanged = not_modified_response(blob, request, cache_control)
+    if unchanged is not None:
+        return unchanged
+
+    size = await blob_size(blob)
+    headers = blob_headers(blob, cache_control, disposition_name)
+    last_modified = headers["Last-Modified"]
+
+    try:
+        encoding = await response_encoding(blob, request, size) if ranges is None else None
+        if encoding is not None:
+            return await serve_encoded(blob, headers, encoding)
+    except http_client.UpstreamError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    # A local file to serve from: the blob itself, or its disk cache entry
+    if storage.remote:
+        cached = content_cache.get(blob)
+    else:
+        cached = storage.local_path(blob) if not blob.get("encoding") else None
+    if cached is not None and ranges is None:
+        # FileResponse does Range/If-Range itself and hands the file to the
+        # server (http.response.pathsend) where that is supported
+        return FileResponse(cached, headers=headers, media_type="application/octet-stream")
+
+    if ranges is None and if_range_matches(request.headers.get("if-range"), last_modified, headers["ETag"]):
+        try:
+            ranges = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            raise HTTPException(
+                status_code=416, detail="Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+
+    if cached is not None and len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = content_range(start, end, size)
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_file(cached, start, end, http_client.RELAY_CHUNK_SIZE), status_code=206,
+            media_type="application/octet-stream", headers=headers,
+        )
+
+    try:
+        if not ranges and storage.remote:
+            # Concurrent full downloads of one blob share a single upstream
+            # fetch, which also fills the disk cache
+            async def open_body():
+                return content_cache.tee(blob, await open_content(blob))
+
+            with metrics.span("singleflight.open"):
+                body = await single_flight.fetch(blob, open_body)
+            headers["Content-Length"] = str(size)
+            return StreamingResponse(body, media_type="application/octet-stream", headers=headers)
+
+        if not ranges:
+            body = await open_content(blob)
+            headers["Content-Length"] = str(size)
+            return StreamingResponse(
+                body, media_type="application/octet-stream",
+                headers=headers, background=BackgroundTask(body.aclose),
+            )
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            body = await open_content(blob, start, end)
+            headers["Content-Range"] = content_range(start, end, size)
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                body, status_code=206, media_type="application/octet-stream",
+                headers=headers, background=BackgroundTask(body.aclose),
+            )
+
+        # Multiple ranges: fetch them one after another into one multipart body
+        multipart = MultipartByteranges(ranges, size)
+        first = await open_content(blob, *ranges[0])
+    except http_client.UpstreamError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    async def parts():
+        for i, (start, end) in enumerate(ranges):
+            body = first if i == 0 else await open_content(blob, start, end)
+            yield multipart.part_header(start, end)
             try:
-                tmp_path.unlink()
-            except Exception:
-                pass
+                async for chunk in body:
+                    yield chunk
+            finally:
+                await body.aclose()
+        yield multipart.closing()
+
+    headers["Content-Length"] = str(multipart.content_length())
+    return StreamingResponse(
+        parts(), status_code=206, media_type=multipart.content_type,
+        headers=headers, background=BackgroundTask(first.aclose),
+    )
+
+
+async def deliver_blob(blob, request, mode=None, cache_control=REVALIDATE):
+    # Either bounce the client to the blob store or proxy the bytes ourselves;
+    # backends without a public URL, and objects stored compressed, are
+    # always proxied
+    await blob_size(blob)
+    target = storage.public_url(blob) if not blob.get("encoding") else None
+    if target is not None and delivery.choose(blob, request, mode) == "redirect":
+        unchanged = not_modified_response(blob, request, cache_control)
+        if unchanged is not None:
+            return unchanged
+        headers = {checksums.CONTENT_SHA256_HEADER: blob["sha256"]} if blob.get("sha256") else None
+        return RedirectResponse(target, status_code=307, headers=headers)
+    return await serve_blob(blob, request, cache_control=cache_control)
+
+
+async def head_blob(blob, request, cache_control=REVALIDATE):
+    # Metadata only: validators and size, no upstream body
+    unchanged = not_modified_response(blob, request, cache_control)
+    if unchanged is not None:
+        return unchanged
+    headers = blob_headers(blob, cache_control)
+    headers["Content-Length"] = str(await blob_size(blob))
+    return Response(status_code=200, headers=headers, media_type="application/octet-stream")
+
+
+def cache_control_for(filename, blob):
+    return IMMUTABLE if blob["pathname"] == filename and logical_name(filename) != filename else REVALIDATE
+
+
+DeliveryMode = Literal["proxy", "redirect", "auto"]
+
 
 @app.get("/download")
-def download_file(filename: str):
+async def download_file(filename: str, request: Request, delivery: DeliveryMode | None = None):
     try:
-        response = vercel_blob.list()
-        blobs = response.get("blobs", [])
-        
-        if not blobs:
-            raise HTTPException(status_code=404, detail="No blobs found")
-            
-        target_blob = None
+        target_blob = await find_blob(filename)
         
-        matches = [
-            b for b in blobs 
-            if b["pathname"].endswith(f"_{filename}") or b["pathname"] == filename
-        ]
-        
-        if not matches:
+        if not target_blob:
              raise HTTPException(status_code=404, detail=f"File '{filename}' not found")
-             
-        matches.sort(key=lambda x: x["uploadedAt"], reverse=True)
-        target_blob = matches[0]
-        
-        url = target_blob["url"]
-        blob_pathname = target_blob["pathname"]
         
-        r = requests.get(url, stream=True)
-        r.raise_for_status()
-        
-        return StreamingResponse(
-            r.iter_content(chunk_size=8192),
-            media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename={blob_pathname}"}
-        )
+        return await deliver_blob(target_blob, request, delivery, cache_control_for(filename, target_blob))
+
+    except (HTTPException, upstream.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.head("/download")
+async def head_download(filename: str, request: Request):
+    try:
+        target_blob = await find_blob(filename)
+        if not target_blob:
+            raise HTTPException(status_code=404, detail=f"File '{filename}' not found")
+        return await head_blob(target_blob, request, cache_control_for(filename, target_blob))
+    except (HTTPException, upstream.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-    except HTTPException:
+# One listing of every name for clients that mirror a directory: served from
+# the index, so it costs at most one (delta) listing of the store
+@app.get("/manifest")
+async def get_manifest(prefix: str = ""):
+    try:
+        if blob_index.stale():
+            with metrics.span("index.refresh"):
+                await run_in_threadpool(blob_index.refresh)
+        files = []
+        for blob in blob_index.all():
+            name = logical_name(blob["pathname"])
+            if not name.startswith(prefix):
+                continue
+            blob = resolve(blob)
+            files.append({
+                "name": name,
+                "pathname": blob["pathname"],
+                "size": blob.get("size"),
+                "uploadedAt": blob["uploadedAt"],
+                "sha256": blob.get("sha256"),
+            })
+        files.sort(key=lambda f: f["name"])
+        return {"prefix": prefix, "count": len(files), "files": files}
+
+    except (HTTPException, upstream.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def parse_checksum_ranges(value, size):
+    """(start, end) pairs, inclusive, from "a-b,c-d"; kept in the order given."""
+    ranges = []
+    for part in value.split(","):
+        first, dash, last = part.strip().partition("-")
+        try:
+            start, end = int(first), int(last)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Bad range {part.strip()!r}; expected start-end")
+        if not dash or not 0 <= start <= end < size:
+            raise HTTPException(status_code=416, detail=f"Range {start}-{end} is outside 0-{size - 1}")
+        ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_RANGES} ranges per request")
+    if sum(end - start + 1 for start, end in ranges) > MAX_CHECKSUM_BYTES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CHECKSUM_BYTES} bytes per request")
+    return ranges
+
+
+async def hash_range(blob, start, end):
+    digest = hashlib.sha256()
+    length = 0
+    body = await open_content(blob, start, end)
+    try:
+        async for data in body:
+            digest.update(data)
+            length += len(data)
+    finally:
+        await body.aclose()
+    if length != end - start + 1:
+        raise HTTPException(status_code=502, detail=f"Store returned {length} bytes for {start}-{end}")
+    return digest.hexdigest()
+
+
+# Verify stored content without downloading it: the SHA-256 of byte ranges
+# read back from the store, and the chunk hashes recorded at upload
+@app.get("/checksum")
+async def get_checksum(filename: str, ranges: str | None = None, chunks: bool = False):
+    try:
+        blob = await find_blob(filename)
+        if not blob:
+            raise HTTPException(status_code=404, detail=f"File '{filename}' not found")
+        size = await blob_size(blob)
+        result = {"filename": logical_name(blob["pathname"]), "size": size, "sha256": blob.get("sha256")}
+        if ranges:
+            hashed = []
+            for start, end in parse_checksum_ranges(ranges, size):
+                hashed.append({"start": start, "end": end, "sha256": await hash_range(blob, start, end)})
+            result["ranges"] = hashed
+        if chunks and blob.get("sha256"):
+            recorded = await asyncio.to_thread(content_store.object_chunks, blob["sha256"])
+            result["chunks"] = [{"offset": o, "length": n, "sha256": h} for o, n, h in recorded]
+        return result
+
+    except (HTTPException, upstream.Overloaded):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/latest")
-def get_latest_blob():
+async def get_latest_blob(request: Request, delivery: DeliveryMode | None = None):
     try:
-        response = vercel_blob.list()
-        blobs = response.get("blobs", [])
+        latest_blob = await find_blob()
         
-        if not blobs:
+        if not latest_blob:
             raise HTTPException(status_code=404, detail="No blobs found")
-            
-        sorted_blobs = sorted(blobs, key=lambda x: x["uploadedAt"], reverse=True)
-        latest_blob = sorted_blobs[0]
         
-        url = latest_blob["url"]
-        filename = latest_blob["pathname"]
+        return await deliver_blob(latest_blob, request, delivery)
 
-        r = requests.get(url, stream=True)
-        r.raise_for_status()
-        
-        return StreamingResponse(
-            r.iter_content(chunk_size=8192),
-            media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+    except (HTTPException, upstream.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
+@app.head("/latest")
+async def head_latest(request: Request):
+    try:
+        latest_blob = await find_blob()
+        if not latest_blob:
+            raise HTTPException(status_code=404, detail="No blobs found")
+        return await head_blob(latest_blob, request)
+    except (HTTPException, upstream.Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/latest/partial")
-def get_latest_partial():
+async def get_latest_partial(request: Request, start: int = 0, end: int = 8191):
+    # A fixed byte window of the latest blob, first 8KB by default
     try:
-        # List blobs
-        response = vercel_blob.list()
-        blobs = response.get("blobs", [])
+        latest_blob = await find_blob()
         
-        if not blobs:
+        if not latest_blob:
             raise HTTPException(status_code=404, detail="No blobs found")
-            
-        # Sort by uploadedAt (descending)
-        sorted_blobs = sorted(blobs, key=lambda x: x["uploadedAt"], reverse=True)
-        latest_blob = sorted_blobs[0]
-        
-        url = latest_blob["url"]
-        filename = latest_blob["pathname"]
-        
-        # Request first 8KB
-        headers = {"Range": "bytes=0-8191"}
-        r = requests.get(url, headers=headers)
-        
-        # 206 Partial Content is expected, but 200 OK is also possible if file < 8KB
-        if r.status_code not in [200, 206]:
-            raise HTTPException(status_code=r.status_code, detail="Failed to fetch partial content")
-            
-        return StreamingResponse(
-            iter([r.content]),
-            media_type="application/octet-stream",
-            headers={
-                "Content-Disposition": f"attachment; filename=partial_{filename}",
-                "Content-Length": str(len(r.content))
-            }
+        if start < 0 or end < start:
+            raise HTTPException(status_code=400, detail="Invalid byte window")
+
+        size = await blob_size(latest_blob)
+        try:
+            ranges = parse_range(f"bytes={start}-{end}", size)
+        except RangeNotSatisfiable:
+            raise HTTPException(
+                status_code=416, detail="Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+
+        return await serve_blob(
+            latest_blob, request, disposition_name=f"partial_{latest_blob['pathname']}", ranges=ranges,
+        )
+
+    except (HTTPException, upstream.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class ArchiveRequest(BaseModel):
+    files: list[str] | None = None
+    prefix: str | None = None
+    format: Literal["zip", "tar"] = "zip"
+
+
+async def stream_archive(files=None, prefix=None, fmt="zip"):
+    # Everything is resolved from the index (at most one listing) before the
+    # first byte goes out, so a missing file is a 404 and not a cut stream
+    if not files and prefix is None:
+        raise HTTPException(status_code=400, detail="Give files or a prefix")
+    if blob_index.stale():
+        with metrics.span("index.refresh"):
+            await run_in_threadpool(blob_index.refresh)
+
+    if files:
+        names = list(dict.fromkeys(Path(f).name for f in files))
+        blobs = [blob_index.lookup(name) for name in names]
+        missing = [name for name, blob in zip(names, blobs) if blob is None]
+        if missing:
+            raise HTTPException(status_code=404, detail={"message": "Files not found", "missing": missing[:100]})
+    else:
+        blobs = sorted(
+            (b for b in blob_index.all() if logical_name(b["pathname"]).startswith(prefix)),
+            key=lambda b: logical_name(b["pathname"]),
         )
+        if not blobs:
+            raise HTTPException(status_code=404, detail=f"No files match prefix '{prefix}'")
+    if len(blobs) > archive.MAX_ARCHIVE_FILES:
+        raise HTTPException(status_code=400, detail=f"More than {archive.MAX_ARCHIVE_FILES} files")
+
+    blobs = [resolve(b) for b in blobs]
+    for blob in blobs:
+        if blob.get("size") is None:
+            blob["size"] = await storage.size(blob)
+
+    entries = []
+    for blob in blobs:
+        name = logical_name(blob["pathname"])
+        entries.append((name, blob, archive.tar_header(name, blob) if fmt == "tar" else None))
+
+    headers = {"Content-Disposition": f"attachment; filename=archive.{fmt}"}
+    if fmt == "tar":
+        headers["Content-Length"] = str(archive.tar_length(entries))
+        body = archive.stream_tar(entries, open_whole_body)
+        media_type = "application/x-tar"
+    else:
+        body = archive.stream_zip(entries, open_whole_body)
+        media_type = "application/zip"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
+
+@app.get("/archive")
+async def get_archive(files: list[str] | None = Query(None), prefix: str | None = None,
+                      format: Literal["zip", "tar"] = "zip"):
+    try:
+        return await stream_archive(files, prefix, format)
+    except (HTTPException, upstream.Overloaded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/archive")
+async def post_archive(payload: ArchiveRequest):
+    # Same as GET, for file lists too long for a query string
+    try:
+        return await stream_archive(payload.files, payload.prefix, payload.format)
+    except (HTTPException, upstream.Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,270 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TRACE_HEADER = "x-trace"
+
+# By name: a module that is imported again (tests reload main) replaces its
+# metrics rather than adding a second copy of each
+_metrics = {}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics[name] = self
+
+    def _samples(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """A gauge set by inc()/dec(), or read from `function` at scrape time;
+    a labelled one's function returns {label values: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def _samples(self):
+        if self.function is not None:
+            value = self.function()
+            return sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        names = self.label_names + ("le",)
+        with self._lock:
+            samples = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        for key, counts, total in samples:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time from request start to the end of the response body.",
+    ("route", "method", "status"),
+)
+requests_in_flight = Gauge("http_requests_in_flight", "Requests being handled.")
+request_bytes = Counter("http_request_bytes_total", "Request body bytes received.", ("route",))
+response_bytes = Counter("http_response_bytes_total", "Response body bytes sent.", ("route",))
+upstream_duration = Histogram(
+    "upstream_request_duration_seconds",
+    "Storage backend calls by operation and status; for reads, the time until the body starts.",
+    ("op", "status"),
+)
+
+
+# Tracing: a request sends `X-Trace: 1` to have its spans recorded. With no
+# trace active, span() is one ContextVar lookup returning a shared no-op.
+_trace = contextvars.ContextVar("trace", default=None)
+_NO_SPAN = nullcontext()
+
+
+class Trace:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, started, time.perf_counter() - started)
+
+    def add(self, name, started, duration):
+        self.spans.append((name, started - self.started, duration))
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={duration * 1000:.2f}" for name, _, duration in self.spans)
+
+    def to_dict(self):
+        return {
+            "trace": self.id,
+            "spans": [{"name": n, "start_ms": round(s * 1000, 3), "duration_ms": round(d * 1000, 3)}
+                      for n, s, d in self.spans],
+        }
+
+
+def span(name):
+    """Time a block as a span of the current request's trace, if it has one."""
+    trace = _trace.get()
+    return _NO_SPAN if trace is None else trace.span(name)
+
+
+@contextmanager
+def upstream(op):
+    """Time a storage call into upstream_request_duration_seconds (and the trace)."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with span(f"upstream.{op}"):
+            yield
+        status = "200"
+    except Exception as e:
+        code = getattr(e, "status_code", None)
+        if code is not None:
+            status = str(code)
+        raise
+    finally:
+        upstream_duration.observe(time.perf_counter() - started, op, status)
+
+
+def _route_path(scope):
+    # Label by route template, not raw path, to keep the label set bounded.
+    # The router puts the route it matched in the scope, so this is only
+    # known once routing is done: by the first receive() or send().
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _header(headers, name):
+    return next((v for k, v in headers if k.lower() == name), None)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, bytes and in-flight
+    requests, and tracing requests that carry the X-Trace header.
+
+    A traced request gets an X-Trace-Id header and a Server-Timing header
+    with the spans finished before the response started. The full trace,
+    including the time spent waiting on the client in send(), is printed
+    when the response ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+        content_length = None
+        traced = any(k == TRACE_HEADER.encode() and v not in (b"", b"0") for k, v in scope["headers"])
+        trace = Trace() if traced else None
+        token = _trace.set(trace) if traced else None
+        send_time = 0.0
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes.inc(_route_path(scope), amount=len(message.get("body", b"")))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, send_time, content_length
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_length = _header(message.get("headers", []), b"content-length")
+                if trace is not None:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-trace-id", trace.id.encode()))
+                    if trace.spans:
+                        headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                response_bytes.inc(_route_path(scope), amount=len(message.get("body", b"")))
+            elif message["type"] == "http.response.pathsend":
+                # A FileResponse handing the whole file to the server to send
+                size = int(content_length) if content_length else os.path.getsize(message["path"])
+                response_bytes.inc(_route_path(scope), amount=size)
+            if trace is None:
+                return await send(message)
+            sent = time.perf_counter()
+            await send(message)
+            send_time += time.perf_counter() - sent
+
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.dec()
+            request_duration.observe(elapsed, _route_path(scope), scope["method"], str(status))
+            if trace is not None:
+                trace.add("client.send", trace.started, send_time)
+                trace.add("request", started, elapsed)
+                _trace.reset(token)
+                print(f"trace {scope['method']} {scope['path']} {json.dumps(trace.to_dict())}")
@@ -0,0 +1,184 @@
+import asyncio
+import os
+
+SHARED_BUFFER_BYTES = int(os.getenv("SHARED_BUFFER_BYTES", 8 * 1024 * 1024))
+
+stats = {
+    "body_requests": 0,
+    "body_fetches": 0,
+    "body_joined": 0,
+    "readers_detached": 0,
+}
+
+
+class SharedFetch:
+    """One upstream body fetch fanned out to every concurrent reader.
+
+    The fetch keeps a window of at most `window` bytes. It runs at the pace
+    of the fastest reader and never gets more than `window` bytes ahead of
+    it. A reader that falls behind the start of the window is detached and
+    finishes on its own ranged upstream request, so one slow client cannot
+    stall the rest.
+    """
+
+    def __init__(self, blob, open_body, open_range, window=SHARED_BUFFER_BYTES):
+        self.blob = blob
+        self.window = window
+        self._open_body = open_body
+        self._open_range = open_range
+        self._opened = asyncio.Event()
+        self._chunks = []
+        self._base = 0
+        self._fetched = 0
+        self._buffered = 0
+        self._done = False
+        self._abandoned = False
+        self._error = None
+        self._positions = {}
+        self._changed = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def joinable(self):
+        return self._base == 0 and self._error is None and not self._abandoned
+
+    async def opened(self):
+        """Wait until the upstream response has started; raises if it failed."""
+        await self._opened.wait()
+        if self._error is not None and self._fetched == 0:
+            raise self._error
+
+    async def _run(self):
+        body = None
+        try:
+            body = await self._open_body()
+            stats["body_fetches"] += 1
+            self._opened.set()
+            async for chunk in body:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: self._positions and self._fetched - max(self._positions.values()) < self.window
+                    )
+                    self._chunks.append(chunk)
+                    self._fetched += len(chunk)
+                    self._buffered += len(chunk)
+                    while self._buffered - len(self._chunks[0]) >= self.window:
+                        dropped = self._chunks.pop(0)
+                        self._base += len(dropped)
+                        self._buffered -= len(dropped)
+                    self._changed.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            if body is not None:
+                await body.aclose()
+            self._opened.set()
+            async with self._changed:
+                self._done = True
+                self._changed.notify_all()
+
+    def _read_at(self, pos):
+        offset = self._base
+        for chunk in self._chunks:
+            if pos < offset + len(chunk):
+                return chunk[pos - offset:]
+            offset += len(chunk)
+        return None
+
+    def join(self):
+        """Register a reader at offset 0 so the fetch waits for it."""
+        reader = object()
+        self._positions[reader] = 0
+        return reader
+
+    def leave(self, reader):
+        self._positions.pop(reader, None)
+        # Nobody is reading any more: stop pulling from upstream
+        if not self._positions and not self._done:
+            self._abandoned = True
+            self._task.cancel()
+
+    async def read(self, reader):
+        """Yield the whole body from the start for a joined reader."""
+        pos = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: pos < self._base or pos < self._fetched or self._done
+                    )
+                    if pos < self._base:
+                        break
+                    data = self._read_at(pos)
+                    if data is None:
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    pos += len(data)
+                    self._positions[reader] = pos
+                    self._changed.notify_all()
+                yield data
+        finally:
+            self.leave(reader)
+
+        # Fell out of the window: fetch the rest ourselves
+        stats["readers_detached"] += 1
+        size = self.blob["size"]
+        if pos < size:
+            body = await self._open_range(self.blob, pos, size - 1)
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                await body.aclose()
+
+
+class SingleFlight:
+    """Registry of in-progress shared fetches, keyed by blob URL.
+
+    `open_range(blob, start, end)` is the storage read that detached
+    readers finish on.
+    """
+
+    def __init__(self, open_range):
+        self._open_range = open_range
+        self._flights = {}
+
+    async def fetch(self, blob, open_body):
+        """Return an async iterator over the body of `blob`, joining a fetch
+        already in flight or starting one with `await open_body()`.
+
+        Raises whatever open_body() raised, so callers can still turn an
+        upstream error into a proper status before sending headers.
+        """
+        stats["body_requests"] += 1
+        key = blob["url"]
+        flight = self._flights.get(key)
+        if flight is not None and flight.joinable:
+            stats["body_joined"] += 1
+        else:
+            flight = SharedFetch(blob, open_body, self._open_range)
+            self._flights[key] = flight
+            flight._task.add_done_callback(lambda _: self._forget(key, flight))
+        reader = flight.join()
+        try:
+            await flight.opened()
+        except BaseException:
+            flight.leave(reader)
+            raise
+        return flight.read(reader)
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+def coalescing_stats(index_stats=None):
+    result = dict(stats)
+    fetches = stats["body_fetches"]
+    result["body_coalescing_ratio"] = stats["body_requests"] / fetches if fetches else None
+    if index_stats:
+        result.update(index_stats)
+        syncs = index_stats.get("list_syncs")
+        result["list_coalescing_ratio"] = index_stats["list_requests"] / syncs if syncs else None
+    return result
@@ -0,0 +1,423 @@
+import asyncio
+import inspect
+import mmap
+import os
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from urllib.parse import quote, unquote, urlparse
+
+from blob_index import format_uploaded_at, uploaded_at_now
+from chunk_sessions import pwrite_all
+import http_client
+import upstream
+from http_client import RELAY_CHUNK_SIZE, UpstreamError
+from blob_api import BlobApi
+from streaming import StreamingBlobUpload
+
+STORAGE_BACKENDS = ("vercel", "local", "memory")
+DEFAULT_LOCAL_STORAGE_DIR = Path(tempfile.gettempdir()) / "uploads" / "blobs"
+
+
+class Body:
+    """Async iterator over (part of) a blob body.
+
+    aclose() releases the underlying stream or file even if iteration never
+    started, so it is safe to hand to a response's background task.
+    """
+
+    def __init__(self, chunks, close=None):
+        self._chunks = chunks
+        self._close = close
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._chunks.__anext__()
+
+    async def aclose(self):
+        await self._chunks.aclose()
+        if self._close is not None:
+            close, self._close = self._close, None
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+
+class StorageBackend:
+    """Where blobs live.
+
+    Blobs are dicts with url, downloadUrl, pathname, size and uploadedAt,
+    the shape the Vercel Blob API returns. put/list/delete block and are run
+    in a thread by callers on the event loop; reads are async.
+    """
+
+    name = None
+    # Whether reads cross the network, i.e. are worth caching and coalescing
+    remote = False
+
+    def put(self, pathname: str, data: bytes) -> dict:
+        raise NotImplementedError
+
+    def open_upload(self, pathname: str):
+        """A streaming upload: async write(data), close() -> blob, abort(); tracks .size."""
+        raise NotImplementedError
+
+    def list(self, prefix=None, cursor=None, limit=1000) -> dict:
+        """One page of blobs ordered by pathname: {"blobs", "cursor", "hasMore"}."""
+        raise NotImplementedError
+
+    def delete(self, urls):
+        raise NotImplementedError
+
+    def stat(self, pathname: str):
+        """The blob stored at exactly `pathname`, or None."""
+        for blob in self.list(prefix=pathname, limit=10)["blobs"]:
+            if blob["pathname"] == pathname:
+                return blob
+        return None
+
+    def rename(self, blob, pathname: str) -> dict:
+        """Move `blob` to `pathname` inside the store, without the bytes
+        passing through this process."""
+        raise NotImplementedError
+
+    async def open_range(self, blob, start=None, end=None) -> Body:
+        """Bytes start..end (inclusive) of `blob`, or all of it.
+
+        Raises UpstreamError before returning if the blob cannot be read.
+        """
+        raise NotImplementedError
+
+    async def size(self, blob) -> int:
+        raise NotImplementedError
+
+    def local_path(self, blob):
+        """Path of the blob on this machine, if it has one."""
+        return None
+
+    def public_url(self, blob):
+        """URL clients can fetch the blob from directly, if there is one."""
+        return None
+
+
+class VercelBackend(StorageBackend):
+    name = "vercel"
+    remote = True
+
+    def __init__(self, api_url=None):
+        self.api = BlobApi(api_url)
+        self.timeout = upstream.UPSTREAM_TIMEOUT
+
+    def _to_blob(self, resp, pathname, size):
+        return {
+            "url": resp["url"],
+            "downloadUrl": resp.get("downloadUrl", resp["url"]),
+            "pathname": resp.get("pathname", pathname),
+            "size": size,
+            "uploadedAt": resp.get("uploadedAt") or uploaded_at_now(),
+        }
+
+    def put(self, pathname, data):
+        resp = upstream.call("put", self.api.put, pathname, data, self.timeout)
+        return self._to_blob(resp, pathname, len(data))
+
+    def open_upload(self, pathname):
+        return _VercelUpload(self, pathname)
+
+    def list(self, prefix=None, cursor=None, limit=1000):
+        return upstream.call("list", self.api.list, self.timeout, prefix, cursor, limit)
+
+    def delete(self, urls):
+        if urls:
+            upstream.call("delete", self.api.delete, urls, self.timeout)
+
+    def rename(self, blob, pathname):
+        # The Blob API has no move: copy server-side, then drop the source
+        resp = upstream.call("copy", self.api.copy, blob["url"], pathname, self.timeout)
+        self.delete([blob["url"]])
+        return self._to_blob(resp, pathname, blob.get("size"))
+
+    async def open_range(self, blob, start=None, end=None):
+        r = await upstream.call_async("get", http_client.open_range, blob["url"], start, end)
+        return Body(http_client.iter_body(r, start, end), r.aclose)
+
+    async def size(self, blob):
+        return await upstream.call_async("head", http_client.content_length, blob["url"])
+
+    def public_url(self, blob):
+        return blob.get("downloadUrl") or blob["url"]
+
+
+class _VercelUpload(StreamingBlobUpload):
+    def __init__(self, backend, pathname):
+        super().__init__(pathname, backend.api, timeout=backend.timeout)
+        self._backend = backend
+
+    async def close(self):
+        return self._backend._to_blob(await super().close(), self.pathname, self.size)
+
+
+def _page(pathnames, prefix, cursor, limit):
+    """The page of sorted `pathnames` after `cursor`, plus the next cursor."""
+    names = [p for p in pathnames if (not prefix or p.startswith(prefix)) and (not cursor or p > cursor)]
+    page = names[:limit]
+    has_more = len(names) > limit
+    return page, (page[-1] if has_more else None), has_more
+
+
+class LocalBackend(StorageBackend):
+    """Blobs as files under `root`, named by pathname.
+
+    Writes go to a temporary file with positional writes and are renamed
+    into place, so readers never see a partial blob. Full-body reads are
+    served from local_path() as a FileResponse (sendfile where the server
+    supports it); ranged reads slice an mmap of the file.
+    """
+
+    name = "local"
+
+    def __init__(self, root: Path = DEFAULT_LOCAL_STORAGE_DIR):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, pathname):
+        path = (self.root / pathname).resolve()
+        if path == self.root or self.root not in path.parents:
+            raise ValueError(f"Invalid pathname: {pathname}")
+        return path
+
+    def _to_blob(self, pathname, path):
+        stat = path.stat()
+        url = path.as_uri()
+        return {
+            "url": url,
+            "downloadUrl": url,
+            "pathname": pathname,
+            "size": stat.st_size,
+            "uploadedAt": format_uploaded_at(stat.st_mtime),
+        }
+
+    def _url_path(self, url):
+        return self._path(unquote(urlparse(url).path))
+
+    def _tmp_path(self, path):
+        # Not derived from the name, which may already be near NAME_MAX
+        return path.with_name(f".{uuid.uuid4().hex}.tmp")
+
+    def put(self, pathname, data):
+        path = self._path(pathname)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp_path(path)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            pwrite_all(fd, data, 0)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+        return self._to_blob(pathname, path)
+
+    def open_upload(self, pathname):
+        return _LocalUpload(self, pathname)
+
+    def list(self, prefix=None, cursor=None, limit=1000):
+        pathnames = sorted(
+            path.relative_to(self.root).as_posix()
+            for path in self.root.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+        page, cursor, has_more = _page(pathnames, prefix, cursor, limit)
+        blobs = []
+        for pathname in page:
+            try:
+                blobs.append(self._to_blob(pathname, self.root / pathname))
+            except FileNotFoundError:
+                pass
+        return {"blobs": blobs, "cursor": cursor, "hasMore": has_more}
+
+    def delete(self, urls):
+        for url in urls:
+            self._url_path(url).unlink(missing_ok=True)
+
+    def stat(self, pathname):
+        path = self._path(pathname)
+        return self._to_blob(pathname, path) if path.is_file() else None
+
+    def rename(self, blob, pathname):
+        path = self._path(pathname)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self._url_path(blob["url"]), path)
+        return self._to_blob(pathname, path)
+
+    # Reads go by URL: a ref resolves to its object's URL, not its pathname
+    async def open_range(self, blob, start=None, end=None):
+        try:
+            f = open(self._url_path(blob["url"]), "rb")
+        except FileNotFoundError:
+            raise UpstreamError(404)
+        return Body(_iter_mmap(f, start, end), f.close)
+
+    async def size(self, blob):
+        try:
+            return self._url_path(blob["url"]).stat().st_size
+        except FileNotFoundError:
+            raise UpstreamError(404)
+
+    def local_path(self, blob):
+        path = self._url_path(blob["url"])
+        return path if path.is_file() else None
+
+
+async def _iter_mmap(f, start, end, chunk_size=RELAY_CHUNK_SIZE):
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        start = 0 if start is None else start
+        end = size - 1 if end is None else min(end, size - 1)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(start, end + 1, chunk_size):
+                yield mm[pos:min(pos + chunk_size, end + 1)]
+    finally:
+        f.close()
+
+
+class _LocalUpload:
+    def __init__(self, backend, pathname):
+        self.pathname = pathname
+        self.size = 0
+        self._backend = backend
+        self._path = backend._path(pathname)
+        self._tmp = backend._tmp_path(self._path)
+        self._fd = None
+
+    async def write(self, data: bytes):
+        if self._fd is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self._tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.size = await asyncio.to_thread(pwrite_all, self._fd, data, self.size)
+
+    async def close(self) -> dict:
+        if self._fd is None:
+            await self.write(b"")
+        os.close(self._fd)
+        self._fd = None
+        os.replace(self._tmp, self._path)
+        return self._backend._to_blob(self.pathname, self._path)
+
+    async def abort(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._tmp.unlink(missing_ok=True)
+
+
+class MemoryBackend(StorageBackend):
+    """Blobs held in a dict; for tests and benchmarks that must not touch
+    the network or the disk."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def _to_blob(self, pathname, data, uploaded_at):
+        url = f"memory:///{quote(pathname)}"
+        return {"url": url, "downloadUrl": url, "pathname": pathname, "size": len(data), "uploadedAt": uploaded_at}
+
+    def _pathname(self, url):
+        return unquote(urlparse(url).path.lstrip("/"))
+
+    def _get(self, blob):
+        with self._lock:
+            entry = self._blobs.get(self._pathname(blob["url"]))
+        if entry is None:
+            raise UpstreamError(404)
+        return entry[0]
+
+    def put(self, pathname, data):
+        data = bytes(data)
+        uploaded_at = uploaded_at_now()
+        with self._lock:
+            self._blobs[pathname] = (data, uploaded_at)
+        return self._to_blob(pathname, data, uploaded_at)
+
+    def open_upload(self, pathname):
+        return _MemoryUpload(self, pathname)
+
+    def list(self, prefix=None, cursor=None, limit=1000):
+        with self._lock:
+            entries = dict(self._blobs)
+        page, cursor, has_more = _page(sorted(entries), prefix, cursor, limit)
+        blobs = [self._to_blob(p, *entries[p]) for p in page]
+        return {"blobs": blobs, "cursor": cursor, "hasMore": has_more}
+
+    def delete(self, urls):
+        with self._lock:
+            for url in urls:
+                self._blobs.pop(self._pathname(url), None)
+
+    def stat(self, pathname):
+        with self._lock:
+            entry = self._blobs.get(pathname)
+        return self._to_blob(pathname, *entry) if entry else None
+
+    def rename(self, blob, pathname):
+        with self._lock:
+            entry = self._blobs.pop(self._pathname(blob["url"]))
+            self._blobs[pathname] = entry
+        return self._to_blob(pathname, *entry)
+
+    async def open_range(self, blob, start=None, end=None):
+        data = memoryview(self._get(blob))
+        start = 0 if start is None else start
+        end = len(data) - 1 if end is None else min(end, len(data) - 1)
+
+        async def chunks():
+            for pos in range(start, end + 1, RELAY_CHUNK_SIZE):
+                yield bytes(data[pos:min(pos + RELAY_CHUNK_SIZE, end + 1)])
+
+        return Body(chunks())
+
+    async def size(self, blob):
+        return len(self._get(blob))
+
+
+class _MemoryUpload:
+    def __init__(self, backend, pathname):
+        self.pathname = pathname
+        self.size = 0
+        self._backend = backend
+        self._buffer = bytearray()
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        self.size += len(data)
+
+    async def close(self) -> dict:
+        return await asyncio.to_thread(self._backend.put, self.pathname, self._buffer)
+
+    async def abort(self):
+        self._buffer.clear()
+
+
+def create_backend(name: str = None) -> StorageBackend:
+    """The storage backend called `name`, by default the one STORAGE_BACKEND
+    selects.
+
+    Settings are read here rather than at import so values from a .env file
+    loaded by the app are seen. BLOB_API_URL points the Vercel backend at
+    another Blob API (e.g. a local fake); LOCAL_STORAGE_DIR is where the
+    local backend keeps its files.
+    """
+    name = name or os.getenv("STORAGE_BACKEND", "vercel")
+    if name == "vercel":
+        return VercelBackend(os.getenv("BLOB_API_URL"))
+    if name == "local":
+        return LocalBackend(os.getenv("LOCAL_STORAGE_DIR") or DEFAULT_LOCAL_STORAGE_DIR)
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"STORAGE_BACKEND must be one of {', '.join(STORAGE_BACKENDS)}")
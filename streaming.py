@@ -0,0 +1,199 @@
+import asyncio
+import os
+
+from fastapi import Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+import upstream
+
+# Vercel Blob (S3 underneath) needs every part except the last to be >= 5 MB
+PART_SIZE = int(os.getenv("BLOB_PART_SIZE", 8 * 1024 * 1024))
+MAX_INFLIGHT_PARTS = int(os.getenv("BLOB_MAX_INFLIGHT_PARTS", 4))
+
+
+class MultipartFileStream:
+    """Reads a single file field out of a multipart/form-data request body
+    as it arrives, without spooling the body to disk like UploadFile does."""
+
+    def __init__(self, request: Request, field_name: str = "file"):
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise ValueError("Expected a multipart/form-data body")
+
+        self.field_name = field_name
+        self.filename = None
+        self._body = request.stream()
+        self._eof = False
+        self._in_target = False
+        self._found = False
+        self._done = False
+        self._pending = bytearray()
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = params.get(b"name", b"").decode("latin-1")
+        if not self._found and name == self.field_name and b"filename" in params:
+            self._found = True
+            self._in_target = True
+            self.filename = params[b"filename"].decode("utf-8", errors="replace")
+
+    def _on_part_data(self, data, start, end):
+        if self._in_target:
+            self._pending += data[start:end]
+
+    def _on_part_end(self):
+        if self._in_target:
+            self._in_target = False
+            self._done = True
+
+    async def _pump(self):
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            self._parser.finalize()
+            return
+        if chunk:
+            self._parser.write(chunk)
+
+    async def open(self):
+        """Consume the body up to the start of the file field and return its filename."""
+        while not self._found and not self._eof:
+            await self._pump()
+        return self.filename
+
+    async def read(self, size: int = -1) -> bytes:
+        while not self._done and not self._eof and (size < 0 or len(self._pending) < size):
+            await self._pump()
+        if size < 0 or size >= len(self._pending):
+            data = bytes(self._pending)
+            self._pending.clear()
+        else:
+            data = bytes(self._pending[:size])
+            del self._pending[:size]
+        return data
+
+
+class StreamingBlobUpload:
+    """Uploads a stream of bytes through a blob_api.BlobApi as a multipart upload.
+
+    Data passed to write() is cut into PART_SIZE parts which are uploaded in
+    the background while more data keeps arriving. At most max_inflight parts
+    are held in memory; write() waits for a free slot, which pushes
+    backpressure onto the incoming request. Uploads that never fill a single
+    part fall back to a plain put().
+    """
+
+    def __init__(self, pathname: str, api, part_size: int = PART_SIZE,
+                 max_inflight: int = MAX_INFLIGHT_PARTS, timeout: float = upstream.UPSTREAM_TIMEOUT):
+        self.pathname = pathname
+        self.api = api
+        self.part_size = part_size
+        self.timeout = timeout
+        self.size = 0
+        self._buffer = bytearray()
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._tasks = []
+        self._parts = {}
+        self._error = None
+        self._upload_id = None
+        self._key = None
+
+    async def _start(self):
+        self._upload_id, self._key = await upstream.call_async(
+            "mpu_create", asyncio.to_thread, self.api.mpu_create, self.pathname, self.timeout,
+        )
+
+    async def _upload_part(self, part_number, data):
+        try:
+            self._parts[part_number] = await upstream.call_async(
+                "mpu_part", asyncio.to_thread,
+                self.api.mpu_part, self.pathname, self._upload_id, self._key, part_number, data, self.timeout,
+            )
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+        finally:
+            self._slots.release()
+
+    async def _submit(self, data):
+        await self._slots.acquire()
+        if self._error is not None:
+            self._slots.release()
+            raise self._error
+        if self._upload_id is None:
+            try:
+                await self._start()
+            except Exception:
+                self._slots.release()
+                raise
+        part_number = len(self._tasks) + 1
+        self._tasks.append(asyncio.create_task(self._upload_part(part_number, data)))
+
+    async def write(self, data: bytes):
+        if self._error is not None:
+            raise self._error
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._submit(part)
+
+    async def close(self) -> dict:
+        """Flush the last part and finish the upload, returning the blob metadata."""
+        if self._upload_id is None:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            return await upstream.call_async(
+                "put", asyncio.to_thread, self.api.put, self.pathname, data, self.timeout,
+            )
+
+        if self._buffer:
+            part = bytes(self._buffer)
+            self._buffer.clear()
+            await self._submit(part)
+
+        await asyncio.gather(*self._tasks)
+        if self._error is not None:
+            raise self._error
+
+        parts = [self._parts[n] for n in sorted(self._parts)]
+        return await upstream.call_async(
+            "mpu_complete", asyncio.to_thread,
+            self.api.mpu_complete, self.pathname, self._upload_id, self._key, parts, self.timeout,
+        )
+
+    async def abort(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._buffer.clear()
@@ -0,0 +1,36 @@
+import importlib
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    """A fresh main module on the memory backend, with its state under tmp_path."""
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    monkeypatch.setenv("VERCEL", "1")  # no .env file
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    import main
+    return importlib.reload(main)
+
+
+@pytest.fixture
+def client(main):
+    from fastapi.testclient import TestClient
+    with TestClient(main.app) as c:
+        yield c
+
+
+def finished(client, response):
+    """The body of a finalize response, waiting for its job when it was queued."""
+    if response.status_code == 202:
+        response = client.get(response.json()["statusUrl"], params={"wait": 30})
+        job = response.json()
+        assert job["status"] == "completed", job
+        return job["result"]
+    assert response.status_code == 200, response.text
+    return response.json()
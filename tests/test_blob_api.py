@@ -0,0 +1,67 @@
+import httpx
+import pytest
+
+from blob_api import BlobApi, BlobApiError
+import upstream
+
+
+def api_with(handler, monkeypatch):
+    monkeypatch.setenv("BLOB_READ_WRITE_TOKEN", "vercel_blob_rw_test")
+    api = BlobApi("http://blob.test/")
+    api._client = httpx.Client(transport=httpx.MockTransport(handler))
+    return api
+
+
+def test_requests_go_to_the_configured_url(monkeypatch):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"url": "http://blob.test/b/a.txt", "pathname": "a.txt"})
+
+    api = api_with(handler, monkeypatch)
+    api.put("dir/a b.txt", b"data", 5)
+    api.copy("http://blob.test/b/a.txt", "c.txt", 5)
+
+    put, copy = seen
+    assert put.method == "PUT" and put.url.host == "blob.test"
+    assert put.url.params["pathname"] == "dir/a b.txt"
+    assert put.headers["authorization"] == "Bearer vercel_blob_rw_test"
+    assert put.headers["x-content-type"] == "text/plain"
+    assert put.content == b"data"
+    assert copy.url.params["fromUrl"] == "http://blob.test/b/a.txt"
+
+
+def test_multipart_parts_carry_etags(monkeypatch):
+    def handler(request):
+        action = request.headers["x-mpu-action"]
+        if action == "create":
+            return httpx.Response(200, json={"uploadId": "u1", "key": "k/1"})
+        if action == "upload":
+            return httpx.Response(200, headers={"etag": f'"{request.headers["x-mpu-part-number"]}"'}, json={})
+        return httpx.Response(200, json={"pathname": "big.bin", "parts": request.read().decode()})
+
+    api = api_with(handler, monkeypatch)
+    upload_id, key = api.mpu_create("big.bin", 5)
+    part = api.mpu_part("big.bin", upload_id, key, 1, b"x", 5)
+    assert part == {"partNumber": 1, "etag": '"1"'}
+    assert api.mpu_complete("big.bin", upload_id, key, [part], 5)["pathname"] == "big.bin"
+
+
+def test_errors_carry_the_status(monkeypatch):
+    api = api_with(lambda request: httpx.Response(503, text="busy"), monkeypatch)
+    with pytest.raises(BlobApiError) as e:
+        api.list(5)
+    assert e.value.status_code == 503
+    assert upstream.transient(e.value)
+
+    api = api_with(lambda request: httpx.Response(403, text="denied"), monkeypatch)
+    with pytest.raises(BlobApiError) as e:
+        api.delete(["http://blob.test/b/a.txt"], 5)
+    assert not upstream.transient(e.value)
+
+
+def test_missing_token(monkeypatch):
+    monkeypatch.delenv("BLOB_READ_WRITE_TOKEN", raising=False)
+    with pytest.raises(BlobApiError):
+        BlobApi().list(5)
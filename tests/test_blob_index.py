@@ -0,0 +1,91 @@
+import base64
+
+from blob_index import BlobIndex, logical_name, ref_pathname
+from conftest import finished
+
+
+class FakeManifest:
+    def __init__(self, blobs=()):
+        self.blobs = list(blobs)
+
+    def load(self):
+        return list(self.blobs)
+
+    def sync(self):
+        return [], []
+
+    def upsert(self, blobs):
+        pass
+
+    def delete(self, urls):
+        pass
+
+
+def blob(pathname, uploaded_at):
+    return {"url": f"memory:///{pathname}", "pathname": pathname, "size": 1, "uploadedAt": uploaded_at}
+
+
+SHA = "ab" * 32
+
+
+def test_logical_name_strips_one_prefix():
+    assert logical_name("1700000000_report.csv") == "report.csv"
+    assert logical_name("1700000000_2024_report.csv") == "2024_report.csv"
+    assert logical_name(ref_pathname(1700000000, SHA, 5, "2024_report.csv")) == "2024_report.csv"
+    assert logical_name(ref_pathname(1700000000, SHA, 5, "a.txt", "zstd")) == "a.txt"
+
+
+def test_digit_prefixed_names_resolve_to_themselves():
+    plain = blob(ref_pathname(1700000000, SHA, 1, "report.csv"), "2023-11-14T22:13:20.000Z")
+    dated = blob(ref_pathname(1700000001, SHA, 1, "2024_report.csv"), "2023-11-14T22:13:21.000Z")
+    index = BlobIndex(FakeManifest([plain, dated]))
+
+    assert index.lookup("report.csv") is plain
+    assert index.lookup("2024_report.csv") is dated
+    assert index.versions("2024_report.csv") == [dated]
+    assert index.versions("report.csv") == [plain]
+    assert index.lookup("2025_report.csv") is None
+
+
+def test_exact_version_by_pathname():
+    old = blob(ref_pathname(1700000000, SHA, 1, "a.txt"), "2023-11-14T22:13:20.000Z")
+    new = blob(ref_pathname(1700000005, SHA, 1, "a.txt"), "2023-11-14T22:13:25.000Z")
+    legacy = blob("1690000000_a.txt", "2023-07-22T04:26:40.000Z")
+    index = BlobIndex(FakeManifest([old, new, legacy]))
+
+    assert index.lookup("a.txt") is new
+    assert index.lookup("1700000000_a.txt") is old
+    assert index.lookup("1690000000_a.txt") is legacy
+    assert index.lookup("1700000009_a.txt") is None
+    assert len(index.versions("a.txt")) == 3
+    # A version's pathname is not a name of its own
+    assert index.versions("1700000000_a.txt") == []
+
+
+def test_remove_moves_newest_back():
+    old = blob("1700000000_a.txt", "2023-11-14T22:13:20.000Z")
+    new = blob("1700000005_a.txt", "2023-11-14T22:13:25.000Z")
+    index = BlobIndex(FakeManifest([old, new]))
+    index.refresh()
+    index.remove(new)
+    assert index.lookup("a.txt") is old
+    assert index.latest() is old
+
+
+def test_digit_prefixed_upload_keeps_other_file(client):
+    assert client.put("/upload/report.csv", content=b"plain").status_code == 200
+    assert client.put("/upload/2024_report.csv", content=b"dated").status_code == 200
+    assert client.get("/download", params={"filename": "2024_report.csv"}).content == b"dated"
+    assert client.get("/download", params={"filename": "report.csv"}).content == b"plain"
+
+    # Overwriting the digit-prefixed name must leave report.csv alone
+    response = client.post("/test1", json={
+        "data": base64.b64encode(b"dated v2").decode(), "chunkNumber": 0, "totalChunks": 1,
+        "fileName": "2024_report.csv", "isStarted": True, "isCompleted": True,
+    })
+    finished(client, response)
+    assert client.get("/download", params={"filename": "2024_report.csv"}).content == b"dated v2"
+    assert client.get("/download", params={"filename": "report.csv"}).content == b"plain"
+
+    names = {f["name"] for f in client.get("/manifest").json()["files"]}
+    assert names == {"report.csv", "2024_report.csv"}
@@ -0,0 +1,80 @@
+import pytest
+
+from byte_ranges import (
+    MAX_RANGES, MultipartByteranges, RangeNotSatisfiable, if_range_matches, not_modified, parse_range,
+)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=100-", [(100, 999)]),
+    ("bytes=-100", [(900, 999)]),
+    ("bytes=-5000", [(0, 999)]),
+    ("bytes=990-2000", [(990, 999)]),
+    ("bytes=500-599, 0-99", [(0, 99), (500, 599)]),
+    ("bytes=0-99,100-199,150-300", [(0, 300)]),
+    ("BYTES=0-0", [(0, 0)]),
+    ("bytes=0-99,2000-3000", [(0, 99)]),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None, "", "items=0-1", "bytes=", "bytes=abc", "bytes=5", "bytes=10-5", "bytes=x-5",
+    "bytes=" + ",".join(f"{i}-{i}" for i in range(MAX_RANGES + 1)),
+])
+def test_parse_range_ignored(header):
+    # Malformed or abusive headers get the whole body
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", 1000), ("bytes=-0", 1000), ("bytes=0-", 0)])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
+
+
+def test_if_range():
+    date = "Tue, 14 Nov 2023 22:13:20 GMT"
+    assert if_range_matches(None, date)
+    assert if_range_matches(date, date)
+    assert not if_range_matches("Wed, 15 Nov 2023 22:13:20 GMT", date)
+    assert if_range_matches('"abc"', date, '"abc"')
+    assert not if_range_matches('W/"abc"', date, '"abc"')
+    assert not if_range_matches("garbage", date)
+
+
+def test_not_modified():
+    date = "Tue, 14 Nov 2023 22:13:20 GMT"
+    assert not_modified('"a", W/"b"', None, '"b"', date)
+    assert not_modified("*", None, '"b"', date)
+    assert not not_modified('"a"', date, '"b"', date)  # If-None-Match wins
+    assert not_modified(None, date, '"b"', date)
+    assert not not_modified(None, "Mon, 13 Nov 2023 00:00:00 GMT", '"b"', date)
+
+
+def test_multipart_length():
+    framing = MultipartByteranges([(0, 9), (20, 29)], 100)
+    body = b"".join(framing.part_header(s, e) + b"x" * (e - s + 1) for s, e in framing.ranges) + framing.closing()
+    assert len(body) == framing.content_length()
+
+
+def test_download_ranges(client):
+    data = bytes(range(256)) * 40
+    assert client.put("/upload/r.bin", content=data).status_code == 200
+
+    r = client.get("/download", params={"filename": "r.bin"}, headers={"Range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.content == data[100:200]
+    assert r.headers["content-range"] == f"bytes 100-199/{len(data)}"
+
+    r = client.get("/download", params={"filename": "r.bin"}, headers={"Range": "bytes=-10"})
+    assert r.content == data[-10:]
+
+    r = client.get("/download", params={"filename": "r.bin"}, headers={"Range": f"bytes={len(data)}-"})
+    assert r.status_code == 416
+
+    r = client.get("/download", params={"filename": "r.bin"}, headers={"Range": "bytes=0-1,10-11"})
+    assert r.status_code == 206
+    assert r.headers["content-type"].startswith("multipart/byteranges")
@@ -0,0 +1,92 @@
+import asyncio
+import os
+
+import pytest
+
+import compression
+from test_ingest import tar_of
+from test_sessions import CHUNK, start_session
+
+ENCODINGS = compression.SUPPORTED
+
+
+async def chunks_of(data, size=64 * 1024):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def decoded(data, encoding, size=64 * 1024):
+    async def collect():
+        return [piece async for piece in compression.decode(chunks_of(data, size), encoding)]
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_round_trip(encoding):
+    data = os.urandom(300 * 1024) + b"abc" * 500_000
+    assert b"".join(decoded(compression.compress(data, encoding), encoding, size=1000)) == data
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_pieces_are_bounded(encoding):
+    # Tens of KB that expand to 64MB
+    bomb = compression.compress(bytes(64 * 1024 * 1024), encoding)
+    assert len(bomb) < 100 * 1024
+    pieces = decoded(bomb, encoding)
+    assert max(map(len, pieces)) <= compression.DECODE_PIECE
+    assert sum(map(len, pieces)) == 64 * 1024 * 1024
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_truncated(encoding):
+    body = compression.compress(os.urandom(200 * 1024), encoding)
+    with pytest.raises(compression.DecodeError, match="Truncated"):
+        decoded(body[:-10], encoding)
+
+
+def test_upload_limit_counts_decoded_bytes(main, client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 4 * 1024 * 1024)
+    body = compression.compress(bytes(16 * 1024 * 1024), "gzip")
+    response = client.put("/upload/bomb.bin", content=body, headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+    assert client.get("/download", params={"filename": "bomb.bin"}).status_code == 404
+
+
+def test_ingest_limit_counts_decoded_bytes(main, client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 4 * 1024 * 1024)
+    body = compression.compress(tar_of({f"zeros{i}.bin": bytes(1024 * 1024) for i in range(16)}), "gzip")
+    response = client.post("/ingest", content=body, headers={
+        "Content-Type": "application/x-tar", "Content-Encoding": "gzip",
+    })
+    assert response.status_code == 413
+    # What came before the limit is stored and listed
+    assert response.json()["detail"]["uploaded"] == 3
+
+
+def test_session_chunk_limit_counts_decoded_bytes(client):
+    session_id, _ = start_session(client, bytes(CHUNK * 2))
+    body = compression.compress(bytes(64 * 1024 * 1024), "gzip")
+    response = client.put(f"/sessions/{session_id}/chunks/0", content=body, headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 400
+    assert "larger than" in response.json()["detail"]
+    good = compression.compress(bytes(CHUNK), "gzip")
+    assert client.put(f"/sessions/{session_id}/chunks/0", content=good, headers={"Content-Encoding": "gzip"}).status_code == 200
+
+
+def test_downloads_are_sent_raw_by_default(client, monkeypatch):
+    data = b"name,value\n" * 100_000
+    assert client.put("/upload/table.csv", content=data).status_code == 200
+    headers = {"Accept-Encoding": "gzip"}
+
+    response = client.get("/download", params={"filename": "table.csv"}, headers=headers)
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == str(len(data))
+
+    monkeypatch.setattr(compression, "COMPRESS_RESPONSES", True)
+    response = client.get("/download", params={"filename": "table.csv"}, headers=headers)
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == data
+
+    monkeypatch.setattr(compression, "COMPRESS_MAX_SIZE", len(data) - 1)
+    response = client.get("/download", params={"filename": "table.csv"}, headers=headers)
+    assert "content-encoding" not in response.headers
@@ -0,0 +1,49 @@
+import asyncio
+
+from content_cache import ContentCache
+
+
+class Body:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+BLOB = {"url": "memory:///objects/abc", "size": 30}
+
+
+def test_fill(tmp_path):
+    cache = ContentCache(tmp_path / "cache")
+    body = Body([b"a" * 10, b"b" * 10, b"c" * 10])
+
+    async def relay():
+        return b"".join([chunk async for chunk in cache.tee(BLOB, body)])
+
+    assert asyncio.run(relay()) == b"a" * 10 + b"b" * 10 + b"c" * 10
+    assert body.closed
+    assert cache.get(BLOB).read_bytes() == b"a" * 10 + b"b" * 10 + b"c" * 10
+
+
+def test_reader_gone_early(tmp_path):
+    cache = ContentCache(tmp_path / "cache")
+    body = Body([b"a" * 10, b"b" * 10, b"c" * 10])
+
+    async def relay():
+        relayed = cache.tee(BLOB, body)
+        assert await relayed.__anext__() == b"a" * 10
+        await relayed.aclose()
+
+    asyncio.run(relay())
+    assert body.closed
+    assert cache.get(BLOB) is None
+    assert list((tmp_path / "cache").iterdir()) == []
@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+from blob_index import object_pathname
+from conftest import finished
+from test_sessions import CHUNK, put_chunk, start_session
+
+
+def commit(client, name, data):
+    session_id, total = start_session(client, data, name)
+    for index in range(total):
+        assert put_chunk(client, session_id, data, index).status_code == 200
+    return finished(client, client.post(f"/sessions/{session_id}/commit"))
+
+
+def stored(main, sha256):
+    return main.storage.stat(object_pathname(sha256)) is not None
+
+
+def test_overwrite_deletes_unreferenced_object(main, client):
+    old, new = os.urandom(CHUNK * 2), os.urandom(CHUNK * 2)
+    old_sha = commit(client, "a.bin", old)["sha256"]
+    assert stored(main, old_sha) and main.content_store.object_chunks(old_sha)
+
+    commit(client, "a.bin", new)
+    assert not stored(main, old_sha)
+    assert main.content_store.object_chunks(old_sha) == []
+    assert stored(main, hashlib.sha256(new).hexdigest())
+    assert client.get("/download", params={"filename": "a.bin"}).content == new
+
+
+def test_overwrite_keeps_shared_object(main, client):
+    data = os.urandom(CHUNK + 10)
+    sha256 = commit(client, "a.bin", data)["sha256"]
+    commit(client, "b.bin", data)
+    commit(client, "a.bin", os.urandom(100))
+    assert stored(main, sha256)
+    assert client.get("/download", params={"filename": "b.bin"}).content == data
+
+
+def test_overwrite_with_same_content_keeps_object(main, client):
+    data = os.urandom(CHUNK)
+    sha256 = commit(client, "a.bin", data)["sha256"]
+    commit(client, "a.bin", data)
+    assert stored(main, sha256)
+    assert client.get("/download", params={"filename": "a.bin"}).content == data
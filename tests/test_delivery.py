@@ -0,0 +1,19 @@
+import os
+
+
+def test_browser_gets_the_file_name(main, client, monkeypatch):
+    monkeypatch.setattr(main.storage, "public_url", lambda blob: f"https://store.example/{blob['url'].split(':///')[1]}")
+    data = os.urandom(1000)
+    assert client.put("/upload/report.csv", content=data).status_code == 200
+    params = {"filename": "report.csv", "delivery": "redirect"}
+
+    response = client.get("/download", params=params, follow_redirects=False)
+    assert response.status_code == 307
+    assert "/objects/" in response.headers["location"]
+
+    # Sent to the hash-named object, a browser would save it under the hash
+    for headers in ({"Sec-Fetch-Mode": "navigate"}, {"Accept": "text/html,*/*;q=0.8"}):
+        response = client.get("/download", params=params, headers=headers, follow_redirects=False)
+        assert response.status_code == 200
+        assert response.headers["content-disposition"].endswith("_report.csv")
+        assert response.content == data
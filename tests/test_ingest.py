@@ -0,0 +1,47 @@
+import importlib
+import io
+import os
+import tarfile
+
+import pytest
+
+import ingest
+
+LIMIT = 64 * 1024
+
+
+@pytest.fixture
+def small_items(monkeypatch):
+    """ingest with INGEST_MAX_ITEM_BYTES lowered to LIMIT (it is read at import)."""
+    monkeypatch.setenv("INGEST_MAX_ITEM_BYTES", str(LIMIT))
+    importlib.reload(ingest)
+    yield
+    monkeypatch.delenv("INGEST_MAX_ITEM_BYTES")
+    importlib.reload(ingest)
+
+
+def tar_of(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_oversize_item_fails_alone(small_items, client):
+    files = {f"small{i}.bin": os.urandom(1000 + i) for i in range(3)}
+    files["big.bin"] = os.urandom(LIMIT + 1)
+    response = client.post("/ingest", content=tar_of(files), headers={"Content-Type": "application/x-tar"})
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert (result["uploaded"], result["failed"]) == (3, 1)
+
+    statuses = {item["name"]: item["status"] for item in result["files"]}
+    assert statuses["big.bin"] != "uploaded"
+    for name, data in files.items():
+        if name != "big.bin":
+            assert statuses[name] == "uploaded"
+            assert client.get("/download", params={"filename": name}).content == data
+    assert client.get("/download", params={"filename": "big.bin"}).status_code == 404
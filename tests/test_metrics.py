@@ -0,0 +1,72 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, PlainTextResponse
+from starlette.routing import Route
+
+import metrics
+
+
+def sample(metric, *labels):
+    return dict(metric._samples()).get(labels, 0)
+
+
+def call(app, path, extensions=None):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [], "client": ("127.0.0.1", 1), "server": ("test", 80),
+        "extensions": extensions or {},
+    }
+    asyncio.run(app(scope, receive, send))
+    return messages
+
+
+def make_app(path):
+    routes = [
+        Route("/items/{item_id}", lambda request: PlainTextResponse("x" * 10)),
+        Route("/file", lambda request: FileResponse(path)),
+    ]
+    app = Starlette(routes=routes)
+    app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+
+def test_labels_by_route_template(tmp_path):
+    app = make_app(tmp_path / "f")
+    before = sample(metrics.response_bytes, "/items/{item_id}")
+    call(app, "/items/1")
+    call(app, "/items/2")
+    assert sample(metrics.response_bytes, "/items/{item_id}") - before == 20
+
+    unmatched = sample(metrics.response_bytes, "unmatched")
+    call(app, "/nothing/here")
+    assert sample(metrics.response_bytes, "unmatched") > unmatched
+    assert sample(metrics.requests_in_flight) == 0
+
+
+def test_pathsend_is_counted(tmp_path):
+    path = tmp_path / "f"
+    path.write_bytes(b"y" * 1234)
+    app = make_app(path)
+    before = sample(metrics.response_bytes, "/file")
+    messages = call(app, "/file", extensions={"http.response.pathsend": {}})
+    assert messages[-1]["type"] == "http.response.pathsend"
+    assert sample(metrics.response_bytes, "/file") - before == 1234
+
+
+def test_reload_does_not_duplicate_metrics(main):
+    import importlib
+    importlib.reload(main)
+    names = [line.split()[2] for line in metrics.render().splitlines() if line.startswith("# TYPE")]
+    assert len(names) == len(set(names))
+    # The gauges read the reloaded module's state
+    assert metrics._metrics["finalize_jobs_pending"].function == main.finalize_jobs.pending
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import finished
+from jobs import JobQueue
+
+CHUNK = 64 * 1024
+
+
+def start_session(client, data, name="s.bin", **extra):
+    total = -(-len(data) // CHUNK)
+    response = client.post("/sessions", json={
+        "fileName": name, "totalChunks": total, "chunkSize": CHUNK, "fileSize": len(data), **extra,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["sessionId"], total
+
+
+def put_chunk(client, session_id, data, index):
+    return client.put(f"/sessions/{session_id}/chunks/{index}", content=data[index * CHUNK:(index + 1) * CHUNK])
+
+
+def test_commit_out_of_order(client):
+    data = os.urandom(CHUNK * 5 + 100)
+    session_id, total = start_session(client, data)
+    for index in (3, 0, 5, 1, 4, 2):
+        assert put_chunk(client, session_id, data, index).status_code == 200
+
+    result = finished(client, client.post(f"/sessions/{session_id}/commit"))
+    assert result["sha256"] == hashlib.sha256(data).hexdigest()
+    assert client.get("/download", params={"filename": "s.bin"}).content == data
+    # The session is gone once committed
+    assert client.get(f"/sessions/{session_id}").status_code == 404
+
+
+def test_repeated_commit_gets_the_same_job(client):
+    data = os.urandom(CHUNK * 2)
+    session_id, total = start_session(client, data)
+    for index in range(total):
+        put_chunk(client, session_id, data, index)
+    first = client.post(f"/sessions/{session_id}/commit")
+    result = finished(client, first)
+
+    # The answer was lost, say; the session is gone but its job is not
+    again = client.post(f"/sessions/{session_id}/commit")
+    assert again.status_code == 202
+    assert again.json()["jobId"] == first.json()["jobId"]
+    assert finished(client, again) == result
+
+
+def test_commit_with_missing_chunks(client):
+    data = os.urandom(CHUNK * 3)
+    session_id, _ = start_session(client, data)
+    put_chunk(client, session_id, data, 0)
+    response = client.post(f"/sessions/{session_id}/commit")
+    assert response.status_code == 400
+    assert response.json()["detail"]["missing"] == [1, 2]
+
+
+def test_commit_rejects_wrong_declared_hash(client):
+    data = os.urandom(CHUNK + 1)
+    session_id, _ = start_session(client, data, sha256="0" * 64)
+    put_chunk(client, session_id, data, 0)
+    put_chunk(client, session_id, data, 1)
+    response = client.post(f"/sessions/{session_id}/commit")
+    job = client.get(response.json()["statusUrl"], params={"wait": 30}).json()
+    assert job["status"] == "failed"
+    assert job["error"]["code"] == "BadDigest"
+    assert client.get("/download", params={"filename": "s.bin"}).status_code == 404
+
+
+def test_resent_chunk_replaces_bytes(client):
+    data = os.urandom(CHUNK * 2)
+    session_id, _ = start_session(client, data)
+    client.put(f"/sessions/{session_id}/chunks/0", content=b"x" * CHUNK)
+    put_chunk(client, session_id, data, 1)
+    put_chunk(client, session_id, data, 0)
+    result = finished(client, client.post(f"/sessions/{session_id}/commit"))
+    assert result["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_submit_needs_a_started_queue():
+    with pytest.raises(RuntimeError, match="not running"):
+        JobQueue().submit("session", None)
+
+    async def run():
+        queue = JobQueue(workers=1)
+        queue.start()
+
+        async def work(job):
+            return {"ok": True}
+
+        job = queue.submit("session", work)
+        await job.wait(5)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(run())
+    assert job.status == "completed" and job.result == {"ok": True}
+
+
+def test_job_key_expires_with_job():
+    async def run():
+        queue = JobQueue(workers=1, ttl=0)
+        queue.start()
+
+        async def work(job):
+            return {}
+
+        job = queue.submit("session", work, key=("session", "abc"))
+        assert queue.find(("session", "abc")) is job
+        await job.wait(5)
+        await asyncio.sleep(0.01)
+        queue.expire()
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert queue.find(("session", "abc")) is None
+    assert queue._keys == {}
+
+
+def test_resend_during_inline_chunk(client, main):
+    # Chunk 1 is hashed inline onto a copy of the digest of chunk 0; if chunk
+    # 0 is resent with other bytes meanwhile, that copy must be thrown away
+    a0, a1, b0 = os.urandom(CHUNK), os.urandom(CHUNK), os.urandom(CHUNK)
+    session_id, _ = start_session(client, a0 + a1)
+    assert put_chunk(client, session_id, a0 + a1, 0).status_code == 200
+    session = main.chunk_sessions.get(session_id)
+    gate = threading.Event()
+    path = f"/sessions/{session_id}/chunks/1"
+    pieces = [a1[:CHUNK // 2], a1[CHUNK // 2:]]
+    messages = []
+
+    async def receive():
+        if len(pieces) == 1:
+            while not gate.is_set():
+                await asyncio.sleep(0.01)
+        data = pieces.pop(0)
+        return {"type": "http.request", "body": data, "more_body": bool(pieces)}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "PUT",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-length", str(CHUNK).encode())], "client": ("127.0.0.1", 1), "server": ("test", 80),
+    }
+    slow = client.portal.start_task_soon(main.app, scope, receive, send)
+    while not session.writing[1]:
+        time.sleep(0.01)
+    assert put_chunk(client, session_id, b0 + a1, 0).status_code == 200
+    gate.set()
+    slow.result(10)
+    assert messages[0]["status"] == 200
+
+    result = finished(client, client.post(f"/sessions/{session_id}/commit"))
+    assert result["sha256"] == hashlib.sha256(b0 + a1).hexdigest()
+    assert client.get("/download", params={"filename": "s.bin"}).content == b0 + a1
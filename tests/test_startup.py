@@ -0,0 +1,15 @@
+from fastapi.testclient import TestClient
+
+
+def test_import_touches_no_files(main, tmp_path):
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_state_is_created_on_first_use(main, tmp_path):
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        assert client.put("/upload/a.txt", content=b"hello").status_code == 200
+        response = client.post("/sessions", json={"fileName": "b.bin", "totalChunks": 1, "chunkSize": 5, "fileSize": 5})
+        assert response.status_code == 200
+        assert client.get("/download", params={"filename": "a.txt"}).content == b"hello"
+    assert (tmp_path / "uploads" / "sessions").is_dir()
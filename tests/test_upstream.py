@@ -0,0 +1,97 @@
+import asyncio
+
+import httpx
+import pytest
+
+import upstream
+from blob_api import BlobApiError
+
+
+def governor(**kwargs):
+    return upstream.Governor(limits={}, **{"retries": 2, "backoff": 0, **kwargs})
+
+
+class Flaky:
+    """Fails with each of `errors` in turn, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.mark.parametrize("error, expected", [
+    (BlobApiError("busy", 503), True),
+    (BlobApiError("slow down", 429), True),
+    (BlobApiError("not found", 404), False),
+    (Exception("Blob API PUT / failed (status 502): bad gateway"), True),
+    (TimeoutError(), True),
+    (httpx.ConnectError("refused"), True),
+    (ValueError("bad input"), False),
+])
+def test_transient(error, expected):
+    assert upstream.transient(error) is expected
+
+
+def test_idempotent_call_is_retried():
+    fn = Flaky(BlobApiError("busy", 503), httpx.ReadTimeout("slow"))
+    assert governor().call("put", fn) == "ok"
+    assert fn.calls == 3
+
+
+def test_retries_are_bounded():
+    fn = Flaky(*[BlobApiError("busy", 503)] * 5)
+    with pytest.raises(BlobApiError):
+        governor().call("put", fn)
+    assert fn.calls == 3
+
+
+def test_final_answer_is_not_retried():
+    fn = Flaky(BlobApiError("forbidden", 403))
+    with pytest.raises(BlobApiError):
+        governor().call("put", fn)
+    assert fn.calls == 1
+
+
+@pytest.mark.parametrize("op", ["mpu_create", "mpu_complete"])
+def test_non_idempotent_call_is_sent_once(op):
+    fn = Flaky(BlobApiError("busy", 503))
+    with pytest.raises(BlobApiError):
+        governor().call(op, fn)
+    assert fn.calls == 1
+
+
+def test_async_call_is_retried():
+    fn = Flaky(BlobApiError("busy", 500))
+
+    async def call():
+        return fn()
+
+    assert asyncio.run(governor().call_async("mpu_part", call)) == "ok"
+    assert fn.calls == 2
+
+
+def test_circuit_opens_after_failures():
+    g = governor(retries=0)
+    g._operation("list").breaker.failures = 2
+    for _ in range(2):
+        with pytest.raises(BlobApiError):
+            g.call("list", Flaky(BlobApiError("busy", 503)))
+    fn = Flaky()
+    with pytest.raises(upstream.CircuitOpen):
+        g.call("list", fn)
+    assert fn.calls == 0
+
+
+def test_full_queue_is_refused():
+    slots = upstream.Slots(1, max_queue=0)
+    slots.acquire(1)
+    with pytest.raises(upstream.Overloaded):
+        slots.acquire(1)
+    slots.release()
+    slots.acquire(1)
@@ -0,0 +1,390 @@
+import asyncio
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# Per-operation concurrency, e.g. UPSTREAM_LIMITS="put=32,get=128"
+DEFAULT_LIMITS = {
+    "get": 64, "head": 32, "list": 8, "put": 16, "delete": 8, "copy": 8,
+    "mpu_create": 8, "mpu_part": 32, "mpu_complete": 8,
+}
+DEFAULT_LIMIT = 16
+# Safe to send twice: every write goes to a fixed pathname with the same
+# bytes. A repeated mpu_create would leave an orphaned upload, and an
+# mpu_complete that got through before its answer was lost fails when sent
+# again, turning a finished upload into an error.
+IDEMPOTENT = {"get", "head", "list", "put", "delete", "copy", "mpu_part"}
+
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 30))  # seconds per Blob API call
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 3))
+UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", 0.2))  # seconds, doubled on every retry
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", 5))
+UPSTREAM_RATE = float(os.getenv("UPSTREAM_RATE", 0))  # calls per second over all operations; 0 = no limit
+UPSTREAM_BURST = int(os.getenv("UPSTREAM_BURST", 50))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", 256))  # waiting calls per operation
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", 10))
+BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", 10))  # in a row, to open the circuit
+BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", 15))
+
+_STATUS = re.compile(r"status (\d{3})")
+
+
+class Overloaded(Exception):
+    """The call was not sent: its queue is full, it waited too long, or the
+    circuit is open. Answer 503 and have the client come back after
+    `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=1, reason="queue_full"):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class CircuitOpen(Overloaded):
+    def __init__(self, message, retry_after=1):
+        super().__init__(message, retry_after, "circuit_open")
+
+
+def parse_limits(value):
+    limits = dict(DEFAULT_LIMITS)
+    for item in (value or "").split(","):
+        op, _, limit = item.partition("=")
+        if op.strip() and limit.strip().isdigit():
+            limits[op.strip()] = max(1, int(limit))
+    return limits
+
+
+def transient(error):
+    """Whether a failed call is worth retrying, and counts against the
+    circuit: timeouts, dropped connections, 408, 429 and 5xx. Any other
+    answer means the store is up and said no."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        match = _STATUS.search(str(error))
+        if match:
+            status = int(match.group(1))
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Only check the HTTP libraries that are loaded; see http_client
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    return False
+
+
+class _Waiter:
+    def __init__(self, loop=None):
+        self.granted = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    def wake(self):
+        """False if the waiter's event loop is gone and it never will be."""
+        if self._loop is None:
+            self._event.set()
+            return True
+        try:
+            self._loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            return False
+        return True
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Slots:
+    """A semaphore that threads and coroutines can both wait on, first come
+    first served, with a bounded queue. Storage calls come from worker
+    threads (put/list/delete) and from the event loop (reads, multipart
+    parts), and both count against the same limit."""
+
+    def __init__(self, limit, max_queue=UPSTREAM_MAX_QUEUE):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _enter(self, waiter):
+        """Take a free slot (True), or queue `waiter` for one (False)."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            raise Overloaded(f"{len(self._waiters)} calls already waiting", 1, "queue_full")
+        self._waiters.append(waiter)
+        return False
+
+    def _give_up(self, waiter):
+        """Leave the queue after a timeout; False if a slot was handed over
+        in the meantime, which the caller then owns."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def acquire(self, timeout):
+        waiter = _Waiter()
+        with self._lock:
+            if self._enter(waiter):
+                return
+        if not waiter.wait(timeout) and self._give_up(waiter):
+            raise Overloaded(f"No free slot within {timeout:g}s", timeout, "queue_timeout")
+
+    async def acquire_async(self, timeout):
+        waiter = _Waiter(asyncio.get_running_loop())
+        with self._lock:
+            if self._enter(waiter):
+                return
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            if self._give_up(waiter):
+                raise Overloaded(f"No free slot within {timeout:g}s", timeout, "queue_timeout")
+        except asyncio.CancelledError:
+            if not self._give_up(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self.active -= 1
+                    return
+                # The slot passes straight to the next waiter; active is unchanged
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+            if waiter.wake():
+                return
+
+
+class TokenBucket:
+    """`rate` calls per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """Take a token; returns how long to wait before using it. Raises
+        Overloaded instead if that would be longer than `max_wait`."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                raise Overloaded(f"Over {self.rate:g} upstream calls per second", wait, "rate")
+            self._tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    """Fails calls fast once `failures` in a row went wrong, for `cooldown`
+    seconds; then lets one probe through, whose outcome closes or reopens it."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                left = self._opened_at + self.cooldown - now
+                if left > 0:
+                    raise CircuitOpen("Storage is failing; circuit open", retry_after=left)
+                self.state = self.HALF_OPEN
+            elif self.state == self.HALF_OPEN and now - self._probe_at < self.cooldown:
+                # One probe at a time; another only if that one never reported
+                raise CircuitOpen("Storage is failing; waiting on a probe", retry_after=1)
+            if self.state == self.HALF_OPEN:
+                self._probe_at = now
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self._failed = 0
+                self.state = self.CLOSED
+                return
+            self._failed += 1
+            if self.state == self.HALF_OPEN or self._failed >= self.failures:
+                if self.state != self.OPEN:
+                    print(f"Warning: upstream circuit opened after {self._failed} failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class _Operation:
+    def __init__(self, name, limit):
+        self.name = name
+        self.slots = Slots(limit)
+        self.breaker = CircuitBreaker()
+
+
+queue_wait = metrics.Histogram(
+    "upstream_queue_wait_seconds", "Time storage calls waited for a rate token and a free slot.", ("op",),
+)
+retries = metrics.Counter("upstream_retries_total", "Storage calls sent again after a transient failure.", ("op",))
+rejected = metrics.Counter("upstream_rejected_total", "Storage calls refused without being sent.", ("op", "reason"))
+
+
+class Governor:
+    """One scheduler for every call to the blob store: a concurrency limit
+    and circuit breaker per operation, a token bucket shared by all of them,
+    and retries with exponential backoff and full jitter for idempotent
+    operations. Calls that cannot be admitted in time raise Overloaded
+    instead of piling up."""
+
+    def __init__(self, limits=None, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, retries=UPSTREAM_RETRIES,
+                 backoff=UPSTREAM_BACKOFF, backoff_max=UPSTREAM_BACKOFF_MAX, queue_timeout=UPSTREAM_QUEUE_TIMEOUT):
+        self.limits = limits if limits is not None else parse_limits(os.getenv("UPSTREAM_LIMITS"))
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def _operation(self, op):
+        operation = self._operations.get(op)
+        if operation is None:
+            with self._lock:
+                operation = self._operations.setdefault(op, _Operation(op, self.limits.get(op, DEFAULT_LIMIT)))
+        return operation
+
+    def _delay(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+    def _check(self, operation):
+        """Breaker and rate token; returns how long to wait for the token."""
+        try:
+            operation.breaker.check()
+            return self.bucket.reserve(self.queue_timeout) if self.bucket is not None else 0.0
+        except Overloaded as e:
+            rejected.inc(operation.name, e.reason)
+            raise
+
+    def _settle(self, operation, error, attempt):
+        """Record how a call went; True if it should be sent again."""
+        failed = error is not None and transient(error)
+        operation.breaker.record(not failed)
+        if not failed or operation.name not in IDEMPOTENT or attempt >= self.retries:
+            return False
+        retries.inc(operation.name)
+        return True
+
+    def call(self, op, fn, *args, **kwargs):
+        """fn(*args, **kwargs) as storage operation `op`, blocking; for
+        code already running in a worker thread."""
+        operation = self._operation(op)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            time.sleep(self._check(operation))
+            try:
+                operation.slots.acquire(self.queue_timeout)
+            except Overloaded as e:
+                rejected.inc(op, e.reason)
+                raise
+            queue_wait.observe(time.perf_counter() - started, op)
+            try:
+                with metrics.upstream(op):
+                    result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self._settle(operation, e, attempt):
+                    raise
+            else:
+                operation.breaker.record(True)
+                return result
+            finally:
+                operation.slots.release()
+            time.sleep(self._delay(attempt))
+            attempt += 1
+
+    async def call_async(self, op, fn, *args, **kwargs):
+        """await fn(*args, **kwargs) as storage operation `op`. Waiting for
+        a slot does not hold a thread."""
+        operation = self._operation(op)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            wait = self._check(operation)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                await operation.slots.acquire_async(self.queue_timeout)
+            except Overloaded as e:
+                rejected.inc(op, e.reason)
+                raise
+            queue_wait.observe(time.perf_counter() - started, op)
+            try:
+                with metrics.upstream(op):
+                    result = await fn(*args, **kwargs)
+            except Exception as e:
+                if not self._settle(operation, e, attempt):
+                    raise
+            else:
+                operation.breaker.record(True)
+                return result
+            finally:
+                operation.slots.release()
+            await asyncio.sleep(self._delay(attempt))
+            attempt += 1
+
+    def stats(self):
+        return {
+            op: {
+                "limit": operation.slots.limit,
+                "inFlight": operation.slots.active,
+                "queued": operation.slots.queued,
+                "circuit": operation.breaker.state,
+            }
+            for op, operation in sorted(self._operations.items())
+        }
+
+
+governor = Governor()
+call = governor.call
+call_async = governor.call_async
+
+metrics.Gauge("upstream_queue_depth", "Storage calls waiting for a free slot.", ("op",),
+              function=lambda: {(op,): s["queued"] for op, s in governor.stats().items()})
+metrics.Gauge("upstream_in_flight", "Storage calls being sent.", ("op",),
+              function=lambda: {(op,): s["inFlight"] for op, s in governor.stats().items()})
+metrics.Gauge("upstream_circuit_open", "1 while an operation's circuit is open or probing.", ("op",),
+              function=lambda: {(op,): int(s["circuit"] != CircuitBreaker.CLOSED) for op, s in governor.stats().items()})
@@ -1,73 +1,161 @@
-# import requests
-# import time
-
-# BASE_URL = "http://localhost:8000"
-
-# def test_chunked_upload():
-#     print("Testing Chunked Upload...")
-    
-#     # 1. Start
-#     payload_start = {
-#         "text": "Part 1: Start of the file.\n",
-#         "isStarted": True,
-#         "isCompleted": False
-#     }
-#     r = requests.post(f"{BASE_URL}/test", json=payload_start)
-#     print(f"Start: {r.status_code} - {r.json()}")
-#     assert r.status_code == 200
-
-#     # 2. Append
-#     payload_mid = {
-#         "text": "Part 2: Middle of the file.\n",
-#         "isStarted": False,
-#         "isCompleted": False
-#     }
-#     r = requests.post(f"{BASE_URL}/test", json=payload_mid)
-#     print(f"Append: {r.status_code} - {r.json()}")
-#     assert r.status_code == 200
-
-#     # 3. Complete
-#     payload_end = {
-#         "text": "Part 3: End of the file.",
-#         "isStarted": False,
-#         "isCompleted": True
-#     }
-#     r = requests.post(f"{BASE_URL}/test", json=payload_end)
-#     print(f"Complete: {r.status_code} - {r.json()}")
-#     assert r.status_code == 200
-    
-#     blob_url = r.json().get("url")
-#     print(f"Blob URL: {blob_url}")
-#     return blob_url
-
-# def test_latest_download(expected_url):
-#     print("\nTesting Latest Download...")
-#     # Allow some time for eventual consistency if needed, though usually fast
-#     time.sleep(2) 
-    
-#     r = requests.get(f"{BASE_URL}/latest", allow_redirects=False)
-#     print(f"Latest Redirect Status: {r.status_code}")
-    
-#     if r.status_code == 307:
-#         location = r.headers['Location']
-#         print(f"Redirect Location: {location}")
-#         # Note: The URL might be slightly different (e.g. query params) but base should match
-#         # or we can just fetch the content and verify it matches
-        
-#         content_r = requests.get(location)
-#         print(f"Content: {content_r.text}")
-#         assert "Part 1" in content_r.text
-#         assert "Part 3" in content_r.text
-#     else:
-#         print("Did not redirect as expected (307).")
-#         # If it followed redirect automatically (if allow_redirects=True default)
-#         # requests.get follows by default, but I set False above.
-#         pass
-
-# if __name__ == "__main__":
-#     try:
-#         url = test_chunked_upload()
-#         test_latest_download(url)
-#         print("\nSUCCESS: All tests passed!")
-#     except Exception as e:
-#         print(f"\nFAILURE: {e}")
+"""Check that a stored file is intact without downloading it.
+
+The server hashes byte ranges of the stored object on request (GET
+/checksum), so a few random samples cover the object at a fraction of a
+download:
+
+    python verify_upload.py report.csv                 # against the local copy
+    python verify_upload.py --name report.csv          # against the chunk hashes recorded at upload
+    python verify_upload.py report.csv --samples 32 --sample-size 1048576
+
+With a local file its SHA-256 must match the digest the server reports,
+and every sampled range must hash the same on both ends. Without one, the
+sampled ranges are chunks whose hashes were recorded when the file was
+uploaded. Exits 0 when everything matches, 1 on a mismatch, 2 on errors.
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+
+import requests
+
+BASE_URL = "http://localhost:8000"
+SAMPLES = 16
+SAMPLE_SIZE = 256 * 1024
+RANGES_PER_REQUEST = 16  # the server's limit
+HASH_READ_SIZE = 4 * 1024 * 1024
+
+
+class VerifyError(Exception):
+    pass
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(HASH_READ_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def hash_local_range(f, start, end):
+    f.seek(start)
+    return hashlib.sha256(f.read(end - start + 1)).hexdigest()
+
+
+def sample_ranges(size, samples, sample_size, rng):
+    """Random, possibly overlapping (start, end) ranges; the first and last
+    bytes are always covered."""
+    if size == 0:
+        return []
+    length = min(sample_size, size)
+    starts = {0, size - length}
+    while len(starts) < min(samples, size - length + 1):
+        starts.add(rng.randrange(0, size - length + 1))
+    return [(start, start + length - 1) for start in sorted(starts)]
+
+
+def remote_checksums(session, base_url, name, ranges=(), chunks=False):
+    """The server's /checksum answer, asking for at most RANGES_PER_REQUEST
+    ranges at a time; "ranges" holds all of them."""
+    ranges = list(ranges)
+    result, hashed = None, []
+    for i in range(0, max(len(ranges), 1), RANGES_PER_REQUEST):
+        params = {"filename": name}
+        batch = ranges[i:i + RANGES_PER_REQUEST]
+        if batch:
+            params["ranges"] = ",".join(f"{start}-{end}" for start, end in batch)
+        if chunks and result is None:
+            params["chunks"] = "true"
+        r = session.get(f"{base_url}/checksum", params=params, timeout=(10, 300))
+        if r.status_code == 404:
+            raise VerifyError(f"'{name}' is not on the server")
+        if r.status_code != 200:
+            raise VerifyError(f"/checksum returned {r.status_code}: {r.text[:200]}")
+        answer = r.json()
+        hashed += answer.get("ranges", [])
+        result = result or answer
+    result["ranges"] = hashed
+    return result
+
+
+def verify(local_path=None, name=None, base_url=BASE_URL, samples=SAMPLES, sample_size=SAMPLE_SIZE,
+           seed=None, session=None):
+    """Compare a stored file with a local copy or its recorded chunk hashes.
+    Returns a report; "ok" is False when anything differs."""
+    name = name or os.path.basename(local_path)
+    rng = random.Random(seed)
+    session = session or requests.Session()
+    mismatches = []
+
+    info = remote_checksums(session, base_url, name, chunks=local_path is None)
+    size = info["size"]
+    if local_path is not None:
+        local_size = os.path.getsize(local_path)
+        if local_size != size:
+            mismatches.append(f"size: server has {size} bytes, local file {local_size}")
+        local_sha256 = hash_file(local_path)
+        if info.get("sha256") and info["sha256"] != local_sha256:
+            mismatches.append(f"sha256: server has {info['sha256']}, local file {local_sha256}")
+        ranges = sample_ranges(min(size, local_size), samples, sample_size, rng)
+        hashed = remote_checksums(session, base_url, name, ranges)["ranges"]
+        with open(local_path, "rb") as f:
+            for item in hashed:
+                expected = hash_local_range(f, item["start"], item["end"])
+                if item["sha256"] != expected:
+                    mismatches.append(f"bytes {item['start']}-{item['end']}: server {item['sha256']}, local {expected}")
+    else:
+        recorded = info.get("chunks") or []
+        if not recorded:
+            print("No chunk hashes were recorded for this file; only its digest can be reported.")
+        picked = rng.sample(recorded, min(samples, len(recorded)))
+        ranges = [(c["offset"], c["offset"] + c["length"] - 1) for c in picked]
+        hashed = remote_checksums(session, base_url, name, ranges)["ranges"]
+        for chunk, item in zip(picked, hashed):
+            if item["sha256"] != chunk["sha256"]:
+                mismatches.append(f"chunk at {chunk['offset']}: stored bytes hash {item['sha256']}, "
+                                  f"recorded {chunk['sha256']}")
+
+    checked = sum(end - start + 1 for start, end in ranges)
+    return {
+        "name": name,
+        "size": size,
+        "sha256": info.get("sha256"),
+        "ranges": len(ranges),
+        "bytesChecked": checked,
+        "mismatches": mismatches,
+        "ok": not mismatches,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify a stored file by sampling hashes of byte ranges.")
+    parser.add_argument("file", nargs="?", help="local copy to compare against")
+    parser.add_argument("--name", help="name on the server (default: the local file's name)")
+    parser.add_argument("--url", default=BASE_URL, help=f"server base URL (default {BASE_URL})")
+    parser.add_argument("--samples", type=int, default=SAMPLES, help="ranges to check")
+    parser.add_argument("--sample-size", type=int, default=SAMPLE_SIZE, help="bytes per range")
+    parser.add_argument("--seed", type=int, help="seed for picking ranges, to repeat a run")
+    args = parser.parse_args(argv)
+    if not args.file and not args.name:
+        parser.error("give a local file, --name, or both")
+
+    try:
+        report = verify(args.file, args.name, args.url, args.samples, args.sample_size, args.seed)
+    except (VerifyError, OSError, requests.exceptions.RequestException) as e:
+        print(f"Error verifying: {e}")
+        return 2
+
+    print(f"'{report['name']}': {report['size']} bytes, sha256 {report['sha256']}")
+    print(f"Checked {report['ranges']} ranges ({report['bytesChecked']} bytes, "
+          f"{100 * report['bytesChecked'] / report['size'] if report['size'] else 100:.1f}% of the file)")
+    for mismatch in report["mismatches"]:
+        print(f"MISMATCH {mismatch}")
+    print("OK" if report["ok"] else "FAILED")
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())